@@ -2,6 +2,7 @@
 
 """This is the beerapi package"""
 
+import mongoengine
 from flask import Flask
 from flask_mongoengine import MongoEngine
 
@@ -13,7 +14,58 @@ app = Flask(__package__, instance_relative_config=True)
 app.config.from_object('beerpi.settings')
 #app.config.from_pyfile('settings.cfg')
 
-db = MongoEngine(app)
+# a site can override any of the settings in a file named by BEERPI_SETTINGS
+app.config.from_envvar('BEERPI_SETTINGS', silent=True)
 
-blueprints.find(app)
+# the documents are declared on this at import, but the connection is only
+# set up by `connect` or `create_app`
+db = MongoEngine()
 
+_state = {
+    'connected': False,
+    'created': False,
+}
+
+
+def connect():
+    """Sets up the database connection of the app, unless it has been.  With
+    `connect` off in MONGODB_SETTINGS nothing is sent to mongo until the first
+    query."""
+
+    if not _state['connected']:
+        db.init_app(app)
+        _state['connected'] = True
+
+
+def reconnect():
+    """Replaces the database connection with a new one.  A forked process has
+    to do this since the connection it inherits can't be shared."""
+
+    mongoengine.connection.disconnect()
+    db.init_app(app)
+    _state['connected'] = True
+
+
+def create_app():
+    """Registers the blueprints, metrics and slow query log on the app, sets
+    up its connection and creates any missing index if ENSURE_INDEXES is set.
+    Returns the app, which is only set up the first time."""
+
+    if _state['created']:
+        return app
+
+    blueprints.register(app)
+
+    # the command listeners only hear the clients made after them
+    if _state['connected']:
+        reconnect()
+    else:
+        connect()
+
+    if app.config['ENSURE_INDEXES']:
+        from beerpi import indexes
+        indexes.ensure()
+
+    _state['created'] = True
+
+    return app
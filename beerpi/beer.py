@@ -2,16 +2,29 @@
 
 import flask
 import mongoengine
+from bson import ObjectId, json_util
+from pymongo import UpdateOne
 
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
-from beerpi import db
+from beerpi import app, bulk, db, search
 from beerpi.brewery import Brewery
+from beerpi.fields import select
 from beerpi.glasses import Glass
-from beerpi.json import JSONResponse
+from beerpi.json import JSONList, JSONResponse
+from beerpi.serialize import encoder
 from beerpi.sort import get_sort_keys
+from beerpi.update import get_update, missing, modify
 from beerpi.users import User, login_required
+from beerpi.version import bump, conditional
+
+# the beers that are ranked on the leaderboards
+RANKED = {'rating_count': {'$gte': app.config['TOP_MIN_REVIEWS']}}
+
+# the beers that are ranked by how many users favorited them
+POPULAR = {'favorites': {'$gt': 0}}
+
 
 class Beer(db.Document):
     name = db.StringField(unique=True)
@@ -24,27 +37,215 @@ class Beer(db.Document):
 
     rating = db.DecimalField(precision=2)
 
+    # the totals of the overall score of every review, which the rating is
+    # derived from.  the sum is kept in hundredths so it's a whole number,
+    # which adds up the same in whatever order the reviews are counted
+    rating_sum = db.IntField(default=0)
+    rating_count = db.IntField(default=0)
+
+    # the rating pulled towards TOP_PRIOR_MEAN as if it had TOP_PRIOR_WEIGHT
+    # more reviews, which is what the leaderboard ranks by
+    score = db.FloatField()
+
+    # the number of users who favorited the beer, kept up to date as the
+    # favorites are added, changed and removed
+    favorites = db.IntField(default=0)
+
     added_by = db.ReferenceField(User, reverse_delete_rule=db.DENY)
 
+    meta = {
+        'indexes': [
+            # the sorts of the list, with the id pages are split on
+            ('ibu', 'id'),
+            ('calories', 'id'),
+            ('abv', 'id'),
+            ('style', 'id'),
+            ('rating', 'id'),
+
+            # the filters by style and brewery, sorted by the properties
+            # they're most often sorted by when filtered
+            ('style', 'rating', 'id'),
+            ('style', 'abv', 'id'),
+            ('brewery', 'id'),
+            ('brewery', 'rating', 'id'),
+
+            # the leaderboards overall and by style, which only hold the
+            # beers with enough reviews to be ranked
+            {'fields': ('-score', 'id'), 'partialFilterExpression': RANKED},
+            {'fields': ('style', '-score', 'id'), 'partialFilterExpression': RANKED},
+            {'fields': ('-rating', 'id'), 'partialFilterExpression': RANKED},
+            {'fields': ('style', '-rating', 'id'), 'partialFilterExpression': RANKED},
+
+            # the most favorited beers overall and by style, which only hold
+            # the beers favorited at all
+            {'fields': ('-favorites', 'id'), 'partialFilterExpression': POPULAR},
+            {'fields': ('style', '-favorites', 'id'), 'partialFilterExpression': POPULAR},
+
+            # the reverse_delete_rule checks of the referenced documents,
+            # the brewery is covered by the filter indexes
+            'glass',
+            'added_by',
+        ]
+    }
+
+
+def hundredths(overall):
+    """Returns an overall score as it is stored, rounded to two places, as
+    the whole number of hundredths the rating totals are kept in"""
+
+    return int(round(float(overall) * 100))
+
+
+def rate(beer, overall, count):
+    """Adds the given hundredths of an overall score and number of reviews
+    to the totals of the given beer in one atomic update, then derives the
+    rating and the score it is ranked by from the new totals.
+    """
+
+    totals = Beer.objects(id=beer.id).only('rating_sum', 'rating_count') \
+                 .modify(new=True, inc__rating_sum=overall, inc__rating_count=count)
+
+    if totals is None:
+        return
+
+    rating, score = ratings(totals.rating_sum, totals.rating_count)
+
+    # if another review came in since our update, the rating is left for it
+    # to set from the newer totals
+    Beer.objects(id=beer.id,
+                 rating_sum=totals.rating_sum,
+                 rating_count=totals.rating_count).update_one(set__rating=rating,
+                                                              set__score=score)
+
+
+def correct(updates):
+    """Writes the given updates of single beers, as pairs of an id and an
+    update, in one unordered batch and bumps the versions of the beers so
+    their tags and cached responses are refreshed.  Returns their ids."""
+
+    if len(updates) == 0:
+        return []
+
+    Beer._get_collection().bulk_write([UpdateOne({'_id': id}, update)
+                                       for id, update in updates], ordered=False)
+
+    ids = [id for id, _ in updates]
+    bump('beer', *['beer:{}'.format(id) for id in ids])
+
+    return ids
+
+
+def ratings(total, count):
+    """Returns the rating and the score of a beer with the given total of
+    the overall scores of its reviews, in hundredths, and number of reviews.
+    The rating is rounded the way its field stores it."""
+
+    if count == 0:
+        return None, None
+
+    mean = app.config['TOP_PRIOR_MEAN']
+    weight = app.config['TOP_PRIOR_WEIGHT']
+
+    rating = Beer.rating.to_mongo(total / count / 100)
+
+    return rating, (mean * weight + total / 100) / (weight + count)
+
+
+# the properties the beer list can be sorted by
+SORTABLE = ['name', 'ibu', 'calories', 'abv', 'style', 'rating']
+
+# the properties the beers can be limited to with `fields`
+SELECTABLE = SORTABLE + ['score', 'rating_count', 'favorites', 'brewery', 'glass',
+                         'added_by']
+
+# the arguments the beer list can be filtered with, and the property and
+# operator each of them matches with
+FILTERABLE = {
+    'style': ('style', None),
+    'brewery': ('brewery', None),
+    'glass': ('glass', None),
+    'abv_min': ('abv', '$gte'),
+    'abv_max': ('abv', '$lte'),
+    'ibu_min': ('ibu', '$gte'),
+    'ibu_max': ('ibu', '$lte'),
+    'rating_min': ('rating', '$gte'),
+}
+
+# the properties a beer can be updated with
+UPDATABLE = ['name', 'ibu', 'calories', 'abv', 'style', 'brewery', 'glass']
 
 bp = flask.Blueprint('beers', __name__)
 
 @bp.route('/beers', methods=['GET'])
 @login_required
+@conditional('beer', 'brewery', 'glass')
 def list():
     """Returns a list of all beers"""
 
     beers = Beer.objects.all()
+    keys = []
 
     if 'sort' in flask.request.values:
-        props = ['name', 'ibu', 'calories', 'abv', 'style', 'rating']
-
-        keys = get_sort_keys(flask.request.values['sort'].split(','), props)
+        keys = get_sort_keys(flask.request.values['sort'].split(','), SORTABLE)
 
         if len(keys) > 0:
             beers = beers.order_by(*keys)
 
-    return JSONResponse(beers.to_json())
+    expandable = {
+        'brewery': Brewery.objects,
+        'glass': Glass.objects,
+    }
+
+    return JSONList(beers, keys, stream=True, expandable=expandable,
+                    selectable=SELECTABLE, filterable=FILTERABLE)
+
+
+def _claim():
+    """Stamps the logged in user as having added a beer now, unless they've
+    added one within the last 24 hours, with one conditional update that
+    both checks and stamps.  Returns the time stamped and the one it
+    replaced, or the response telling the user how long to wait."""
+
+    now = datetime.now()
+    users = User._get_collection()
+    id = flask.request.user.id
+
+    found = users.find_one_and_update(
+        {'_id': id,
+         '$or': [{'last_beer_added': None},
+                 {'last_beer_added': {'$lte': now + relativedelta(hours=-24)}}]},
+        {'$set': {'last_beer_added': now}},
+        {'last_beer_added': True})
+
+    if found is not None:
+        return (now, found.get('last_beer_added')), None
+
+    # only read when the user has to wait, to say until when
+    found = users.find_one({'_id': id}, {'last_beer_added': True})
+
+    if found is None or found.get('last_beer_added') is None:
+        return None, flask.Response('No user with id {} found'.format(id), 404)
+
+    wait = found['last_beer_added'] + relativedelta(hours=+24)
+
+    return None, flask.Response('You can only add one beer every 24 hours. ' \
+                                'You can add another beer on {}'.format(wait),
+                                400)
+
+
+def _release(claimed):
+    """Puts back the time the user last added a beer, if it's still the one
+    stamped by _claim, for when no beer was added after all"""
+
+    now, previous = claimed
+
+    if previous is None:
+        update = {'$unset': {'last_beer_added': ''}}
+    else:
+        update = {'$set': {'last_beer_added': previous}}
+
+    User._get_collection().update_one({'_id': flask.request.user.id,
+                                       'last_beer_added': now}, update)
 
 
 @bp.route('/beers', methods=['POST'])
@@ -52,16 +253,6 @@ def list():
 def post():
     """Creates a new beer"""
 
-    # figure out who's adding this beer, and if they've added one within the
-    # last 24 hours
-    if flask.request.user.last_beer_added is not None:
-        wait = flask.request.user.last_beer_added + relativedelta(hours=+24)
-
-        if wait > datetime.now():
-            return flask.Response('You can only add one beer every 24 hours. ' \
-                                  'You can add another beer on {}'.format(wait),
-                                  400)
-
     data = flask.request.get_json()
 
     if not 'name' in data:
@@ -87,26 +278,160 @@ def post():
         if glass is not None:
             beer.glass  = glass
 
+    try:
+        beer.validate()
+    except mongoengine.ValidationError as exp:
+        return flask.Response('{}'.format(exp), 400)
+
+    # figure out if the user has added a beer within the last 24 hours, and
+    # count this one if they haven't
+    claimed, wait = _claim()
+    if wait is not None:
+        return wait
+
     try:
         beer.save()
-    except mongoengine.NotUniqueError as exp:
+    except mongoengine.NotUniqueError:
+        _release(claimed)
         return flask.Response('A beer with the name "{}" already exists' \
                               .format(data['name']), 409)
 
-    flask.request.user.last_beer_added = datetime.now()
-    flask.request.user.save()
+    bump('beer', 'beer:{}'.format(beer.id),
+         'user', 'user:{}'.format(flask.request.user.id), 'search')
+
+    search.index('beer', [beer])
 
     return JSONResponse(beer.to_json())
 
 
+@bp.route('/beers/_bulk', methods=['POST'])
+@login_required
+def post_bulk():
+    """Creates every beer in the given list, which counts as adding one beer
+    towards the 24 hour limit"""
+
+    items = flask.request.get_json()
+
+    # look up every brewery and glass referenced with a query each
+    breweries = bulk.existing(Brewery, items, 'brewery')
+    glasses = bulk.existing(Glass, items, 'glass')
+
+    def build(data):
+        if not isinstance(data, dict) or not 'name' in data:
+            raise ValueError('No name specified')
+
+        beer = Beer(name=data['name'],
+                    ibu='ibu' in data and data['ibu'] or None,
+                    calories='calories' in data and data['calories'] or None,
+                    abv='abv' in data and data['abv'] or None,
+                    style='style' in data and data['style'] or None)
+
+        if 'brewery' in data:
+            if not str(data['brewery']) in breweries:
+                raise ValueError('No brewery with id {} found'.format(data['brewery']))
+
+            beer.brewery = ObjectId(str(data['brewery']))
+
+        if 'glass' in data:
+            if not str(data['glass']) in glasses:
+                raise ValueError('No glass with id {} found'.format(data['glass']))
+
+            beer.glass = ObjectId(str(data['glass']))
+
+        return beer
+
+    if not isinstance(items, list):
+        return flask.Response('Expected a list', 400)
+
+    claimed, wait = _claim()
+    if wait is not None:
+        return wait
+
+    results, created = bulk.create(Beer, items, build, 'conflict')
+
+    if len(created) == 0:
+        _release(claimed)
+    else:
+        bump('beer', 'user', 'user:{}'.format(flask.request.user.id), 'search')
+
+        search.index('beer', created)
+
+    return JSONResponse(json_util.dumps(results))
+
+
+@bp.route('/beers/top', methods=['GET'])
+@login_required
+@conditional('beer')
+def top():
+    """Returns the n best beers, optionally of a single style.  They're ranked
+    by their score, or by their plain rating with `by=rating`, and only the
+    beers with at least TOP_MIN_REVIEWS reviews are ranked."""
+
+    values = flask.request.values
+
+    try:
+        n = int(values.get('n', 10))
+    except ValueError:
+        return flask.Response('Invalid n {}'.format(values['n']), 400)
+
+    if n < 1:
+        return flask.Response('Invalid n {}'.format(n), 400)
+
+    by = values.get('by', 'score')
+    if not by in ['score', 'rating']:
+        return flask.Response('Invalid by {}'.format(by), 400)
+
+    # the partial indexes only hold the ranked beers, so the query has to
+    # say the same to be served by them
+    beers = Beer.objects(__raw__=RANKED)
+
+    if 'style' in values:
+        beers = beers.filter(style=values['style'])
+
+    beers = select(beers, SELECTABLE, [by]).order_by('-{}'.format(by), '+id')
+    beers = beers.limit(min(n, app.config['TOP_MAX']))
+
+    return JSONResponse(encoder(Beer).encode_many(beers.as_pymongo()))
+
+
+@bp.route('/beers/popular', methods=['GET'])
+@login_required
+@conditional('beer')
+def popular():
+    """Returns the n most favorited beers, optionally of a single style"""
+
+    values = flask.request.values
+
+    try:
+        n = int(values.get('n', 10))
+    except ValueError:
+        return flask.Response('Invalid n {}'.format(values['n']), 400)
+
+    if n < 1:
+        return flask.Response('Invalid n {}'.format(n), 400)
+
+    # the partial indexes only hold the favorited beers, so the query has to
+    # say the same to be served by them
+    beers = Beer.objects(__raw__=POPULAR)
+
+    if 'style' in values:
+        beers = beers.filter(style=values['style'])
+
+    beers = select(beers, SELECTABLE, ['favorites']).order_by('-favorites', '+id')
+    beers = beers.limit(min(n, app.config['TOP_MAX']))
+
+    return JSONResponse(encoder(Beer).encode_many(beers.as_pymongo()))
+
+
 @bp.route('/beers/<id>', methods=['GET'])
 @login_required
+@conditional('beer:{id}')
 def get(id):
     """Returns the given beer by id"""
 
-    beer = Beer.objects.get(id=id)
+    beer = select(Beer.objects, SELECTABLE).as_pymongo().get(id=id)
 
-    return JSONResponse(beer.to_json())
+    return JSONResponse(encoder(Beer).encode(beer))
 
 
 @bp.route('/beers/<id>', methods=['DELETE'])
@@ -119,41 +444,46 @@ def delete(id):
     except mongoengine.DoesNotExist:
         return flask.Response('No beer with id {} found'.format(id), 404)
 
+    bump('beer', 'beer:{}'.format(id), 'search')
+
+    search.unindex('beer', id)
+
     return JSONResponse()
 
 
-@bp.route('/beers/<id>', methods=['PUT'])
+@bp.route('/beers/<id>', methods=['PUT', 'PATCH'])
 @login_required
 def put(id):
-    """Updates the given beer by it's id"""
+    """Updates the given properties of the beer with a single update and
+    returns it as it is afterwards"""
 
-    try:
-        beer = Beer.objects.get(id=id)
-    except mongoengine.DoesNotExist:
-        return flask.Response('Not found', 404)
+    if not ObjectId.is_valid(id):
+        return flask.Response('Invalid id {}'.format(id), 400)
 
-    data = flask.request.get_json()
+    try:
+        update = get_update(Beer, flask.request.get_json(), UPDATABLE)
+    except mongoengine.ValidationError as exp:
+        return flask.Response('{}'.format(exp), 400)
 
-    # update an of our simple fields
-    props = ['name', 'ibu', 'calories', 'abv', 'style']
-    for item in props:
-        if item in data:
-            setattr(beer, item, data[item])
+    found = missing(Beer, update)
+    if found is not None:
+        return flask.Response('No {} with id {} found'.format(*found), 404)
 
-    # check if we got a brewery update
-    if 'brewery' in data:
-        brewery = Brewery.objects.get(id=data['brewery'])
-        if brewery is not None:
-            beer.brewery = brewery
+    try:
+        beer = modify(Beer, {'_id': ObjectId(id)}, update)
+    except mongoengine.NotUniqueError:
+        return flask.Response('A beer with the name "{}" already exists' \
+                              .format(update.get('$set', {}).get('name')), 409)
 
-    # check if we got a glass update
-    if 'glass' in data:
-        glass = Glass.objectsget(id=data['glass'])
-        if glass is not None:
-            beer.glass = glass
+    if beer is None:
+        return flask.Response('No beer with id {} found'.format(id), 404)
 
-    beer.save()
+    names = ['beer', 'beer:{}'.format(id)]
+    if search.searched('beer', update):
+        names.append('search')
 
-    return JSONResponse(beer.to_json())
+    bump(*names)
 
+    search.index('beer', [Beer._from_son(beer)])
 
+    return JSONResponse(encoder(Beer).encode(beer))
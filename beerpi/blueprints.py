@@ -4,6 +4,23 @@ import pkgutil
 
 from flask import Blueprint
 
+# the modules whose blueprints make up the application, every module with a
+# `bp` has to be listed here unless DISCOVER_BLUEPRINTS is set
+BLUEPRINTS = [
+    'beerpi.beer',
+    'beerpi.brewery',
+    'beerpi.cache',
+    'beerpi.favorite',
+    'beerpi.glasses',
+    'beerpi.metrics',
+    'beerpi.once',
+    'beerpi.review',
+    'beerpi.search',
+    'beerpi.slow',
+    'beerpi.users',
+]
+
+
 def find(app):
     """ Finds all of the blueprints and adds them to the given app """
 
@@ -20,3 +37,18 @@ def find(app):
             if isinstance(symbol, Blueprint):
                 app.register_blueprint(symbol)
 
+
+def register(app):
+    """Adds the blueprints of the listed modules to the given app, or every
+    blueprint found in the package if DISCOVER_BLUEPRINTS is set, and installs
+    the request and mongo metrics and the slow query log on it"""
+
+    if app.config['DISCOVER_BLUEPRINTS']:
+        find(app)
+    else:
+        for name in BLUEPRINTS:
+            app.register_blueprint(importlib.import_module(name).bp)
+
+    from beerpi import metrics, slow
+    metrics.install(app)
+    slow.install(app)
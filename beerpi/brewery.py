@@ -2,40 +2,64 @@
 
 import flask
 import mongoengine
+from bson import ObjectId, json_util
 
-from beerpi import db
-from beerpi.json import JSONResponse
+from beerpi import bulk, db, search
+from beerpi.cache import cached
+from beerpi.fields import select
+from beerpi.json import JSONList, JSONResponse
+from beerpi.serialize import encoder
 from beerpi.sort import get_sort_keys
+from beerpi.update import get_or_create, get_update, modify
 from beerpi.users import login_required
+from beerpi.version import bump, conditional
 
 class Brewery(db.Document):
     name = db.StringField(unique=True)
     city = db.StringField()
     state = db.StringField()
 
+    meta = {
+        'indexes': [
+            ('city', 'id'),
+            ('state', 'id'),
+        ]
+    }
+
+# the properties the brewery list can be sorted by
+SORTABLE = ['name', 'city', 'state']
+
+# the properties the breweries can be limited to with `fields`
+SELECTABLE = SORTABLE
+
+# the properties a brewery can be updated with
+UPDATABLE = ['name', 'city', 'state']
+
 bp = flask.Blueprint('breweries', __name__)
 
 @bp.route('/breweries', methods=['GET'])
 @login_required
+@conditional('brewery')
+@cached('brewery')
 def list():
     """Returns a list of all breweries"""
 
     breweries = Brewery.objects.all()
+    keys = []
 
     if 'sort' in flask.request.values:
-        props = ['name', 'city', 'state']
-
-        keys = get_sort_keys(flask.request.values['sort'].split(','), props)
+        keys = get_sort_keys(flask.request.values['sort'].split(','), SORTABLE)
 
         breweries = breweries.order_by(*keys)
 
-    return JSONResponse(breweries.to_json())
+    return JSONList(breweries, keys, selectable=SELECTABLE)
 
 
 @bp.route('/breweries', methods=['POST'])
 @login_required
 def post():
-    """Creates a new brewery"""
+    """Creates a new brewery, or returns the one with the same name as it is
+    if there already is one"""
 
     data = flask.request.get_json()
 
@@ -47,21 +71,56 @@ def post():
                       state='state' in data and data['state'] or None)
 
     try:
-        brewery.save()
-    except mongoengine.NotUniqueError as exp:
-        brewery = Brewery.objects.get(name=data['name'])
+        found, created = get_or_create(brewery, 'name')
+    except mongoengine.ValidationError as exp:
+        return flask.Response('{}'.format(exp), 400)
+
+    if created:
+        bump('brewery', 'brewery:{}'.format(brewery.id), 'search')
+
+        search.index('brewery', [brewery])
+
+    return JSONResponse(encoder(Brewery).encode(found))
+
+
+@bp.route('/breweries/_bulk', methods=['POST'])
+@login_required
+def post_bulk():
+    """Creates every brewery in the given list.  A brewery that already
+    exists is returned as it is."""
+
+    def build(data):
+        if not isinstance(data, dict) or not 'name' in data:
+            raise ValueError('No name specified')
+
+        return Brewery(name=data['name'],
+                       city='city' in data and data['city'] or None,
+                       state='state' in data and data['state'] or None)
+
+    try:
+        results, created = bulk.create(Brewery, flask.request.get_json(), build,
+                                       'exists')
+    except ValueError as exp:
+        return flask.Response('{}'.format(exp), 400)
+
+    if len(created) > 0:
+        bump('brewery', 'search')
+
+        search.index('brewery', created)
 
-    return JSONResponse(brewery.to_json())
+    return JSONResponse(json_util.dumps(results))
 
 
 @bp.route('/breweries/<id>', methods=['GET'])
 @login_required
+@conditional('brewery:{id}')
+@cached('brewery:{id}')
 def get(id):
     """Gets a brewery by id"""
 
-    brewery = Brewery.objects.get(id=id)
+    brewery = select(Brewery.objects, SELECTABLE).as_pymongo().get(id=id)
 
-    return JSONResponse(brewery.to_json())
+    return JSONResponse(encoder(Brewery).encode(brewery))
 
 
 @bp.route('/breweries/<id>', methods=['DELETE'])
@@ -71,28 +130,42 @@ def delete(id):
 
     brewery = Brewery.objects.get(id=id).delete()
 
+    bump('brewery', 'brewery:{}'.format(id), 'search')
+
+    search.unindex('brewery', id)
+
     return JSONResponse()
 
 
-@bp.route('/breweries/<id>', methods=['PUT'])
+@bp.route('/breweries/<id>', methods=['PUT', 'PATCH'])
 @login_required
 def put(id):
-    """Updates a brewery by id"""
+    """Updates the given properties of a brewery by id with a single update
+    and returns it as it is afterwards"""
+
+    if not ObjectId.is_valid(id):
+        return flask.Response('Invalid id {}'.format(id), 400)
 
     try:
-        brewery = Brewery.objects.get(id=id)
-    except mongoengine.DoesNotExist:
-        return flask.response('Not found', 404)
+        update = get_update(Brewery, flask.request.get_json(), UPDATABLE)
+    except mongoengine.ValidationError as exp:
+        return flask.Response('{}'.format(exp), 400)
 
-    data = flask.request.get_json()
+    try:
+        brewery = modify(Brewery, {'_id': ObjectId(id)}, update)
+    except mongoengine.NotUniqueError:
+        return flask.Response('A brewery with the name "{}" already exists' \
+                              .format(update.get('$set', {}).get('name')), 409)
 
-    props = ['name', 'city', 'state']
+    if brewery is None:
+        return flask.Response('No brewery with id {} found'.format(id), 404)
 
-    for item in props:
-        if item in data:
-            setattr(brewery, item, data[item])
+    names = ['brewery', 'brewery:{}'.format(id)]
+    if search.searched('brewery', update):
+        names.append('search')
 
-    brewery.save()
+    bump(*names)
 
-    return JSONResponse(brewery.to_json())
+    search.index('brewery', [Brewery._from_son(brewery)])
 
+    return JSONResponse(encoder(Brewery).encode(brewery))
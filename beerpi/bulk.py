@@ -0,0 +1,88 @@
+"""This module contains the helpers for creating many documents at once"""
+
+import mongoengine
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY = 11000
+
+
+def existing(document, items, name):
+    """Returns the ids given for the named property of the given items that
+    are ids of the given document, found with a single query
+    """
+
+    if not isinstance(items, list):
+        return set()
+
+    ids = set(str(item[name]) for item in items
+              if isinstance(item, dict) and name in item)
+    ids = [ObjectId(id) for id in ids if ObjectId.is_valid(id)]
+
+    if len(ids) == 0:
+        return set()
+
+    return set(str(row['_id']) for row in
+               document.objects(id__in=ids).only('id').as_pymongo())
+
+
+def create(document, items, build, duplicate):
+    """Builds a document from each of the given items and inserts the valid
+    ones in a single unordered batch, so one bad item doesn't stop the rest.
+
+    Returns a result for each item, in the same order, and the documents that
+    were created.  Each result has a status of `created`, `invalid` along
+    with the error, or the given duplicate status along with the existing
+    document of the same name.
+    """
+
+    if not isinstance(items, list):
+        raise ValueError('Expected a list')
+
+    results = [None] * len(items)
+    pending = []
+
+    for index, item in enumerate(items):
+        try:
+            doc = build(item)
+            doc.validate()
+        except (ValueError, mongoengine.ValidationError) as exp:
+            results[index] = {'status': 'invalid', 'error': '{}'.format(exp)}
+            continue
+
+        pending.append((index, doc))
+
+    sons = [doc.to_mongo() for _, doc in pending]
+    failed = {}
+
+    if len(sons) > 0:
+        try:
+            document._get_collection().insert_many(sons, ordered=False)
+        except BulkWriteError as exp:
+            failed = dict((error['index'], error) for error in exp.details['writeErrors'])
+
+    created = []
+    duplicates = []
+
+    for position, (index, doc) in enumerate(pending):
+        error = failed.get(position)
+
+        if error is None:
+            doc.id = sons[position]['_id']
+            created.append(doc)
+            results[index] = {'status': 'created', 'document': sons[position]}
+        elif error['code'] == DUPLICATE_KEY:
+            duplicates.append((index, doc))
+        else:
+            results[index] = {'status': 'invalid', 'error': error['errmsg']}
+
+    # look up everything that clashed with one query
+    if len(duplicates) > 0:
+        names = [doc.name for _, doc in duplicates]
+        found = dict((row['name'], row) for row in
+                     document.objects(name__in=names).as_pymongo())
+
+        for index, doc in duplicates:
+            results[index] = {'status': duplicate, 'document': found.get(doc.name)}
+
+    return results, created
@@ -0,0 +1,148 @@
+"""This module contains the in-process cache of the responses of the small,
+read mostly collections"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+import flask
+
+from beerpi import version
+from beerpi.json import JSONResponse
+from beerpi.users import login_required
+from beerpi.version import current, names_of
+
+
+class Cache(object):
+    """A least recently used cache whose entries also expire after a number of
+    seconds.  Each entry records the version counter names it depends on so
+    it can be dropped when one of them is bumped.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the value cached for the given key, or None"""
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or entry[0] < time.time():
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[2]
+
+    def set(self, key, value, names):
+        """Caches the value for the given key"""
+
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, set(names), value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, names):
+        """Drops every entry depending on any of the given names"""
+
+        names = set(names)
+
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if len(entry[1] & names) > 0:
+                    del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.entries),
+            }
+
+
+responses = None
+
+
+def _responses():
+    global responses
+
+    if responses is None:
+        config = flask.current_app.config
+        responses = Cache(config['CACHE_SIZE'], config['CACHE_TTL'])
+
+    return responses
+
+
+def _invalidate(names):
+    if responses is not None:
+        responses.invalidate(names)
+
+version.listeners.append(_invalidate)
+
+
+def cached(*names):
+    """This decorator caches the responses of a GET by its path and arguments
+    along with the version counters of the given names, which are formatted
+    with the arguments of the view.  Bumping any of them here drops the
+    response straight away, other processes notice within the version poll
+    interval.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            keys = names_of(names, **kwargs)
+
+            key = (flask.request.path,
+                   tuple(sorted(flask.request.args.items(multi=True))),
+                   tuple(current(keys)))
+
+            entry = _responses().get(key)
+            if entry is not None:
+                body, headers = entry
+
+                response = flask.Response(body, 200, headers)
+                response.headers['X-Cache'] = 'HIT'
+
+                return response
+
+            response = func(*args, **kwargs)
+
+            if response.status_code == 200 and not response.is_streamed:
+                _responses().set(key, (response.get_data(), dict(response.headers)), keys)
+
+            response.headers['X-Cache'] = 'MISS'
+
+            return response
+
+        return decorated
+
+    return decorator
+
+
+###############################################################################
+# Views
+###############################################################################
+bp = flask.Blueprint('cache', __name__)
+
+@bp.route('/cache', methods=['GET'])
+@login_required
+def stats():
+    """Returns the hit and miss counters of the response cache"""
+
+    return JSONResponse(json.dumps(_responses().stats()))
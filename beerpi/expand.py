@@ -0,0 +1,39 @@
+"""This module contains a helper for embedding referenced documents in a list
+without querying for each of them"""
+
+import flask
+
+
+def get_expand(allowed):
+    """Returns the references the request asked to expand, out of the given
+    mapping of reference names to the query sets to look them up in
+    """
+
+    if not 'expand' in flask.request.values:
+        return {}
+
+    names = flask.request.values['expand'].split(',')
+
+    return dict((name, allowed[name]) for name in names if name in allowed)
+
+
+def expand(rows, references):
+    """Replaces the ids of the given references in the raw documents with the
+    documents they point at.  Each referenced collection is read with one
+    query however many rows there are.
+    """
+
+    for name, query in references.items():
+        ids = set(row[name] for row in rows if row.get(name) is not None)
+
+        if len(ids) == 0:
+            continue
+
+        found = dict((doc['_id'], doc) for doc in
+                     query.filter(id__in=list(ids)).as_pymongo())
+
+        for row in rows:
+            if row.get(name) in found:
+                row[name] = found[row[name]]
+
+    return rows
@@ -2,21 +2,111 @@
 
 import flask
 import mongoengine
+from bson import ObjectId
 
 from beerpi import db
-from beerpi.beer import Beer
-from beerpi.json import JSONResponse
+from beerpi.beer import Beer, correct
+from beerpi.expand import expand, get_expand
+from beerpi.fields import select
+from beerpi.json import JSONList, JSONResponse
+from beerpi.page import get_limit
+from beerpi.serialize import encoder
+from beerpi.sort import get_sort_keys
+from beerpi.update import get_update, missing, modify
 from beerpi.users import User, login_required
+from beerpi.version import bump, conditional
 
 class Favorite(db.Document):
     beer = db.ReferenceField(Beer, reverse_delete_rule=db.DENY)
     user = db.ReferenceField(User, reverse_delete_rule=db.DENY)
 
+    meta = {
+        'indexes': [
+            # a user can only favorite a beer once
+            {'fields': ('user', 'beer'), 'unique': True},
+
+            # the list of a user's favorites, with the id pages are split on
+            ('user', 'id'),
+
+            # the reverse_delete_rule check of the beer
+            'beer',
+        ]
+    }
+
+
+def count(beer, by):
+    """Adds the given number to the favorite count of the beer with the given
+    id with a single atomic update"""
+
+    Beer._get_collection().update_one({'_id': beer}, {'$inc': {'favorites': by}})
+
+
+def reconcile_favorites(batch=1000):
+    """Recomputes the favorite count of every beer from the favorites in a
+    single aggregation pass and writes back the ones that are wrong in bulk.
+    Beers that are no longer favorited by anyone are reset.  Returns the ids
+    of the beers corrected.
+    """
+
+    pipeline = [
+        {'$group': {'_id': '$beer', 'count': {'$sum': 1}}},
+
+        # the count the beer has now, so only the wrong ones are written
+        {'$lookup': {'from': Beer._get_collection_name(),
+                     'localField': '_id',
+                     'foreignField': '_id',
+                     'as': 'beer'}},
+        {'$unwind': '$beer'},
+        {'$project': {'count': True, 'beer.favorites': True}},
+    ]
+
+    counted = set()
+    updates = []
+    corrected = []
+
+    for totals in Favorite._get_collection().aggregate(pipeline, allowDiskUse=True):
+        counted.add(totals['_id'])
+
+        if totals['beer'].get('favorites') == totals['count']:
+            continue
+
+        updates.append((totals['_id'], {'$set': {'favorites': totals['count']}}))
+
+        if len(updates) >= batch:
+            corrected += correct(updates)
+            updates = []
+
+    stale = Beer._get_collection().find({'favorites': {'$exists': True, '$ne': 0}},
+                                        {'_id': True})
+    for beer in stale:
+        if beer['_id'] in counted:
+            continue
+
+        updates.append((beer['_id'], {'$set': {'favorites': 0}}))
+
+        if len(updates) >= batch:
+            corrected += correct(updates)
+            updates = []
+
+    corrected += correct(updates)
+
+    return corrected
+
+
+###############################################################################
+# Views
+###############################################################################
+# the properties the favorites can be limited to with `fields`
+SELECTABLE = ['beer', 'user']
+
+# the properties the favorites can be sorted by, which are of their beers
+SORTABLE = ['popularity']
 
 bp = flask.Blueprint('favorites', __name__)
 
 @bp.route('/users/<id>/favorites', methods=['GET'])
 @login_required
+@conditional('user:{id}', 'favorites:{id}', 'beer')
 def list(id):
     """Returns a list of all favorites for the given user"""
 
@@ -27,7 +117,52 @@ def list(id):
     except:
         return flask.Resposne('Invalid id {}'.format(id), 400)
 
-    return JSONResponse(Favorite.objects.all().filter(user=user).to_json())
+    expandable = {
+        'beer': Beer.objects,
+    }
+
+    if 'sort' in flask.request.values:
+        keys = get_sort_keys(flask.request.values['sort'].split(','), SORTABLE)
+
+        if len(keys) > 0:
+            return by_popularity(user, keys[0][0] == '-', expandable)
+
+    return JSONList(Favorite.objects.all().filter(user=user), stream=True,
+                    expandable=expandable, selectable=SELECTABLE)
+
+
+def by_popularity(user, descending, expandable):
+    """Returns the favorites of the given user sorted by how many users
+    favorited their beers.  The counts of all of the beers are read with one
+    query, and a limit only cuts the list short since it can't be paged."""
+
+    if 'cursor' in flask.request.values:
+        return flask.Response('Favorites sorted by popularity can not be paged', 400)
+
+    try:
+        limit = get_limit()
+    except ValueError as exp:
+        return flask.Response('{}'.format(exp), 400)
+
+    references = get_expand(expandable)
+
+    favorites = select(Favorite.objects(user=user), SELECTABLE, ['beer'])
+    rows = [row for row in favorites.as_pymongo()]
+
+    ids = [row['beer'] for row in rows]
+    counts = dict((beer['_id'], beer.get('favorites', 0)) for beer in
+                  Beer.objects(id__in=ids).only('favorites').as_pymongo())
+
+    # the ids break the ties so the order is the same every time
+    rows.sort(key=lambda row: row['_id'], reverse=descending)
+    rows.sort(key=lambda row: counts.get(row['beer'], 0), reverse=descending)
+
+    if limit is not None:
+        rows = rows[:limit]
+
+    expand(rows, references)
+
+    return JSONResponse(encoder(Favorite).encode_many(rows))
 
 
 @bp.route('/users/<id>/favorites', methods=['POST'])
@@ -51,28 +186,30 @@ def post(id):
     except:
         return flask.Resposne('Invalid beer id {}'.format(data['beer']), 400)
 
-    # check to see if a favorite was already created for this beer from this
-    # user
-    try:
-        Favorite.objects.get(beer=beer, user=flask.request.user)
-    except mongoengine.DoesNotExist:
-        pass
-    else:
-        return flask.Response('You\'ve already favorited beer {}'.format(data['beer']),
-                              400)
-
     favorite = Favorite(user=flask.request.user,
                         beer=beer)
+
+    # the unique index on user and beer stops this user favoriting this beer
+    # a second time
     try:
         favorite.save()
+    except mongoengine.NotUniqueError:
+        return flask.Response('You\'ve already favorited beer {}'.format(data['beer']),
+                              400)
     except mongoengine.ValidationError as exp:
         return flask.Response('{}'.format(exp), 400)
 
+    count(beer.id, 1)
+
+    bump('beer', 'beer:{}'.format(beer.id), 'favorites:{}'.format(id),
+         'favorite:{}'.format(favorite.id))
+
     return JSONResponse(favorite.to_json())
 
 
 @bp.route('/users/<id>/favorites/<fid>', methods=['GET'])
 @login_required
+@conditional('user:{id}', 'favorite:{fid}')
 def get(id, fid):
     """Returns the given favorite for the given user by ids"""
 
@@ -84,13 +221,13 @@ def get(id, fid):
         return flask.Response('Invalid user id {}'.format(id), 400)
 
     try:
-        favorite = Favorite.objects.get(id=fid, user=user)
+        favorite = select(Favorite.objects, SELECTABLE).as_pymongo().get(id=fid, user=user)
     except mongoengine.DoesNotExist:
         return flask.Resposne('Failed to find a favorite with id {}'.format(fid), 404)
     except:
         return flask.Response('Invalid favorite id {}'.format(fid), 400)
 
-    return JSONResponse(favorite.to_json())
+    return JSONResponse(encoder(Favorite).encode(favorite))
 
 
 @bp.route('/users/<id>/favorites/<fid>', methods=['DELETE'])
@@ -102,52 +239,77 @@ def delete(id, fid):
         return flask.Response('You can not remove a favorite that does not belong to you',
                               400)
 
-    try:
-        favorite = Favorite.objects.get(id=fid, user=flask.request.user)
-    except mongoengine.DoesNotExist:
-        return flask.Response('No favorite with id {} found'.format(fid), 404)
-    except:
+    if not ObjectId.is_valid(fid):
         return flask.Response('Invalid favorite id {}'.format(fid), 400)
 
-    favorite.delete()
+    # only the request that actually removed the favorite takes it off the
+    # beer's count
+    favorite = Favorite._get_collection().find_one_and_delete(
+        {'_id': ObjectId(fid), 'user': flask.request.user.id}, {'beer': True})
+
+    if favorite is None:
+        return flask.Response('No favorite with id {} found'.format(fid), 404)
+
+    count(favorite['beer'], -1)
+
+    bump('beer', 'beer:{}'.format(favorite['beer']), 'favorites:{}'.format(id),
+         'favorite:{}'.format(fid))
 
     return JSONResponse()
 
 
-@bp.route('/users/<id>/favorites/<fid>', methods=['PUT'])
+@bp.route('/users/<id>/favorites/<fid>', methods=['PUT', 'PATCH'])
 @login_required
 def put(id, fid):
-    """Updates the given favorite for the logged in user by ids"""
+    """Updates the given favorite for the logged in user by ids with a single
+    update and returns it as it is afterwards"""
 
     if id != str(flask.request.user.id):
         return flask.Response('You can not update a favorite that does not belong to you',
                               400)
 
-    try:
-        favorite = Favorite.objects.get(id=fid, user=flask.request.user)
-    except mongoengine.DoesNotExist:
-        return flask.Response('No favorite with id {} found'.format(fid), 404)
-    except:
+    if not ObjectId.is_valid(fid):
         return flask.Response('Invalid favorite id {}'.format(fid), 400)
 
     data = flask.request.get_json()
 
-    # update an of our simple fields
-    if 'beer' in data:
-        try:
-            beer = Beer.objects.get(id=data['beer'])
-        except mongoengine.DoesNotExist:
-            return flask.Response('No beer with id {} found'.format(data['beer']), 404)
-        except:
-            return flask.Response('Invalid beer id {}'.format(data['beer']), 400)
-
-        favorite.beer = beer
-
     try:
-        favorite.save()
+        update = get_update(Favorite, data, ['beer'])
     except mongoengine.ValidationError as exp:
         return flask.Response('{}'.format(exp), 400)
 
-    return JSONResponse(favorite.to_json())
+    found = missing(Favorite, update)
+    if found is not None:
+        return flask.Response('No {} with id {} found'.format(*found), 404)
+
+    # the favorite is returned as it was so the count moves from the beer it
+    # had to the one it has now
+    try:
+        favorite = modify(Favorite, {'_id': ObjectId(fid), 'user': flask.request.user.id},
+                          update, before=True)
+    except mongoengine.NotUniqueError:
+        return flask.Response('You\'ve already favorited beer {}'.format(data['beer']),
+                              400)
+
+    if favorite is None:
+        return flask.Response('No favorite with id {} found'.format(fid), 404)
+
+    previous = favorite.get('beer')
+
+    favorite.update(update.get('$set', {}))
+    for name in update.get('$unset', {}):
+        favorite.pop(name, None)
+
+    names = ['favorites:{}'.format(id), 'favorite:{}'.format(fid)]
+
+    if favorite.get('beer') != previous:
+        for beer, by in [(previous, -1), (favorite.get('beer'), 1)]:
+            if beer is not None:
+                count(beer, by)
+                names.append('beer:{}'.format(beer))
+
+        names.append('beer')
 
+    bump(*names)
 
+    return JSONResponse(encoder(Favorite).encode(favorite))
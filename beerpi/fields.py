@@ -0,0 +1,26 @@
+"""This module contains a helper for reading only the properties asked for
+with the `fields` argument out of mongo"""
+
+import flask
+
+
+def get_fields(given, allowed):
+    """Check the list of given property names and keep the ones that may be
+    selected"""
+
+    return [name for name in given if name in allowed]
+
+
+def select(query, allowed, required=[]):
+    """Limits the query to the properties the request asked for, out of the
+    allowed ones.  The required properties, which the view needs itself, and
+    the id are always read.
+    """
+
+    if not 'fields' in flask.request.values:
+        return query
+
+    fields = get_fields(flask.request.values['fields'].split(','), allowed)
+    fields += [name for name in ['id'] + required if not name in fields]
+
+    return query.only(*fields)
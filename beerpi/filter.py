@@ -0,0 +1,63 @@
+"""This module contains a helper for turning the filter arguments of a list
+into a mongo query"""
+
+import flask
+from bson import ObjectId
+from mongoengine import fields
+
+
+def _convert(field, name, value):
+    """Converts an argument to the type the given field stores"""
+
+    try:
+        if isinstance(field, fields.ReferenceField):
+            if not ObjectId.is_valid(value):
+                raise ValueError()
+
+            return ObjectId(value)
+
+        if isinstance(field, fields.IntField):
+            return int(value)
+
+        if isinstance(field, (fields.FloatField, fields.DecimalField)):
+            return float(value)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid {} {}'.format(name, value))
+
+    return value
+
+
+def get_filter(document, values, allowed):
+    """Builds the mongo query matching the given filter arguments.  Allowed
+    maps the names of the arguments to the property they filter on and the
+    operator they compare it with, None for equality.  Any other argument is
+    left alone.  Raises ValueError if a value isn't of the property's type.
+    """
+
+    query = {}
+
+    for name, (prop, operator) in allowed.items():
+        if not name in values:
+            continue
+
+        field = document._fields[prop]
+        value = _convert(field, name, values[name])
+
+        if operator is None:
+            query[field.db_field] = value
+        else:
+            query.setdefault(field.db_field, {})[operator] = value
+
+    return query
+
+
+def where(query, allowed):
+    """Limits the query to the documents matching the filter arguments of the
+    request"""
+
+    predicate = get_filter(query._document, flask.request.values, allowed)
+
+    if len(predicate) == 0:
+        return query
+
+    return query.filter(__raw__=predicate)
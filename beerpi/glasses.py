@@ -4,33 +4,49 @@ resource.
 
 import flask
 import mongoengine
+from bson import ObjectId, json_util
 
-from beerpi import db
-from beerpi.json import JSONResponse
+from beerpi import bulk, db
+from beerpi.cache import cached
+from beerpi.fields import select
+from beerpi.json import JSONList, JSONResponse
+from beerpi.serialize import encoder
 from beerpi.sort import get_sort_keys
+from beerpi.update import get_or_create, get_update, modify
 from beerpi.users import login_required
+from beerpi.version import bump, conditional
 
 class Glass(db.Document):
     name = db.StringField(unique=True)
 
+# the properties the glass list can be sorted by
+SORTABLE = ['name']
+
+# the properties the glasses can be limited to with `fields`
+SELECTABLE = SORTABLE
+
+# the properties a glass can be updated with
+UPDATABLE = ['name']
+
 bp = flask.Blueprint('glasses', __name__)
 
 @bp.route('/glasses', methods=['GET'])
 @login_required
+@conditional('glass')
+@cached('glass')
 def list():
     """ returns a list of all glasses """
 
     glasses = Glass.objects.all()
+    keys = []
 
     if 'sort' in flask.request.values:
-        props = ['name']
-
-        keys = get_sort_keys(flask.request.values['sort'].split(','), props)
+        keys = get_sort_keys(flask.request.values['sort'].split(','), SORTABLE)
 
         if len(keys) > 0:
             glasses = glasses.order_by(*keys)
 
-    return JSONResponse(glasses.to_json())
+    return JSONList(glasses, keys, selectable=SELECTABLE)
 
 
 @bp.route('/glasses', methods=['POST'])
@@ -43,20 +59,50 @@ def post():
 
     glass = Glass(name=data['name'])
 
+    # a glass of the same name is returned as it is
     try:
-        glass.save()
-    except mongoengine.NotUniqueError as exp:
-        glass = Glass.objects.get(name=data['name'])
+        found, created = get_or_create(glass, 'name')
+    except mongoengine.ValidationError as exp:
+        return flask.Response('{}'.format(exp), 400)
+
+    if created:
+        bump('glass', 'glass:{}'.format(glass.id))
 
-    return JSONResponse(glass.to_json())
+    return JSONResponse(encoder(Glass).encode(found))
+
+
+@bp.route('/glasses/_bulk', methods=['POST'])
+@login_required
+def post_bulk():
+    """Creates every glass in the given list.  A glass that already
+    exists is returned as it is."""
+
+    def build(data):
+        if not isinstance(data, dict) or not 'name' in data:
+            raise ValueError('No name specified')
+
+        return Glass(name=data['name'])
+
+    try:
+        results, created = bulk.create(Glass, flask.request.get_json(), build,
+                                       'exists')
+    except ValueError as exp:
+        return flask.Response('{}'.format(exp), 400)
+
+    if len(created) > 0:
+        bump('glass')
+
+    return JSONResponse(json_util.dumps(results))
 
 
 @bp.route('/glasses/<id>', methods=['GET'])
 @login_required
+@conditional('glass:{id}')
+@cached('glass:{id}')
 def get(id):
-    glass = Glass.objects.get(id=id)
+    glass = select(Glass.objects, SELECTABLE).as_pymongo().get(id=id)
 
-    return JSONResponse(glass.to_json())
+    return JSONResponse(encoder(Glass).encode(glass))
 
 
 @bp.route('/glasses/<id>', methods=['DELETE'])
@@ -64,23 +110,31 @@ def get(id):
 def delete(id):
     Glass.objects.get(id=id).delete()
 
+    bump('glass', 'glass:{}'.format(id))
+
     return JSONResponse()
 
 
-@bp.route('/glasses/<id>', methods=['PUT'])
+@bp.route('/glasses/<id>', methods=['PUT', 'PATCH'])
 @login_required
 def put(id):
-    try:
-        glass = Glass.objects.get(id=id)
-    except mongoengine.DoesNotExist:
-        return flask.response('Not found', 404)
+    if not ObjectId.is_valid(id):
+        return flask.Response('Invalid id {}'.format(id), 400)
 
-    data = flask.request.get_json()
+    try:
+        update = get_update(Glass, flask.request.get_json(), UPDATABLE)
+    except mongoengine.ValidationError as exp:
+        return flask.Response('{}'.format(exp), 400)
 
-    if 'name' in data:
-        glass.name = data['name']
+    try:
+        glass = modify(Glass, {'_id': ObjectId(id)}, update)
+    except mongoengine.NotUniqueError:
+        return flask.Response('A glass with the name "{}" already exists' \
+                              .format(update.get('$set', {}).get('name')), 409)
 
-    glass.save()
+    if glass is None:
+        return flask.Response('No glass with id {} found'.format(id), 404)
 
-    return JSONResponse(glass.to_json())
+    bump('glass', 'glass:{}'.format(id))
 
+    return JSONResponse(encoder(Glass).encode(glass))
@@ -0,0 +1,369 @@
+"""This module contains the offline importer for catalogues of glasses,
+breweries, beers and reviews kept in NDJSON or CSV files.
+
+    python -m beerpi.importer beers beers.ndjson
+
+Rows are read and written a batch at a time so memory stays bounded however
+large the file is.  Glasses, breweries and beers are upserted on their
+unique names and reviews on their beer and user, so a file can be imported
+again to refresh what is already there.  After every batch the number of
+rows done is saved to a checkpoint file, and an import that was stopped
+picks up from there when run again.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import mongoengine
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from beerpi.beer import Beer
+from beerpi.brewery import Brewery
+from beerpi.glasses import Glass
+from beerpi.review import Review, rebuild_ratings
+from beerpi.users import User
+from beerpi.version import bump
+
+
+class Resolver(object):
+    """Maps the unique names of a document to its ids, remembering up to size
+    of them.  Names missing from the cache are looked up with one query per
+    batch.
+    """
+
+    def __init__(self, document, key, size=100000):
+        self.document = document
+        self.key = key
+        self.size = size
+        self.cache = OrderedDict()
+
+    def load(self, names):
+        """Looks up every given name that isn't already cached"""
+
+        missing = set(name for name in names
+                      if name is not None and not name in self.cache)
+
+        if len(missing) == 0:
+            return
+
+        query = self.document.objects(**{'{}__in'.format(self.key): list(missing)})
+
+        for row in query.only(self.key).as_pymongo():
+            self.add(row[self.key], row['_id'])
+
+    def add(self, name, id):
+        self.cache[name] = id
+        self.cache.move_to_end(name)
+
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+
+    def get(self, name):
+        """Returns the id of the given name, or the name itself if it's
+        already an id"""
+
+        if name in self.cache:
+            return self.cache[name]
+
+        if ObjectId.is_valid(name):
+            return ObjectId(name)
+
+        return None
+
+
+# what each kind of row is upserted on, and the references it resolves
+KINDS = {
+    'glasses': (Glass, ['name'], {}),
+    'breweries': (Brewery, ['name'], {}),
+    'beers': (Beer, ['name'], {'brewery': (Brewery, 'name'),
+                               'glass': (Glass, 'name')}),
+    'reviews': (Review, ['beer', 'user'], {'beer': (Beer, 'name'),
+                                           'user': (User, 'username')}),
+}
+
+# the properties kept up to date from the reviews and favorites, which a row
+# can't set since they'd no longer match what they're counted from
+DERIVED = ['rating', 'rating_sum', 'rating_count', 'score', 'favorites']
+
+
+def read(path, format):
+    """Yields every row of the given file as a dictionary"""
+
+    with open(path, newline='') as stream:
+        if format == 'csv':
+            for row in csv.DictReader(stream):
+                yield row
+        else:
+            for line in stream:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def convert(document, row):
+    """Converts the values of a row to the types of the document's fields,
+    leaving out everything the document doesn't have and the derived
+    counters"""
+
+    values = {}
+
+    for name, value in row.items():
+        field = document._fields.get(name)
+
+        if field is None or name == 'id' or name in DERIVED:
+            continue
+
+        if value == '':
+            value = None
+
+        if value is not None and not name in ['beer', 'user', 'brewery', 'glass']:
+            value = field.to_python(value)
+
+        values[name] = value
+
+    return values
+
+
+def build(kind, row, resolvers):
+    """Builds the upsert of a single row, returning the key it is upserted on
+    and the request.  Raises ValueError if the row is invalid."""
+
+    document, keys, references = KINDS[kind]
+
+    values = convert(document, row)
+
+    for name in references:
+        if values.get(name) is None:
+            continue
+
+        id = resolvers[name].get(str(values[name]))
+        if id is None:
+            raise ValueError('No {} named {} found'.format(name, values[name]))
+
+        values[name] = id
+
+    for key in keys:
+        if values.get(key) is None:
+            raise ValueError('No {} specified'.format(key))
+
+    doc = document(**values)
+
+    if kind == 'reviews':
+        try:
+            doc.calculate()
+        except TypeError:
+            raise ValueError('Every score has to be given')
+
+        values['overall'] = doc.overall
+
+    try:
+        doc.validate()
+    except mongoengine.ValidationError as exp:
+        raise ValueError('{}'.format(exp))
+
+    son = doc.to_mongo()
+    son.pop('_id', None)
+
+    # only overwrite what the row gave, defaults are only set on insert
+    given = dict((field, son[field]) for field in son
+                 if document._reverse_db_field_map.get(field) in values)
+    defaults = dict((field, son[field]) for field in son if not field in given)
+
+    key = dict((document._fields[key].db_field, son[document._fields[key].db_field])
+               for key in keys)
+
+    update = {'$set': given}
+    if len(defaults) > 0:
+        update['$setOnInsert'] = defaults
+
+    return key, UpdateOne(key, update, upsert=True)
+
+
+def load_checkpoint(path, source, kind):
+    """Returns the number of rows already imported from the given file"""
+
+    if path is None or not os.path.exists(path):
+        return 0
+
+    with open(path) as stream:
+        checkpoint = json.load(stream)
+
+    if checkpoint['file'] != source or checkpoint['kind'] != kind:
+        return 0
+
+    return checkpoint['rows']
+
+
+def save_checkpoint(path, source, kind, rows):
+    """Records the number of rows imported from the given file"""
+
+    if path is None:
+        return
+
+    with open(path + '.tmp', 'w') as stream:
+        json.dump({'file': source, 'kind': kind, 'rows': rows}, stream)
+
+    os.replace(path + '.tmp', path)
+
+
+def run(kind, path, format=None, batch=1000, checkpoint=None, ratings=True,
+        out=sys.stderr):
+    """Imports the given file.  Returns the number of rows imported and the
+    number that failed."""
+
+    document, keys, references = KINDS[kind]
+
+    format = format or (path.endswith('.csv') and 'csv' or 'ndjson')
+    source = os.path.abspath(path)
+
+    skip = load_checkpoint(checkpoint, source, kind)
+    done = skip
+    failed = 0
+
+    resolvers = dict((name, Resolver(other, key))
+                     for name, (other, key) in references.items())
+
+    # what the version counter of a single document of the kind is named
+    counter = {
+        'glasses': 'glass',
+        'breweries': 'brewery',
+        'beers': 'beer',
+        'reviews': 'review',
+    }[kind]
+
+    collection = document._get_collection()
+    touched = set()
+
+    start = time.time()
+    rows = read(path, format)
+
+    def flush(pending):
+        errors = 0
+
+        for name, resolver in resolvers.items():
+            resolver.load(str(row[name]) for row in pending if row.get(name))
+
+        requests = []
+        keys = []
+
+        for number, row in enumerate(pending):
+            try:
+                key, request = build(kind, row, resolvers)
+            except ValueError as exp:
+                out.write('row {}: {}\n'.format(done + number + 1, exp))
+                errors += 1
+                continue
+
+            requests.append(request)
+            keys.append(key)
+
+            if kind == 'reviews':
+                touched.add(key['beer'])
+
+        if len(requests) > 0:
+            try:
+                collection.bulk_write(requests, ordered=False)
+            except BulkWriteError as exp:
+                for error in exp.details['writeErrors']:
+                    out.write('{}\n'.format(error['errmsg']))
+
+                errors += len(exp.details['writeErrors'])
+
+            # the documents of the batch are looked up by the keys they were
+            # upserted on, so the ones that were changed stop matching their
+            # old tags and cached responses
+            ids = [row['_id'] for row in collection.find({'$or': keys}, {'_id': True})]
+
+            if len(ids) > 0:
+                bump(*['{}:{}'.format(counter, id) for id in ids])
+
+        return errors
+
+    pending = []
+
+    for number, row in enumerate(rows):
+        if number < skip:
+            continue
+
+        pending.append(row)
+
+        if len(pending) >= batch:
+            failed += flush(pending)
+            done += len(pending)
+            pending = []
+
+            save_checkpoint(checkpoint, source, kind, done)
+
+            elapsed = time.time() - start
+            out.write('{} rows, {:.0f} rows/second\n'.format(done, (done - skip) / elapsed))
+
+    if len(pending) > 0:
+        failed += flush(pending)
+        done += len(pending)
+
+        save_checkpoint(checkpoint, source, kind, done)
+
+    elapsed = max(time.time() - start, 0.001)
+    out.write('imported {} rows ({} failed) in {:.1f} seconds, {:.0f} rows/second\n'
+              .format(done - skip, failed, elapsed, (done - skip) / elapsed))
+
+    if kind == 'reviews' and ratings:
+        out.write('rebuilding ratings\n')
+        rebuild_ratings()
+
+    # let every cache and conditional GET know the collection changed
+    names = {
+        'glasses': ['glass'],
+        'breweries': ['brewery', 'search'],
+        'beers': ['beer', 'search'],
+        'reviews': ['beer'],
+    }[kind]
+
+    touched = list(touched)
+    for index in range(0, len(touched), batch):
+        ids = touched[index:index + batch]
+
+        bump(*['beer:{}'.format(id) for id in ids] + ['reviews:{}'.format(id) for id in ids])
+
+    bump(*names)
+
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    return done - skip, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Imports a catalogue file')
+    parser.add_argument('kind', choices=sorted(KINDS.keys()),
+                        help='what the file holds')
+    parser.add_argument('path', help='the NDJSON or CSV file to import')
+    parser.add_argument('--format', choices=['ndjson', 'csv'],
+                        help='the format of the file, by default from its extension')
+    parser.add_argument('--batch', type=int, default=1000,
+                        help='the number of rows to write at a time')
+    parser.add_argument('--checkpoint',
+                        help='the file to record progress in and resume from')
+    parser.add_argument('--no-ratings', dest='ratings', action='store_false',
+                        help='skip rebuilding the beer ratings after reviews')
+
+    args = parser.parse_args()
+
+    # the importer only needs the documents, not the application
+    from beerpi import connect
+    connect()
+
+    _, failed = run(args.kind, args.path, args.format, args.batch,
+                    args.checkpoint, args.ratings)
+
+    sys.exit(failed > 0 and 1 or 0)
+
+
+if __name__ == '__main__':
+    main()
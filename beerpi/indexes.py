@@ -0,0 +1,168 @@
+"""This module contains the helpers for creating the declared indexes and for
+checking that the queries of the endpoints are served by them"""
+
+from bson import ObjectId
+
+from beerpi import beer, brewery, favorite, glasses, review, users
+from beerpi.filter import get_filter
+from beerpi.page import after, get_order
+
+
+DOCUMENTS = [
+    users.User,
+    glasses.Glass,
+    brewery.Brewery,
+    beer.Beer,
+    review.Review,
+    favorite.Favorite,
+]
+
+
+def ensure():
+    """Creates every declared index that doesn't exist yet"""
+
+    for document in DOCUMENTS:
+        document.ensure_indexes()
+
+
+def _sorted(name, query, sortable):
+    """Yields the list query sorted every way the endpoint allows, both as a
+    whole and as the page after a cursor.
+    """
+
+    document = query._document
+    id = ObjectId()
+
+    yield name, query.order_by(*get_order(document, []))
+
+    for prop in sortable:
+        for direction in '+-':
+            keys = ['{}{}'.format(direction, prop)]
+            order = get_order(document, keys)
+            values = [key[1:] == 'id' and id or None for key in order]
+
+            yield '{} sort={}'.format(name, keys[0]), query.order_by(*keys)
+            yield '{} sort={} cursor'.format(name, keys[0]), \
+                query.order_by(*order).filter(__raw__=after(document, order, values))
+
+
+def _filtered(name, query, filterable, values, keys):
+    """Returns the list query filtered with the given arguments and sorted by
+    the given keys"""
+
+    document = query._document
+    predicate = get_filter(document, values, filterable)
+
+    return '{} {} sort={}'.format(name, ' '.join(sorted(values)), ','.join(keys)), \
+        query.filter(__raw__=predicate).order_by(*get_order(document, keys))
+
+
+# the filters of the lists that are expected to be served by an index, and
+# the sort they are served with
+FILTERS = [
+    ({'style': 'x'}, []),
+    ({'style': 'x'}, ['-rating']),
+    ({'style': 'x', 'abv_min': '4', 'abv_max': '6'}, ['+abv']),
+    ({'brewery': str(ObjectId())}, []),
+    ({'brewery': str(ObjectId())}, ['-rating']),
+    ({'abv_min': '4', 'abv_max': '6'}, ['+abv']),
+    ({'ibu_min': '20', 'ibu_max': '60'}, ['+ibu']),
+    ({'rating_min': '4'}, ['-rating']),
+]
+
+
+def queries():
+    """Yields a name and a query set for every query the endpoints and the
+    reverse_delete_rule checks run
+    """
+
+    id = ObjectId()
+
+    for item in _sorted('/users', users.User.objects.all(), users.SORTABLE):
+        yield item
+
+    yield 'authenticate', users.User.objects(username='admin')
+
+    for item in _sorted('/glasses', glasses.Glass.objects.all(), glasses.SORTABLE):
+        yield item
+
+    for item in _sorted('/breweries', brewery.Brewery.objects.all(), brewery.SORTABLE):
+        yield item
+
+    for item in _sorted('/beers', beer.Beer.objects.all(), beer.SORTABLE):
+        yield item
+
+    for values, keys in FILTERS:
+        yield _filtered('/beers', beer.Beer.objects.all(), beer.FILTERABLE, values, keys)
+
+    for by in ['score', 'rating']:
+        ranked = beer.Beer.objects(__raw__=beer.RANKED)
+        order = ['-{}'.format(by), '+id']
+
+        yield '/beers/top by={}'.format(by), ranked.order_by(*order).limit(10)
+        yield '/beers/top by={} style'.format(by), \
+            ranked.filter(style='x').order_by(*order).limit(10)
+
+    popular = beer.Beer.objects(__raw__=beer.POPULAR)
+    order = ['-favorites', '+id']
+
+    yield '/beers/popular', popular.order_by(*order).limit(10)
+    yield '/beers/popular style', popular.filter(style='x').order_by(*order).limit(10)
+
+    yield 'delete brewery', beer.Beer.objects(brewery=id)
+    yield 'delete glass', beer.Beer.objects(glass=id)
+    yield 'delete user', beer.Beer.objects(added_by=id)
+
+    reviews = review.Review.objects(beer=id)
+    for item in _sorted('/beers/<id>/reviews', reviews, review.SORTABLE):
+        yield item
+
+    for prop in review.SORTABLE:
+        yield _filtered('/beers/<id>/reviews', reviews, review.FILTERABLE,
+                        {'{}_min'.format(prop): '3'}, ['-{}'.format(prop)])
+
+    yield 'POST /beers/<id>/reviews', review.Review.objects(beer=id, user=id)
+    yield 'delete beer', review.Review.objects(beer=id)
+    yield 'delete user', review.Review.objects(user=id)
+
+    for item in _sorted('/users/<id>/favorites', favorite.Favorite.objects(user=id), []):
+        yield item
+
+    yield 'POST /users/<id>/favorites', favorite.Favorite.objects(user=id, beer=id)
+    yield 'delete beer', favorite.Favorite.objects(beer=id)
+    yield 'delete user', favorite.Favorite.objects(user=id)
+
+
+def _stages(plan):
+    """Yields every stage of an explained plan"""
+
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+
+        for value in plan.values():
+            for stage in _stages(value):
+                yield stage
+    elif isinstance(plan, list):
+        for value in plan:
+            for stage in _stages(value):
+                yield stage
+
+
+def check():
+    """Explains every query of the endpoints.  Returns a list of the names,
+    query sets and offending stages of the ones that either scan the whole
+    collection or sort in memory.
+    """
+
+    failed = []
+
+    for name, query in queries():
+        plan = query.explain()
+        plan = plan.get('queryPlanner', plan).get('winningPlan', plan)
+
+        stages = set(_stages(plan)) & set(['COLLSCAN', 'SORT'])
+        if len(stages) > 0:
+            failed.append((name, query, sorted(stages)))
+
+    return failed
@@ -1,6 +1,107 @@
+from urllib.parse import urlencode
+
+import flask
 from flask import Response
 
-def JSONResponse(data=None):
-    return Response(data, 200, {'content-type': 'application/json'})
+from beerpi.expand import expand, get_expand
+from beerpi.fields import select
+from beerpi.filter import where
+from beerpi.page import get_limit, paginate
+from beerpi.serialize import encoder
+
+def JSONResponse(data=None, headers=None):
+    headers = dict(headers or {})
+    headers['content-type'] = 'application/json'
+
+    return Response(data, 200, headers)
+
+
+def JSONStream(query, references=None):
+    """Returns a response that writes the documents of the query out as a
+    JSON list one batch at a time, so neither the documents nor the encoded
+    list are ever held in memory all at once.  The given references are
+    expanded a batch at a time.
+    """
+
+    size = flask.current_app.config['STREAM_BATCH_SIZE']
+    rows = query.as_pymongo().batch_size(size)
+    encode_row = encoder(query._document).encode
+
+    def encode(batch):
+        return ', '.join(encode_row(row)
+                         for row in expand(batch, references or {}))
+
+    def generate():
+        yield '['
+
+        batch = []
+        sep = ''
+
+        for row in rows:
+            batch.append(row)
+
+            if len(batch) >= size:
+                yield sep + encode(batch)
+                batch = []
+                sep = ', '
+
+        if len(batch) > 0:
+            yield sep + encode(batch)
+
+        yield ']'
+
+    return JSONResponse(flask.stream_with_context(generate()))
+
+
+def JSONList(query, keys=None, stream=False, expandable=None, selectable=None,
+             filterable=None):
+    """Returns the documents of the query, one page at a time if the request
+    asked for a limit or cursor.  The next page is linked in the headers.
+    Without paging the whole list is either encoded up front or, if stream
+    is set, written out as the cursor is read.  Expandable maps the names of
+    the references the request may ask to expand to the query sets they are
+    looked up in.  Selectable lists the properties the request may limit the
+    documents to, and filterable maps the filter arguments it may give to
+    what they match as described by filter.get_filter.
+    """
+
+    keys = keys or []
+    references = get_expand(expandable or {})
+
+    if selectable is not None:
+        query = select(query, selectable,
+                       [key[1:] for key in keys] + list(references))
+
+    encode = encoder(query._document).encode_many
+
+    try:
+        if filterable is not None:
+            query = where(query, filterable)
+
+        if get_limit() is None:
+            if stream:
+                return JSONStream(query, references)
+
+            rows = expand(list(query.as_pymongo()), references)
+
+            return JSONResponse(encode(rows))
+
+        rows, cursor = paginate(query, keys)
+    except ValueError as exp:
+        return Response('{}'.format(exp), 400)
+
+    expand(rows, references)
+
+    headers = {}
+
+    if cursor is not None:
+        args = flask.request.args.to_dict()
+        args['cursor'] = cursor
+
+        url = '{}?{}'.format(flask.request.base_url, urlencode(args))
+
+        headers['Link'] = '<{}>; rel="next"'.format(url)
+        headers['X-Next-Cursor'] = cursor
 
+    return JSONResponse(encode(rows), headers)
 
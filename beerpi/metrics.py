@@ -0,0 +1,341 @@
+"""This module contains the metrics of the requests and of the mongo commands
+they send, and the endpoint serving them in the Prometheus text format.  The
+requests are timed from Flask hooks and the mongo commands from a pymongo
+command listener, which is registered by `install` before the connection is
+made.  Every metric is per process.
+"""
+
+import bisect
+import threading
+import time
+
+import flask
+from pymongo import monitoring
+
+from beerpi import cache
+
+
+# the seconds the durations are counted by, and the number of mongo commands
+# a request sends
+DURATIONS = [.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10]
+COMMANDS = [0, 1, 2, 3, 5, 10, 20, 50, 100]
+
+registry = []
+
+
+def _escape(value):
+    return '{}'.format(value).replace('\\', '\\\\').replace('"', '\\"') \
+                             .replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = ['{}="{}"'.format(name, _escape(value))
+             for name, value in zip(names, values)]
+
+    if extra:
+        pairs.append(extra)
+
+    return len(pairs) > 0 and '{{{}}}'.format(','.join(pairs)) or ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value))
+
+
+class Metric(object):
+    """A metric with a value per combination of its labels.  The values are
+    only touched under the lock, so it is safe to use from several threads.
+    """
+
+    kind = None
+
+    def __init__(self, name, help, labels=(), register=True):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+        if register:
+            registry.append(self)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+
+        with self.lock:
+            values = sorted(self.values.items())
+
+        for labels, value in values:
+            lines += self.lines(labels, value)
+
+        return lines
+
+    def lines(self, labels, value):
+        return ['{}{} {}'.format(self.name, _labels(self.labels, labels),
+                                 _number(value))]
+
+
+class Counter(Metric):
+    """A count that only goes up"""
+
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down"""
+
+    kind = 'gauge'
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, labels=(), value=0):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    """Counts the values observed by the buckets they fall in, along with
+    their sum.  The counts are kept per bucket and only added up into the
+    cumulative ones Prometheus expects when rendered."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DURATIONS, register=True):
+        Metric.__init__(self, name, help, labels, register)
+
+        self.buckets = sorted(buckets)
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0]
+
+            entry[0][index] += 1
+            entry[1] += value
+
+    def lines(self, labels, value):
+        counts, total = value
+        lines = []
+        seen = 0
+
+        for bound, count in zip(self.buckets + [float('inf')], counts):
+            seen += count
+            lines.append('{}_bucket{} {}'.format(
+                self.name,
+                _labels(self.labels, labels, 'le="{}"'.format(_number(bound))),
+                seen))
+
+        lines.append('{}_sum{} {}'.format(self.name, _labels(self.labels, labels),
+                                          _number(total)))
+        lines.append('{}_count{} {}'.format(self.name, _labels(self.labels, labels),
+                                            seen))
+
+        return lines
+
+
+###############################################################################
+# Requests
+###############################################################################
+REQUEST = ('blueprint', 'endpoint')
+
+in_flight = Gauge('beerpi_requests_in_flight',
+                  'The requests being handled', REQUEST)
+
+durations = Histogram('beerpi_request_duration_seconds',
+                      'The seconds taken to handle a request, body included',
+                      REQUEST + ('status',))
+
+request_commands = Histogram('beerpi_request_mongo_commands',
+                             'The number of mongo commands sent by a request',
+                             REQUEST, COMMANDS)
+
+request_seconds = Histogram('beerpi_request_mongo_seconds',
+                            'The seconds a request spent waiting on mongo',
+                            REQUEST)
+
+# the request being handled by each thread
+_local = threading.local()
+
+
+def started(labels):
+    """Counts a request as in flight"""
+
+    in_flight.inc(labels)
+
+
+def finished(labels, status, seconds):
+    """Records a request that is no longer in flight"""
+
+    in_flight.dec(labels)
+    durations.observe(labels + ('{}'.format(status),), seconds)
+
+
+def _before():
+    request = flask.request
+    labels = (request.blueprint or '', request.endpoint or '')
+
+    _local.request = [labels, time.perf_counter(), 500, 0, 0.0]
+
+    started(labels)
+
+
+def _after(response):
+    current = getattr(_local, 'request', None)
+    if current is not None:
+        current[2] = response.status_code
+
+    return response
+
+
+def _teardown(exc):
+    # a streamed response is torn down once its body has been written, so
+    # the commands reading it are counted too
+    current = getattr(_local, 'request', None)
+    if current is None:
+        return
+
+    _local.request = None
+
+    labels, start, status, count, seconds = current
+
+    finished(labels, status, time.perf_counter() - start)
+    request_commands.observe(labels, count)
+    request_seconds.observe(labels, seconds)
+
+
+###############################################################################
+# Mongo
+###############################################################################
+commands = Counter('beerpi_mongo_commands_total',
+                   'The mongo commands sent, by whether they succeeded',
+                   ('command', 'outcome'))
+
+command_seconds = Histogram('beerpi_mongo_command_seconds',
+                            'The seconds taken by a mongo command',
+                            ('command',))
+
+
+class CommandListener(monitoring.CommandListener):
+    """Counts and times every mongo command, and adds it to the request of
+    the thread sending it.  The commands of the motor client are sent from
+    its own threads so they're only counted in total."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.record(event, 'succeeded')
+
+    def failed(self, event):
+        self.record(event, 'failed')
+
+    def record(self, event, outcome):
+        seconds = event.duration_micros / 1e6
+
+        commands.inc((event.command_name, outcome))
+        command_seconds.observe((event.command_name,), seconds)
+
+        current = getattr(_local, 'request', None)
+        if current is not None:
+            current[3] += 1
+            current[4] += seconds
+
+
+_installed = []
+
+
+def install(app):
+    """Times the requests of the given app and registers the command
+    listener.  Only clients made afterwards are listened to, so this has to
+    be called before the connection is made."""
+
+    app.before_request(_before)
+    app.after_request(_after)
+    app.teardown_request(_teardown)
+
+    if len(_installed) == 0:
+        _installed.append(CommandListener())
+        monitoring.register(_installed[0])
+
+
+###############################################################################
+# Views
+###############################################################################
+def _single(name, kind, help, value):
+    return ['# HELP {} {}'.format(name, help),
+            '# TYPE {} {}'.format(name, kind),
+            '{} {}'.format(name, _number(value))]
+
+
+def _snapshot():
+    """Returns the metrics read from the thread pool and the response cache
+    when scraped"""
+
+    # tornado is left unimported until the server is running
+    from beerpi import server
+
+    pool = server.stats.snapshot()
+
+    lines = _single('beerpi_pool_queued', 'gauge',
+                    'The requests waiting for a thread', pool['queued'])
+    lines += _single('beerpi_pool_running', 'gauge',
+                     'The requests running on a thread', pool['running'])
+    lines += _single('beerpi_pool_completed_total', 'counter',
+                     'The requests run on a thread', pool['completed'])
+    lines += _single('beerpi_pool_wait_seconds_total', 'counter',
+                     'The seconds requests waited for a thread',
+                     pool['wait_seconds_total'])
+    lines += _single('beerpi_pool_wait_seconds_max', 'gauge',
+                     'The longest a request waited for a thread',
+                     pool['wait_seconds_max'])
+
+    if cache.responses is not None:
+        found = cache.responses.stats()
+
+        lines += _single('beerpi_cache_hits_total', 'counter',
+                         'The responses served from the cache', found['hits'])
+        lines += _single('beerpi_cache_misses_total', 'counter',
+                         'The responses not found in the cache', found['misses'])
+        lines += _single('beerpi_cache_entries', 'gauge',
+                         'The responses in the cache', found['size'])
+
+    return lines
+
+
+def render():
+    """Returns every metric in the Prometheus text format"""
+
+    lines = []
+
+    for metric in registry:
+        lines += metric.render()
+
+    lines += _snapshot()
+
+    return '\n'.join(lines) + '\n'
+
+
+bp = flask.Blueprint('metrics', __name__)
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Returns the metrics of this process for Prometheus to scrape"""
+
+    return flask.Response(render(), 200,
+                          content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,358 @@
+"""This module contains Tornado handlers serving the busiest GETs of the beers
+and their reviews straight from the IOLoop with motor, so they neither wait
+for a pool thread nor block one on mongo.  They share the documents, sorts,
+paging, tokens and ETags of the Flask views, and hand any request they don't
+cover (other methods, expanding, filters) to the WSGI application.
+"""
+
+import base64
+import binascii
+from functools import partial
+from urllib.parse import urlencode
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from tornado import escape, gen
+from tornado.iostream import StreamClosedError
+
+from beerpi import beer, metrics, review
+from beerpi.page import after, decode_cursor, encode_cursor, get_order, parse_limit
+from beerpi.serialize import dumps, encoder
+from beerpi.server import WSGIHandler
+from beerpi.sort import get_sort_keys
+from beerpi.users import (User, cached_generation, hash_password, read_token,
+                          remember_generation, signing_key)
+from beerpi.version import Version, _known, make_tag, names_of, remember, stale
+
+
+# the request arguments the handlers answer themselves
+ARGUMENTS = set(['sort', 'limit', 'cursor'])
+
+
+class NativeHandler(WSGIHandler):
+    """The base of the native handlers.  The mongo database is given as a
+    motor database, or anything with the same interface."""
+
+    # the version counters the response is tagged with, formatted with the id
+    names = []
+
+    # the blueprint and endpoint of the view the handler stands in for, which
+    # its requests are timed under
+    endpoint = ('', '')
+    timed = False
+
+    def initialize(self, app, executor, db):
+        WSGIHandler.initialize(self, app, executor)
+
+        self.db = db
+        self.config = app.config
+
+    @gen.coroutine
+    def prepare(self):
+        arguments = set(self.request.query_arguments.keys())
+
+        if self.request.method != 'GET' or not arguments <= ARGUMENTS:
+            yield WSGIHandler.prepare(self)
+            return
+
+        self.timed = True
+        metrics.started(self.endpoint)
+
+        user = yield self.authenticate()
+        if user is None:
+            return
+
+        path = escape.url_unescape(self.request.path)
+        keys = names_of(self.names, id=self.path_args and self.path_args[0] or '')
+
+        versions = yield self.versions(keys)
+        tag = '"{}"'.format(make_tag('{}?{}'.format(path, self.request.query),
+                                     keys, versions))
+
+        if self.check_tag(tag):
+            self.set_status(304)
+            self.set_header('Etag', tag)
+            self.finish()
+            return
+
+        try:
+            status, body, headers = yield self.read(*self.path_args)
+        except ValueError as exp:
+            status, body, headers = 400, '{}'.format(exp), {}
+
+        self.set_status(status)
+
+        if status == 200:
+            self.set_header('Content-Type', 'application/json')
+            self.set_header('Etag', tag)
+        else:
+            self.set_header('Content-Type', 'text/html; charset=utf-8')
+
+        for key, value in headers.items():
+            self.set_header(key, value)
+
+        # an unpaged list is written out as it's read instead of all at once
+        if callable(body):
+            try:
+                yield body()
+            except StreamClosedError:
+                return
+
+            body = None
+
+        self.finish(body)
+
+    def on_finish(self):
+        WSGIHandler.on_finish(self)
+
+        if self.timed:
+            metrics.finished(self.endpoint, self.get_status(),
+                             self.request.request_time())
+
+    def check_tag(self, tag):
+        """Returns whether the request already has the given tag"""
+
+        given = self.request.headers.get('If-None-Match', '')
+
+        if given.strip() == '*':
+            return True
+
+        return tag in [value.strip().lstrip('W/') for value in given.split(',')]
+
+    def deny(self, header, message):
+        self.set_status(401)
+        self.set_header('WWW-Authenticate', header)
+        self.set_header('Content-Type', 'text/html; charset=utf-8')
+        self.finish(message)
+
+    @gen.coroutine
+    def authenticate(self):
+        """Checks the credentials the same way login_required does.  Returns
+        the id of the user, or None once the request has been denied."""
+
+        header = self.request.headers.get('Authorization', '')
+
+        if header.startswith('Bearer '):
+            claims = read_token(header[7:].strip(), signing_key(self.config))
+
+            if claims is not None:
+                generation = yield self.generation(claims['id'])
+
+                if claims['gen'] == generation:
+                    return claims['id']
+
+            self.deny('Bearer realm=\'beerpi\', error=\'invalid_token\'',
+                      'Invalid or expired token')
+            return None
+
+        username = password = None
+
+        if header.startswith('Basic '):
+            try:
+                decoded = base64.b64decode(header[6:].strip()).decode('utf-8')
+                username, password = decoded.split(':', 1)
+            except (ValueError, binascii.Error):
+                pass
+
+        if username is not None:
+            user = yield self.db[User._get_collection_name()].find_one(
+                {'username': username}, {'password': 1})
+
+            if user is not None and user.get('password') == hash_password(password):
+                return str(user['_id'])
+
+        self.deny('Basic realm=\'beerpi\'', 'Authentication Required')
+        return None
+
+    @gen.coroutine
+    def generation(self, id):
+        """Returns the token generation of a user like users._generation"""
+
+        generation = cached_generation(id)
+        if generation is not None:
+            return generation
+
+        user = None
+        if ObjectId.is_valid(id):
+            user = yield self.db[User._get_collection_name()].find_one(
+                {'_id': ObjectId(id)}, {'token_generation': 1})
+
+        if user is None:
+            remember_generation(id, None, 0)
+            return None
+
+        generation = user.get('token_generation') or 0
+        remember_generation(id, generation, self.config['TOKEN_GENERATION_TTL'])
+
+        return generation
+
+    @gen.coroutine
+    def versions(self, names):
+        """Returns the version counters of the given names like
+        version.current"""
+
+        missing = stale(names, self.config['VERSION_POLL_INTERVAL'])
+
+        if len(missing) > 0:
+            found = yield self.db[Version._get_collection_name()] \
+                              .find({'_id': {'$in': missing}}).to_list(None)
+            remember(missing, found)
+
+        return [_known[name][0] for name in names]
+
+    @gen.coroutine
+    def list(self, document, predicate, sortable):
+        """Reads the documents matching the predicate sorted and paged the
+        way JSONList does.  Returns the status, body and headers."""
+
+        values = dict((key, self.get_query_argument(key))
+                      for key in self.request.query_arguments)
+
+        keys = []
+        if 'sort' in values:
+            keys = get_sort_keys(values['sort'].split(','), sortable)
+
+        limit = parse_limit(values, self.config)
+        order = keys
+
+        if limit is not None:
+            order = get_order(document, keys)
+
+            if 'cursor' in values:
+                last = decode_cursor(values['cursor'], order)
+                predicate = {'$and': [predicate, after(document, order, last)]}
+
+        cursor = self.db[document._get_collection_name()].find(predicate)
+
+        if len(order) > 0:
+            cursor = cursor.sort([(document._fields[key[1:]].db_field,
+                                   key[0] == '+' and ASCENDING or DESCENDING)
+                                  for key in order])
+
+        if limit is None:
+            size = self.config['STREAM_BATCH_SIZE']
+            return 200, partial(self.stream, document, cursor.batch_size(size)), {}
+
+        rows = yield cursor.limit(limit + 1).to_list(None)
+
+        headers = {}
+
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = [rows[-1].get(document._fields[key[1:]].db_field) for key in order]
+
+            values['cursor'] = encode_cursor(order, last)
+
+            url = '{}://{}{}?{}'.format(self.request.protocol, self.request.host,
+                                        self.request.path, urlencode(values))
+
+            headers['Link'] = '<{}>; rel="next"'.format(url)
+            headers['X-Next-Cursor'] = values['cursor']
+
+        return 200, dumps(document, rows), headers
+
+
+    @gen.coroutine
+    def stream(self, document, cursor):
+        """Writes the documents of the cursor out as a JSON list one batch at
+        a time like JSONStream, waiting for each batch to be sent before the
+        next is read, so a slow client never has the whole list buffered"""
+
+        size = self.config['STREAM_BATCH_SIZE']
+        encode = encoder(document).encode
+        sep = ''
+
+        self.write('[')
+
+        while True:
+            rows = yield cursor.to_list(size)
+
+            if len(rows) == 0:
+                break
+
+            self.write(sep + ', '.join(encode(row) for row in rows))
+            sep = ', '
+
+            yield self.flush()
+
+        self.write(']')
+
+
+class BeersHandler(NativeHandler):
+    """GET /beers"""
+
+    names = ['beer', 'brewery', 'glass']
+    endpoint = ('beers', 'beers.list')
+
+    @gen.coroutine
+    def read(self):
+        result = yield self.list(beer.Beer, {}, beer.SORTABLE)
+        return result
+
+
+class BeerHandler(NativeHandler):
+    """GET /beers/<id>"""
+
+    names = ['beer:{id}']
+    endpoint = ('beers', 'beers.get')
+
+    @gen.coroutine
+    def read(self, id):
+        row = yield self.db[beer.Beer._get_collection_name()] \
+                        .find_one({'_id': ObjectId(id)})
+
+        if row is None:
+            return 404, 'No beer with id {} found'.format(id), {}
+
+        return 200, encoder(beer.Beer).encode(row), {}
+
+
+class ReviewsHandler(NativeHandler):
+    """GET /beers/<id>/reviews"""
+
+    names = ['beer:{id}', 'reviews:{id}', 'user']
+    endpoint = ('reviews', 'reviews.list')
+
+    @gen.coroutine
+    def read(self, id):
+        found = yield self.db[beer.Beer._get_collection_name()] \
+                          .find_one({'_id': ObjectId(id)}, {'_id': 1})
+
+        if found is None:
+            return 404, 'No beer with id {} found'.format(id), {}
+
+        result = yield self.list(review.Review, {'beer': ObjectId(id)},
+                                 review.SORTABLE)
+        return result
+
+
+def routes(app, executor, db):
+    """Returns the routes of the native handlers, which have to come before
+    the WSGI fallback"""
+
+    args = {'app': app, 'executor': executor, 'db': db}
+
+    return [
+        (r'/beers', BeersHandler, args),
+        (r'/beers/([0-9a-fA-F]{24})', BeerHandler, args),
+        (r'/beers/([0-9a-fA-F]{24})/reviews', ReviewsHandler, args),
+    ]
+
+
+def connect(settings):
+    """Returns the motor database for the given MONGODB_SETTINGS, or None if
+    motor isn't installed"""
+
+    try:
+        import motor.motor_tornado
+    except ImportError:
+        return None
+
+    options = dict((key, value) for key, value in settings.items()
+                   if not key.upper() in ['DB', 'HOST', 'PORT', 'CONNECT'])
+
+    client = motor.motor_tornado.MotorClient(settings.get('host', 'localhost'),
+                                             settings.get('port', 27017),
+                                             **options)
+
+    return client[settings.get('DB', settings.get('db'))]
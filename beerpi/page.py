@@ -0,0 +1,136 @@
+"""This module contains a helper for paging through a sorted collection by the
+last seen sort keys instead of skipping over everything before the page"""
+
+import base64
+import binascii
+
+import flask
+from bson import json_util
+
+
+def get_limit():
+    """Returns the page size asked for, or None if no paging was asked for"""
+
+    return parse_limit(flask.request.values, flask.current_app.config)
+
+
+def parse_limit(values, config):
+    """Returns the page size asked for by the given request arguments, or None
+    if no paging was asked for"""
+
+    if not 'limit' in values and not 'cursor' in values:
+        return None
+
+    try:
+        limit = int(values.get('limit', config['PAGE_LIMIT']))
+    except ValueError:
+        raise ValueError('Invalid limit {}'.format(values['limit']))
+
+    if limit < 1:
+        raise ValueError('Invalid limit {}'.format(limit))
+
+    return min(limit, config['PAGE_LIMIT_MAX'])
+
+
+def get_order(document, keys):
+    """Returns the sort keys with the id appended as a tie breaker, unless one
+    of the keys is already unique.  The id follows the direction of the last
+    key so a single compound index can serve the sort both ways.
+    """
+
+    for key in keys:
+        if document._fields[key[1:]].unique:
+            return list(keys)
+
+    direction = len(keys) > 0 and keys[-1][0] or '+'
+
+    return list(keys) + ['{}id'.format(direction)]
+
+
+def encode_cursor(keys, values):
+    """Packs the sort keys and the last seen values into an opaque token"""
+
+    data = json_util.dumps([keys, values]).encode('utf-8')
+
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, keys):
+    """Unpacks a token made by encode_cursor for the given sort keys"""
+
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        given, values = json_util.loads(data.decode('utf-8'))
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError('Invalid cursor {}'.format(cursor))
+
+    if given != keys or len(values) != len(keys):
+        raise ValueError('The cursor does not match the requested sort')
+
+    return values
+
+
+def after(document, keys, values):
+    """Builds the mongo query matching every document sorted after the one
+    with the given values for the given keys.  Missing values sort first.
+    """
+
+    clauses = []
+
+    for index, key in enumerate(keys):
+        clause = {}
+
+        for prev, value in zip(keys[:index], values):
+            clause[document._fields[prev[1:]].db_field] = value
+
+        name = document._fields[key[1:]].db_field
+        value = values[index]
+
+        if key[0] == '+':
+            if value is None:
+                clause[name] = {'$ne': None}
+            else:
+                clause[name] = {'$gt': value}
+        else:
+            # nothing sorts before a missing value
+            if value is None:
+                continue
+
+            clause['$or'] = [{name: {'$lt': value}}, {name: None}]
+
+        clauses.append(clause)
+
+    # only a missing value of a unique key sorted descending gets here
+    if len(clauses) == 0:
+        return {'_id': {'$in': []}}
+
+    return {'$or': clauses}
+
+
+def paginate(query, keys):
+    """Returns the requested page of the query as raw documents and the cursor
+    for the next page.  The cursor is None on the last page.
+    """
+
+    limit = get_limit()
+
+    document = query._document
+    order = get_order(document, keys)
+
+    query = query.order_by(*order)
+
+    if 'cursor' in flask.request.values:
+        values = decode_cursor(flask.request.values['cursor'], order)
+        query = query.filter(__raw__=after(document, order, values))
+
+    rows = list(query.limit(limit + 1).as_pymongo())
+
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+
+    values = [last.get(document._fields[key[1:]].db_field) for key in order]
+
+    return rows, encode_cursor(order, values)
@@ -1,13 +1,22 @@
 """This module contains everything related to an individual beer"""
 
+import json
+
 import flask
 import mongoengine
+from bson import ObjectId
+from pymongo import ReturnDocument
 
 from beerpi import db
-from beerpi.beer import Beer
-from beerpi.json import JSONResponse
+from beerpi.beer import Beer, correct, hundredths, rate, ratings
+from beerpi.cache import cached
+from beerpi.fields import select
+from beerpi.json import JSONList, JSONResponse
+from beerpi.serialize import encoder
 from beerpi.sort import get_sort_keys
-from beerpi.users import User, login_required
+from beerpi.update import get_update
+from beerpi.users import PRIVATE, User, login_required
+from beerpi.version import bump, conditional
 
 class Review(db.Document):
     beer = db.ReferenceField(Beer, reverse_delete_rule=db.DENY)
@@ -21,9 +30,31 @@ class Review(db.Document):
 
     overall = db.DecimalField(precision=2)
 
+    meta = {
+        'indexes': [
+            # a user can only review a beer once
+            {'fields': ('beer', 'user'), 'unique': True},
+
+            # the sorts of the list of a beer's reviews, with the id pages
+            # are split on
+            ('beer', 'id'),
+            ('beer', 'aroma', 'id'),
+            ('beer', 'appearance', 'id'),
+            ('beer', 'taste', 'id'),
+            ('beer', 'palate', 'id'),
+            ('beer', 'bottle_style', 'id'),
+            ('beer', 'overall', 'id'),
+
+            # the reverse_delete_rule check of the user
+            'user',
+        ]
+    }
 
     total = 30 # update this if anything is changed in the fields
 
+    # the properties the overall rating is calculated from
+    scores = ['aroma', 'appearance', 'taste', 'palate', 'bottle_style']
+
 
     def calculate(self):
         """This method updates the calculated rating of a review.  It takes
@@ -35,20 +66,117 @@ class Review(db.Document):
 
         rating = 0
 
-        props = ['aroma', 'appearance', 'taste', 'palate', 'bottle_style']
-        for item in props:
+        for item in self.scores:
             rating += getattr(self, item, 0)
 
         self.overall = (rating / self.total) / .2
 
 
+def overall(row):
+    """Returns the overall rating of a raw review the way calculate does,
+    rounded to the precision it is stored with"""
+
+    rating = sum(row.get(item) or 0 for item in Review.scores)
+
+    return round((rating / Review.total) / .2, 2)
+
+
+# the overall rating of a review worked out by mongo in an update, the same
+# way as overall
+OVERALL = {'$round': [{'$divide': [{'$add': [{'$ifNull': ['$' + item, 0]}
+                                             for item in Review.scores]},
+                                   Review.total * .2]}, 2]}
+
+
+def rebuild_ratings(batch=1000):
+    """Recomputes the rating totals and scores of every beer from its reviews
+    in a single aggregation pass and writes back the ones that are wrong in
+    bulk.  Beers that have lost all of their reviews are reset.  Returns the
+    ids of the beers corrected.
+    """
+
+    fields = ['rating_sum', 'rating_count', 'rating', 'score']
+
+    pipeline = [
+        {'$match': {'overall': {'$ne': None}}},
+        {'$group': {'_id': '$beer',
+                    'sum': {'$sum': {'$round': [{'$multiply': ['$overall', 100]}, 0]}},
+                    'count': {'$sum': 1}}},
+
+        # the totals the beer has now, so only the wrong ones are written
+        {'$lookup': {'from': Beer._get_collection_name(),
+                     'localField': '_id',
+                     'foreignField': '_id',
+                     'as': 'beer'}},
+        {'$unwind': '$beer'},
+        {'$project': dict([('sum', True), ('count', True)] +
+                          [('beer.{}'.format(field), True) for field in fields])},
+    ]
+
+    rated = set()
+    updates = []
+    corrected = []
+
+    for totals in Review._get_collection().aggregate(pipeline, allowDiskUse=True):
+        rated.add(totals['_id'])
+
+        # the sum of whole hundredths is exact, and the rating and score are
+        # worked out from it the same way rate does, so a beer that is right
+        # compares equal
+        total = int(totals['sum'])
+
+        rating, score = ratings(total, totals['count'])
+        values = {'rating_sum': total,
+                  'rating_count': totals['count'],
+                  'rating': rating,
+                  'score': score}
+
+        if all(totals['beer'].get(field) == values[field] for field in fields):
+            continue
+
+        updates.append((totals['_id'], {'$set': values}))
+
+        if len(updates) >= batch:
+            corrected += correct(updates)
+            updates = []
+
+    stale = Beer._get_collection().find({'rating_count': {'$ne': 0}}, {'_id': True})
+    for beer in stale:
+        if beer['_id'] in rated:
+            continue
+
+        updates.append((beer['_id'], {'$set': {'rating_sum': 0,
+                                               'rating_count': 0,
+                                               'rating': None,
+                                               'score': None}}))
+
+        if len(updates) >= batch:
+            corrected += correct(updates)
+            updates = []
+
+    corrected += correct(updates)
+
+    return corrected
+
+
 ###############################################################################
 # Views
 ###############################################################################
+# the properties the review list can be sorted by
+SORTABLE = ['aroma', 'appearance', 'taste', 'palate', 'bottle_style', 'overall']
+
+# the properties the reviews can be limited to with `fields`
+SELECTABLE = SORTABLE + ['beer', 'user']
+
+# the arguments the review list can be filtered with, the lowest score of
+# each property
+FILTERABLE = dict(('{}_min'.format(prop), (prop, '$gte')) for prop in SORTABLE)
+
 bp = flask.Blueprint('reviews', __name__)
 
 @bp.route('/beers/<id>/reviews', methods=['GET'])
 @login_required
+@conditional('beer:{id}', 'reviews:{id}', 'user')
 def list(id):
     """Returns a list of all reviews for the given beer"""
 
@@ -60,17 +188,89 @@ def list(id):
         return flask.Resposne('Invalid id {}'.format(id), 400)
 
     reviews = Review.objects.all().filter(beer=beer)
+    keys = []
 
     if 'sort' in flask.request.values:
-        props = ['aroma', 'appearance', 'taste', 'palate', 'bottle_style',
-                 'overall']
-
-        keys = get_sort_keys(flask.request.values['sort'].split(','), props)
+        keys = get_sort_keys(flask.request.values['sort'].split(','), SORTABLE)
 
         if len(keys) > 0:
             reviews = reviews.order_by(*keys)
 
-    return JSONResponse(reviews.to_json())
+    expandable = {
+        'user': User.objects.exclude(*PRIVATE),
+    }
+
+    return JSONList(reviews, keys, stream=True, expandable=expandable,
+                    selectable=SELECTABLE, filterable=FILTERABLE)
+
+
+def summarize(beer):
+    """Returns the number of reviews of the given beer and the count, mean,
+    standard deviation and histogram of each of their scores, all worked out
+    by mongo in one aggregation"""
+
+    histograms = dict((prop, [{'$group': {'_id': '$' + prop, 'count': {'$sum': 1}}}])
+                      for prop in SORTABLE)
+
+    # the overall score isn't whole, so it's counted by the whole stars
+    histograms['overall'] = [{'$group': {'_id': {'$floor': '$overall'},
+                                         'count': {'$sum': 1}}}]
+
+    stats = {'_id': None, 'count': {'$sum': 1}}
+    for prop in SORTABLE:
+        # numbers sort after null, so this counts the reviews with a score
+        stats[prop + '_count'] = {'$sum': {'$cond': [{'$gt': ['$' + prop, None]}, 1, 0]}}
+        stats[prop + '_mean'] = {'$avg': '$' + prop}
+        stats[prop + '_stddev'] = {'$stdDevPop': '$' + prop}
+
+    facets = dict(histograms, stats=[{'$group': stats}])
+
+    pipeline = [
+        {'$match': {'beer': beer.id}},
+        {'$facet': facets},
+    ]
+
+    found = next(Review._get_collection().aggregate(pipeline))
+    stats = found['stats'] and found['stats'][0] or {}
+
+    summary = {'count': stats.get('count', 0)}
+
+    for prop in SORTABLE:
+        field = Review._fields[prop]
+        counts = dict((row['_id'], row['count']) for row in found[prop]
+                      if row['_id'] is not None)
+
+        # every possible score is listed, even if no one gave it
+        if prop == 'overall':
+            scores = range(0, 6)
+        else:
+            scores = range(field.min_value, field.max_value + 1)
+
+        summary[prop] = {
+            'count': stats.get(prop + '_count', 0),
+            'mean': stats.get(prop + '_mean'),
+            'stddev': stats.get(prop + '_stddev'),
+            'histogram': dict((str(score), counts.get(score, 0)) for score in scores),
+        }
+
+    return summary
+
+
+@bp.route('/beers/<id>/reviews/summary', methods=['GET'])
+@login_required
+@conditional('reviews:{id}')
+@cached('reviews:{id}')
+def summary(id):
+    """Returns the statistics of the scores of the reviews of the given beer"""
+
+    try:
+        beer = Beer.objects.only('id').get(id=id)
+    except mongoengine.DoesNotExist:
+        return flask.Response('No beer with id {} found'.format(id), 404)
+    except mongoengine.ValidationError:
+        return flask.Response('Invalid id {}'.format(id), 400)
+
+    return JSONResponse(json.dumps(summarize(beer)))
 
 
 @bp.route('/beers/<id>/reviews', methods=['POST'])
@@ -87,16 +287,6 @@ def post(id):
 
     data = flask.request.get_json()
 
-    # check to see if a review was already created for this beer from this
-    # user
-    try:
-        Review.objects.get(beer=beer, user=flask.request.user)
-    except mongoengine.DoesNotExist:
-        pass
-    else:
-        return flask.Response('You\'ve already created a review for beer {}'.format(id),
-                              400)
-
     review = Review(beer=beer,
                     user=flask.request.user)
 
@@ -107,19 +297,28 @@ def post(id):
 
     review.calculate()
 
+    # the unique index on beer and user stops a second review of this beer
+    # from this user
     try:
         review.save()
+    except mongoengine.NotUniqueError:
+        return flask.Response('You\'ve already created a review for beer {}'.format(id),
+                              400)
     except mongoengine.ValidationError as exp:
         return flask.Response('{}'.format(exp), 400)
 
-    beer.rating = Review.objects.all().filter(beer=beer).average('overall')
-    beer.save()
+    # the rating is moved by the overall as it's stored, rounded by its field,
+    # which is what an update or delete of the review takes off again
+    rate(beer, hundredths(review.overall), 1)
+
+    bump('beer', 'beer:{}'.format(id), 'reviews:{}'.format(id))
 
     return JSONResponse(review.to_json())
 
 
 @bp.route('/beers/<id>/reviews/<rid>', methods=['GET'])
 @login_required
+@conditional('beer:{id}', 'review:{rid}')
 def get(id, rid):
     """Returns the given review for the given beer by ids"""
 
@@ -131,13 +330,13 @@ def get(id, rid):
         return flask.Response('Invalid beer id {}'.format(id), 400)
 
     try:
-        review = Review.objects.get(id=rid, beer=beer)
+        review = select(Review.objects, SELECTABLE).as_pymongo().get(id=rid, beer=beer)
     except mongoengine.DoesNotExist:
         return flask.Resposne('Failed to find a review with id {}'.format(id), 404)
     except:
         return flask.Response('Invalid review id {}'.format(rid), 400)
 
-    return JSONResponse(review.to_json())
+    return JSONResponse(encoder(Review).encode(review))
 
 
 @bp.route('/beers/<id>/reviews/<rid>', methods=['DELETE'])
@@ -152,55 +351,79 @@ def delete(id, rid):
     except:
         return flask.Response('Invalid beer id {}'.format(id), 400)
 
-    try:
-        review = Review.objects.get(id=rid, beer=beer)
-    except mongoengine.DoesNotExist:
+    if not ObjectId.is_valid(rid):
+        return flask.Response('Invalid review id {}'.format(rid), 400)
+
+    # only the request that actually removed the review takes it off the
+    # beer's rating
+    review = Review._get_collection().find_one_and_delete(
+        {'_id': ObjectId(rid), 'beer': beer.id}, {'overall': True})
+
+    if review is None:
         return flask.Response('No review with id {} found'.format(rid), 404)
-    except:
-        return flask.Response('Invalid review id {}'.format(id), 400)
 
-    review.delete()
+    if review.get('overall') is not None:
+        rate(beer, -hundredths(review['overall']), -1)
+
+    bump('beer', 'beer:{}'.format(id), 'reviews:{}'.format(id),
+         'review:{}'.format(rid))
 
     return JSONResponse()
 
 
-@bp.route('/beers/<id>/reviews/<rid>', methods=['PUT'])
+@bp.route('/beers/<id>/reviews/<rid>', methods=['PUT', 'PATCH'])
 @login_required
 def put(id, rid):
-    """Updates the given review for a beer by ids"""
-
-    try:
-        beer = Beer.objects.get(id=id)
-    except mongoengine.DoesNotExist:
-        return flask.Response('No beer with id {} found'.format(id), 404)
-    except:
-        return flask.Resposne('Invalid beer id {}'.format(id), 400)
-
-    try:
-        review = Review.objects.get(id=rid, beer=beer)
-    except mongoengine.DoesNotExist:
-        return flask.Response('No review with id {} found'.format(rid), 404)
-    except:
-        return flask.Response('Invalid review id {}'.format(id), 400)
-
-    data = flask.request.get_json()
+    """Updates the given scores of a review for a beer by ids, recalculating
+    its overall rating in the same update, and returns it as it is
+    afterwards"""
 
-    # update an of our simple fields
-    props = ['aroma', 'appearance', 'taste', 'palate', 'bottle_style']
-    for item in props:
-        if item in data:
-            setattr(review, item, data[item])
+    if not ObjectId.is_valid(id):
+        return flask.Response('Invalid beer id {}'.format(id), 400)
 
-    review.calculate()
+    if not ObjectId.is_valid(rid):
+        return flask.Response('Invalid review id {}'.format(rid), 400)
 
     try:
-        review.save()
+        update = get_update(Review, flask.request.get_json(), Review.scores)
     except mongoengine.ValidationError as exp:
         return flask.Response('{}'.format(exp), 400)
 
-    beer.rating = Review.objects.all().filter(beer=beer).average('overall')
-    beer.save()
-
-    return JSONResponse(review.to_json())
+    # an update pipeline, so the overall rating is calculated from the
+    # scores after the others are set
+    pipeline = []
+    if '$set' in update:
+        pipeline.append({'$set': dict((key, {'$literal': value})
+                                      for key, value in update['$set'].items())})
+    if '$unset' in update:
+        pipeline.append({'$unset': [key for key in update['$unset']]})
+    pipeline.append({'$set': {'overall': OVERALL}})
+
+    # the review as it was, which the one written is worked out from, so the
+    # beer's rating can be moved by the difference
+    review = Review._get_collection().find_one_and_update(
+        {'_id': ObjectId(rid), 'beer': ObjectId(id)}, pipeline,
+        return_document=ReturnDocument.BEFORE)
+
+    if review is None:
+        return flask.Response('No review with id {} found for beer {}'.format(rid, id),
+                              404)
+
+    previous = review.get('overall')
+
+    review.update(update.get('$set', {}))
+    for key in update.get('$unset', {}):
+        review.pop(key, None)
+    review['overall'] = overall(review)
+
+    beer = Beer(id=ObjectId(id))
+
+    if previous is None:
+        rate(beer, hundredths(review['overall']), 1)
+    else:
+        rate(beer, hundredths(review['overall']) - hundredths(previous), 0)
 
+    bump('beer', 'beer:{}'.format(id), 'reviews:{}'.format(id),
+         'review:{}'.format(rid))
 
+    return JSONResponse(encoder(Review).encode(review))
@@ -0,0 +1,260 @@
+"""This module contains the search over beers and breweries and the completion
+of beer names.  Both are answered from in memory indexes, which are built
+when the server starts and kept up to date by the write handlers of this
+process.  Writes made by other processes are noticed from the version
+counters, and the indexes are then rebuilt in the background.
+"""
+
+import json
+import threading
+import time
+
+import flask
+from bson import ObjectId, json_util
+
+from beerpi import version
+from beerpi.json import JSONResponse
+from beerpi.serialize import encoder
+from beerpi.text import TextIndex
+from beerpi.users import login_required
+
+
+# the property each kind is listed by, and the other properties searched
+FIELDS = {
+    'beer': ('name', ['style']),
+    'brewery': ('name', ['city', 'state']),
+}
+
+KINDS = sorted(FIELDS.keys())
+
+# the version counter bumped by the writes that change what is searched,
+# which are the only ones the indexes have to be rebuilt for.  the writes
+# bumping the beer or brewery counters for their other properties, like the
+# ratings and favorite counts, leave it alone
+COUNTERS = ['search']
+
+# the indexes of each kind, the version counters they're up to date with and
+# when they were last built
+_state = {
+    'indexes': None,
+    'versions': None,
+    'built': 0,
+    'building': False,
+}
+
+_lock = threading.Lock()
+
+# held for the whole of a build, so only one runs at a time
+_building = threading.RLock()
+
+
+def _documents():
+    # the documents import the write handlers, which import this
+    from beerpi.beer import Beer
+    from beerpi.brewery import Brewery
+
+    return {'beer': Beer, 'brewery': Brewery}
+
+
+def build():
+    """Reads every beer and brewery into new indexes and swaps them in"""
+
+    with _building:
+        with _lock:
+            _state['building'] = True
+            _state['built'] = time.time()
+
+        try:
+            # read first, anything written while reading is picked up by
+            # the next build
+            versions = version.current(COUNTERS)
+            indexes = {}
+
+            for kind, document in _documents().items():
+                title, others = FIELDS[kind]
+
+                rows = document.objects.only(title, *others).as_pymongo()
+
+                indexes[kind] = TextIndex()
+                indexes[kind].add_many((row['_id'], row.get(title),
+                                        [row.get(other) for other in others])
+                                       for row in rows)
+
+            with _lock:
+                _state['indexes'] = indexes
+                _state['versions'] = versions
+        finally:
+            with _lock:
+                _state['building'] = False
+
+
+def _refresh():
+    """Builds the indexes if they haven't been, and starts rebuilding them if
+    another process has written to the beers or breweries since they were"""
+
+    if _state['indexes'] is None:
+        with _building:
+            if _state['indexes'] is None:
+                build()
+
+        return
+
+    interval = flask.current_app.config['SEARCH_REBUILD_INTERVAL']
+
+    with _lock:
+        if _state['building'] or _state['built'] + interval > time.time():
+            return
+
+    # the counters may be read from mongo, which isn't done holding the lock
+    versions = version.current(COUNTERS)
+
+    with _lock:
+        if _state['building'] or versions == _state['versions']:
+            return
+
+        _state['building'] = True
+
+    app = flask.current_app._get_current_object()
+
+    def rebuild():
+        with app.app_context():
+            build()
+
+    threading.Thread(target=rebuild, daemon=True).start()
+
+
+def searched(kind, update):
+    """Returns whether the given update of a document of the given kind
+    changes a property that is searched"""
+
+    title, others = FIELDS[kind]
+    fields = [title] + others
+
+    return any(field in update.get(operator, {}) for field in fields
+               for operator in ['$set', '$unset'])
+
+
+def index(kind, docs):
+    """Adds or updates the given documents in the index of the given kind"""
+
+    indexes = _state['indexes']
+    if indexes is None:
+        return
+
+    title, others = FIELDS[kind]
+
+    for doc in docs:
+        indexes[kind].add(doc.id, getattr(doc, title),
+                          [getattr(doc, other) for other in others])
+
+
+def unindex(kind, id):
+    """Drops the document with the given id from the index of the given
+    kind"""
+
+    indexes = _state['indexes']
+    if indexes is not None:
+        indexes[kind].remove(ObjectId(id))
+
+
+def _bumped(names):
+    # this process's writes are already in the indexes, so they don't make
+    # them out of date
+    with _lock:
+        if _state['versions'] is None:
+            return
+
+        for position, name in enumerate(COUNTERS):
+            if name in names:
+                _state['versions'][position] += 1
+
+version.listeners.append(_bumped)
+
+
+def _limit(default):
+    """Returns the number of results asked for, up to SEARCH_LIMIT_MAX"""
+
+    value = flask.request.values.get('limit', default)
+
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('Invalid limit {}'.format(value))
+
+    if limit < 1:
+        raise ValueError('Invalid limit {}'.format(limit))
+
+    return min(limit, flask.current_app.config['SEARCH_LIMIT_MAX'])
+
+
+bp = flask.Blueprint('search', __name__)
+
+@bp.route('/search', methods=['GET'])
+@login_required
+def search():
+    """Returns the beers and breweries best matching the query, best first"""
+
+    if not 'q' in flask.request.values:
+        return flask.Response('No query specified', 400)
+
+    try:
+        limit = _limit(flask.current_app.config['SEARCH_LIMIT'])
+    except ValueError as exp:
+        return flask.Response('{}'.format(exp), 400)
+
+    _refresh()
+
+    indexes = _state['indexes']
+    query = flask.request.values['q']
+
+    found = [(score, kind, id) for kind in KINDS
+             for id, score in indexes[kind].search(query, limit)]
+    found = sorted(found, key=lambda item: item[0], reverse=True)[:limit]
+
+    # read the documents found of each kind with one query
+    rows = {}
+    for kind, document in _documents().items():
+        ids = [id for _, other, id in found if other == kind]
+
+        if len(ids) > 0:
+            rows.update(((kind, row['_id']), row) for row in
+                        document.objects(id__in=ids).as_pymongo())
+
+    results = []
+    for score, kind, id in found:
+        row = rows.get((kind, id))
+
+        # deleted by another process since the index was built
+        if row is None:
+            continue
+
+        results.append({
+            'type': kind,
+            'score': score,
+            'document': encoder(_documents()[kind]).convert(row),
+        })
+
+    return JSONResponse(json.dumps(results, default=json_util.default))
+
+
+@bp.route('/beers/_suggest', methods=['GET'])
+@login_required
+def suggest():
+    """Returns the ids and names of the beers with a word in their name
+    starting with the given prefix"""
+
+    if not 'prefix' in flask.request.values:
+        return flask.Response('No prefix specified', 400)
+
+    try:
+        limit = _limit(10)
+    except ValueError as exp:
+        return flask.Response('{}'.format(exp), 400)
+
+    _refresh()
+
+    found = _state['indexes']['beer'].suggest(flask.request.values['prefix'], limit)
+
+    rows = [{'_id': id, 'name': name} for id, name in found]
+
+    return JSONResponse(encoder(_documents()['beer']).encode_many(rows))
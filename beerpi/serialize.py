@@ -0,0 +1,102 @@
+"""This module contains the encoders that write raw documents out as JSON
+without loading them into their Document classes.  The output is the same
+as the to_json of the documents would give.
+"""
+
+import json
+from datetime import datetime
+
+from bson import ObjectId, json_util
+from mongoengine import fields
+
+
+def _oid(value):
+    return {'$oid': str(value)}
+
+
+# the field types whose values have to be converted, the type of the values
+# they hold and how they are converted
+CONVERTERS = [
+    ((fields.ObjectIdField, fields.ReferenceField), ObjectId, _oid),
+    ((fields.DateTimeField,), datetime, json_util.default),
+]
+
+
+class Encoder(object):
+    """Encodes the raw documents of one Document class.  The conversions of
+    its fields are looked up once, values of any other type are left to
+    json_util.  The private fields are never written out.
+    """
+
+    def __init__(self, document, private=()):
+        self.document = document
+        self.private = frozenset(document._fields[name].db_field for name in private)
+        self.converters = {}
+
+        for field in document._fields.values():
+            for types, kind, convert in CONVERTERS:
+                if isinstance(field, types):
+                    self.converters[field.db_field] = (kind, convert)
+
+    def convert(self, row):
+        """Returns a copy of the raw document JSON can encode"""
+
+        converted = {}
+
+        for key, value in row.items():
+            if key in self.private:
+                continue
+
+            if key in self.converters:
+                kind, convert = self.converters[key]
+
+                # expanded references hold the document instead of its id
+                if isinstance(value, kind):
+                    value = convert(value)
+
+            converted[key] = value
+
+        return converted
+
+    def encode(self, row):
+        """Encodes a single raw document"""
+
+        return json.dumps(self.convert(row), default=json_util.default)
+
+    def encode_many(self, rows):
+        """Encodes an iterable of raw documents as a JSON list"""
+
+        return json.dumps([self.convert(row) for row in rows],
+                          default=json_util.default)
+
+
+# Document class -> its Encoder
+_encoders = {}
+
+
+def register(document, private):
+    """Sets the fields of the given Document class that are never written
+    out"""
+
+    _encoders[document] = Encoder(document, private)
+
+
+def encoder(document):
+    """Returns the encoder of the given Document class"""
+
+    if not document in _encoders:
+        _encoders[document] = Encoder(document)
+
+    return _encoders[document]
+
+
+def dumps(document, rows):
+    """Encodes raw documents of the given Document class as a JSON list"""
+
+    return encoder(document).encode_many(rows)
+
+
+def dump(doc):
+    """Encodes a loaded document, leaving out its private fields"""
+
+    return encoder(type(doc)).encode(doc.to_mongo())
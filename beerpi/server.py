@@ -0,0 +1,236 @@
+"""This module contains the Tornado front end of the application.  The WSGI
+application is run on a pool of threads so a slow request doesn't hold up
+the IOLoop, which keeps accepting and parsing the others.
+"""
+
+import json
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+
+from tornado import escape, gen, web
+from tornado.concurrent import chain_future
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+
+
+class Stats(object):
+    """Keeps track of how many requests are waiting for a thread, how many
+    are running and how long they waited, and how many requests of any kind
+    are open"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.open = 0
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.waited = 0.0
+        self.waited_max = 0.0
+
+    def opened(self):
+        with self.lock:
+            self.open += 1
+
+    def closed(self):
+        with self.lock:
+            self.open -= 1
+
+    def submitted(self):
+        with self.lock:
+            self.queued += 1
+
+    def started(self, waited):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+            self.waited += waited
+            self.waited_max = max(self.waited_max, waited)
+
+    def finished(self):
+        with self.lock:
+            self.running -= 1
+            self.completed += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'open': self.open,
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'wait_seconds_total': self.waited,
+                'wait_seconds_max': self.waited_max,
+            }
+
+
+stats = Stats()
+
+
+def make_environ(request):
+    """Converts a Tornado request into a WSGI environment"""
+
+    hostport = request.host.split(':')
+    if len(hostport) == 2:
+        host = hostport[0]
+        port = int(hostport[1])
+    else:
+        host = request.host
+        port = request.protocol == 'https' and 443 or 80
+
+    path = escape.url_unescape(request.path, encoding=None, plus=False)
+
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path.decode('latin1'),
+        'QUERY_STRING': request.query,
+        'REMOTE_ADDR': request.remote_ip,
+        'SERVER_NAME': host,
+        'SERVER_PORT': str(port),
+        'SERVER_PROTOCOL': request.version,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': request.protocol,
+        'wsgi.input': BytesIO(escape.utf8(request.body)),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+    for key, value in request.headers.items():
+        if key == 'Content-Type':
+            environ['CONTENT_TYPE'] = value
+        elif key == 'Content-Length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            environ['HTTP_' + key.replace('-', '_').upper()] = value
+
+    return environ
+
+
+class WSGIHandler(web.RequestHandler):
+    """Runs a request through the WSGI application on the thread pool.  The
+    status, headers and body are handed back to the IOLoop as the application
+    produces them, so streamed responses are written out as they're made.
+    The thread waits for each chunk to be sent before making the next, so a
+    slow client holds back its own response instead of having all of it
+    buffered.
+    """
+
+    # whether the request is still counted as open
+    counted = False
+
+    def initialize(self, app, executor):
+        self.app = app
+        self.executor = executor
+
+        self.counted = True
+        stats.opened()
+
+    def on_finish(self):
+        self.uncount()
+
+    def on_connection_close(self):
+        self.uncount()
+
+    def uncount(self):
+        """Stops counting the request as open, once however it ends"""
+
+        if self.counted:
+            self.counted = False
+            stats.closed()
+
+    def compute_etag(self):
+        # the application sets its own
+        return None
+
+    @gen.coroutine
+    def prepare(self):
+        environ = make_environ(self.request)
+
+        stats.submitted()
+
+        yield self.executor.submit(self.call, IOLoop.current(), environ, time.time())
+
+        self.finish()
+
+    def call(self, loop, environ, submitted):
+        """Calls the application, this runs on a pool thread"""
+
+        stats.started(time.time() - submitted)
+
+        def send(data):
+            sent = Future()
+            loop.add_callback(self.send, data, sent)
+
+            sent.result()
+
+        try:
+            def start_response(status, headers, exc_info=None):
+                loop.add_callback(self.start, status, headers)
+
+                return send
+
+            body = self.app(environ, start_response)
+
+            try:
+                for chunk in body:
+                    if chunk:
+                        send(chunk)
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+        except StreamClosedError:
+            # the client went away, so the rest of the body isn't made
+            pass
+        finally:
+            stats.finished()
+
+    def start(self, status, headers):
+        code, reason = status.split(' ', 1)
+
+        self.clear()
+        self.clear_header('Content-Type')
+        self.set_status(int(code), reason)
+
+        for key, value in headers:
+            self.add_header(key, value)
+
+    def send(self, data, sent):
+        """Writes a chunk and resolves the given future once it's sent"""
+
+        try:
+            self.write(data)
+            chain_future(self.flush(), sent)
+        except Exception as exp:
+            sent.set_exception(exp)
+
+
+class PoolHandler(web.RequestHandler):
+    """Returns the queue and wait time counters of the thread pool"""
+
+    def get(self):
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps(stats.snapshot()))
+
+
+def application(app, threads, db=None):
+    """Returns the Tornado application serving the given WSGI application on
+    a pool of the given number of threads.  If a motor database is given the
+    busiest GETs are served natively from it."""
+
+    executor = ThreadPoolExecutor(threads)
+
+    handlers = [(r'/server/pool', PoolHandler)]
+
+    if db is not None:
+        from beerpi import native
+        handlers += native.routes(app, executor, db)
+
+    handlers.append((r'.*', WSGIHandler, {'app': app, 'executor': executor}))
+
+    return web.Application(handlers, executor=executor)
@@ -1,11 +1,97 @@
 """This file contains the site specific configuration details"""
 
+# with connect off, the connection is only opened by the first query
 MONGODB_SETTINGS = {
     'DB': 'beerpi',
     'host': 'localhost',
-    'port': 27017
+    'port': 27017,
+    'connect': False,
 }
 
+# register every blueprint found in the package instead of only the ones
+# listed in beerpi/blueprints.py
+DISCOVER_BLUEPRINTS = False
+
+# create any missing index when the application starts, this can be left off
+# if `manage.py ensure-indexes` is run on every deploy instead
+ENSURE_INDEXES = True
+
 LISTEN_PORT = 8080
 LISTEN_ADDRESS = '0.0.0.0'
 
+# the number of server processes forked by wsgi.py, 0 for one per core.
+# workers that send no heartbeat for WORKER_TIMEOUT seconds are replaced,
+# and a stopping worker is given GRACEFUL_TIMEOUT seconds to finish up.
+WORKERS = 1
+WORKER_TIMEOUT = 60
+GRACEFUL_TIMEOUT = 10
+
+# the number of threads each server process runs requests on
+THREAD_POOL_SIZE = 16
+
+# serve GETs of the beers and their reviews straight from the IOLoop with
+# motor instead of on the thread pool, if motor is installed
+NATIVE_READS = True
+
+# the key bearer tokens are signed with, which must be a long random secret
+# set per site and the same for every process serving the site.  until it is
+# set no token is issued or accepted, and only basic authentication works
+SECRET_KEY = None
+
+# the usernames of the users allowed to use the /admin routes
+ADMINS = ['admin']
+
+# how many seconds a bearer token is valid for, and how many seconds a
+# process may go without checking whether a user's tokens were revoked
+TOKEN_LIFETIME = 900
+TOKEN_GENERATION_TTL = 30
+
+# the page size used when only a cursor is given, and the largest page size
+# a client may ask for
+PAGE_LIMIT = 100
+PAGE_LIMIT_MAX = 1000
+
+# the number of documents read from mongo and written out at a time when a
+# list is streamed
+STREAM_BATCH_SIZE = 500
+
+# how many seconds a process trusts the version counters it has read before
+# reading them again, which bounds how long the writes of other processes
+# can go unnoticed by the ETags and the response cache
+VERSION_POLL_INTERVAL = 1
+
+# the number of responses of the glasses, breweries and review summaries
+# cached per process, and how many seconds one is kept for at most
+CACHE_SIZE = 256
+CACHE_TTL = 300
+
+# the leaderboard ranks the beers with at least TOP_MIN_REVIEWS reviews by
+# their average rating pulled towards TOP_PRIOR_MEAN, as if every beer had
+# TOP_PRIOR_WEIGHT more reviews of that, so a beer with a few great reviews
+# doesn't outrank one with hundreds of good ones.  changing the minimum needs
+# the leaderboard indexes dropped and `manage.py ensure-indexes` run, changing
+# the prior needs `manage.py rebuild-ratings` run
+TOP_MIN_REVIEWS = 5
+TOP_PRIOR_MEAN = 3.0
+TOP_PRIOR_WEIGHT = 10
+TOP_MAX = 100
+
+# the least number of seconds between rebuilds of the search indexes when
+# another process has written to the beers or breweries, and the default and
+# largest number of search results
+SEARCH_REBUILD_INTERVAL = 60
+SEARCH_LIMIT = 20
+SEARCH_LIMIT_MAX = 100
+
+# mongo commands taking longer than SLOW_QUERY_MS are recorded with the
+# endpoint that sent them and the shape of their query, None turns this off.
+# each is written to SLOW_QUERY_LOG with the id of the process added to its
+# name, so `slow-queries.log` becomes `slow-queries.<pid>.log`, rotated at
+# SLOW_QUERY_LOG_BYTES with SLOW_QUERY_LOG_COUNT old files kept (None writes
+# no file), and the SLOW_QUERY_SHAPES most recently seen shapes are listed by
+# /admin/slow
+SLOW_QUERY_MS = 100
+SLOW_QUERY_LOG = 'slow-queries.log'
+SLOW_QUERY_LOG_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_LOG_COUNT = 5
+SLOW_QUERY_SHAPES = 500
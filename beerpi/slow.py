@@ -0,0 +1,374 @@
+"""This module contains the log of slow mongo commands.  A pymongo command
+listener records every command taking longer than SLOW_QUERY_MS along with
+the endpoint that sent it and the shape of its filter, sort and projection,
+with the values left out.  Each one is written to a rotating log file, and
+the commands of the same shape are counted up so the admin routes can list
+them by how slow they are and explain the plan of the last one.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from logging.handlers import RotatingFileHandler
+
+import flask
+import mongoengine
+from bson import SON, json_util
+from pymongo import monitoring
+
+from beerpi.json import JSONResponse
+from beerpi.users import admin_required
+
+
+# the commands that are never recorded
+IGNORED = set(['explain', 'getMore', 'endSessions', 'killCursors', 'ismaster',
+               'isMaster', 'hello', 'ping', 'buildInfo', 'saslStart',
+               'saslContinue', 'authenticate', 'getnonce'])
+
+# the commands mongo can explain
+EXPLAINABLE = set(['find', 'aggregate', 'count', 'distinct', 'update',
+                   'delete', 'findAndModify'])
+
+# the properties of a command whose values are part of its shape, the rest
+# are left out
+KEPT = set(['sort', '$sort', 'projection', '$project', 'hint'])
+
+# the properties of a command that are only for the wire, and are dropped
+# before it is explained
+WIRE = set(['lsid', 'txnNumber', 'autocommit', 'startTransaction'])
+
+# the properties of mongo's plans that describe the plan rather than hold
+# values of the command, which are returned as they are by the explain
+PLAN = set(['stage', 'namespace', 'indexName', 'keyPattern', 'sortPattern',
+            'direction', 'isMultiKey', 'multiKeyPaths', 'isUnique', 'isSparse',
+            'isPartial', 'indexVersion', 'indexFilterSet', 'planCacheKey',
+            'queryHash', 'plannerVersion', 'explainVersion', 'limitAmount',
+            'skipAmount', 'serverInfo', 'ok'])
+
+# the durations kept per shape to work out the 95th percentile from
+SAMPLES = 200
+
+
+log = logging.getLogger('beerpi.slow')
+log.propagate = False
+
+
+def redact(value):
+    """Returns the shape of the value, with every value that isn't a field
+    path replaced by '?'"""
+
+    if isinstance(value, dict):
+        return OrderedDict((key, key in KEPT and value[key] or redact(value[key]))
+                           for key in value)
+
+    if isinstance(value, (list, tuple)):
+        if len(value) > 0 and all(isinstance(item, dict) for item in value):
+            return [redact(item) for item in value]
+
+        return '?'
+
+    if isinstance(value, str) and value.startswith('$'):
+        return value
+
+    return '?'
+
+
+def redact_plan(value, key=None):
+    """Returns mongo's plan with every value of the command in it, such as
+    its parsed filter, index bounds and the command itself, replaced by '?'
+    the way redact does.  Only the properties describing the plan are kept.
+    """
+
+    if key in PLAN or key in KEPT:
+        return value
+
+    if isinstance(value, dict):
+        return OrderedDict((name, redact_plan(value[name], name)) for name in value)
+
+    if isinstance(value, (list, tuple)):
+        return [redact_plan(item, key) for item in value]
+
+    return redact(value)
+
+
+def shape(command):
+    """Returns the name, collection and redacted shape of the command"""
+
+    name = next(iter(command))
+    collection = command[name]
+
+    found = OrderedDict()
+    for key, value in command.items():
+        if key == name or key.startswith('$') or key in WIRE:
+            continue
+
+        # inserts only ever differ by their documents
+        if key == 'documents':
+            found[key] = '?'
+        else:
+            found[key] = key in KEPT and value or redact(value)
+
+    return name, isinstance(collection, str) and collection or '', found
+
+
+class Slow(object):
+    """The slow commands of one shape sent by one endpoint"""
+
+    def __init__(self, id, name, collection, endpoint, found):
+        self.id = id
+        self.name = name
+        self.collection = collection
+        self.endpoint = endpoint
+        self.shape = found
+
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.durations = deque(maxlen=SAMPLES)
+        self.first = self.last = time.time()
+
+        # the last command itself, values and all, which is only kept in
+        # memory to be explained
+        self.database = None
+        self.command = None
+
+    def add(self, seconds, database, command):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.durations.append(seconds)
+        self.last = time.time()
+
+        self.database = database
+        self.command = command
+
+    def p95(self):
+        durations = sorted(self.durations)
+
+        return durations[min(int(len(durations) * .95), len(durations) - 1)]
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'command': self.name,
+            'collection': self.collection,
+            'endpoint': self.endpoint,
+            'shape': self.shape,
+            'count': self.count,
+            'total_ms': round(self.total * 1000, 3),
+            'p95_ms': round(self.p95() * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+            'first': self.first,
+            'last': self.last,
+            'explainable': self.name in EXPLAINABLE,
+        }
+
+
+class Recorder(object):
+    """Keeps the slow commands by shape, dropping the least recently seen
+    shape once there are more than the given number of them"""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, endpoint, database, command, seconds):
+        name, collection, found = shape(command)
+
+        text = json.dumps([name, collection, endpoint, found], default=str)
+        id = hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+        with self.lock:
+            entry = self.entries.get(id)
+            if entry is None:
+                entry = self.entries[id] = Slow(id, name, collection, endpoint, found)
+
+            entry.add(seconds, database, command)
+            self.entries.move_to_end(id)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+        return entry
+
+    def get(self, id):
+        with self.lock:
+            return self.entries.get(id)
+
+    def all(self):
+        with self.lock:
+            return [entry.to_dict() for entry in self.entries.values()]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class CommandListener(monitoring.CommandListener):
+    """Holds on to each command until it finishes and records it if it took
+    longer than the threshold.  Only the commands over it are looked at any
+    closer, so the rest cost two dictionary operations."""
+
+    def __init__(self, recorder, threshold):
+        self.recorder = recorder
+        self.threshold = threshold
+        self.pending = {}
+
+    def started(self, event):
+        if not event.command_name in IGNORED:
+            self.pending[(event.connection_id, event.request_id)] = \
+                (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self.finished(event)
+
+    def failed(self, event):
+        self.finished(event)
+
+    def finished(self, event):
+        started = self.pending.pop((event.connection_id, event.request_id), None)
+
+        if started is None or event.duration_micros < self.threshold:
+            return
+
+        database, command = started
+        seconds = event.duration_micros / 1e6
+
+        # the listener runs on the thread sending the command, so this is the
+        # request that did, streamed bodies included
+        endpoint = flask.has_request_context() and flask.request.endpoint or ''
+
+        entry = self.recorder.add(endpoint, database, command, seconds)
+
+        _write({
+            'time': time.time(),
+            'id': entry.id,
+            'endpoint': endpoint,
+            'command': entry.name,
+            'collection': entry.collection,
+            'shape': entry.shape,
+            'ms': round(seconds * 1000, 3),
+            'failed': isinstance(event, monitoring.CommandFailedEvent),
+        })
+
+
+recorder = None
+
+_config = {}
+
+_lock = threading.Lock()
+
+
+def _path(pid):
+    """Returns the file the given process writes its slow commands to.  Each
+    process has its own, so the workers never rotate a file underneath each
+    other."""
+
+    root, ext = os.path.splitext(_config['path'])
+
+    return '{}.{}{}'.format(root, pid, ext)
+
+
+def _write(record):
+    # the file is opened by the process writing to it, after any fork, and
+    # one inherited from the process it was forked from is put down
+    pid = os.getpid()
+
+    if _config.get('path') and _config.get('pid') != pid:
+        with _lock:
+            if _config.get('pid') != pid:
+                for handler in log.handlers[:]:
+                    log.removeHandler(handler)
+                    handler.close()
+
+                log.addHandler(RotatingFileHandler(_path(pid),
+                                                   maxBytes=_config['bytes'],
+                                                   backupCount=_config['count']))
+                log.setLevel(logging.INFO)
+
+                _config['pid'] = pid
+
+    if len(log.handlers) > 0:
+        log.info(json.dumps(record, default=str))
+
+
+def install(app):
+    """Registers the command listener with the thresholds of the given app,
+    unless SLOW_QUERY_MS is None.  Only clients made afterwards are listened
+    to, so this has to be called before the connection is made."""
+
+    global recorder
+
+    config = app.config
+    if config['SLOW_QUERY_MS'] is None or recorder is not None:
+        return
+
+    _config.update(path=config['SLOW_QUERY_LOG'], bytes=config['SLOW_QUERY_LOG_BYTES'],
+                   count=config['SLOW_QUERY_LOG_COUNT'])
+
+    recorder = Recorder(config['SLOW_QUERY_SHAPES'])
+    monitoring.register(CommandListener(recorder, config['SLOW_QUERY_MS'] * 1000))
+
+
+def explain(entry):
+    """Returns mongo's plan for the last command recorded for the entry"""
+
+    command = SON((key, value) for key, value in entry.command.items()
+                  if not key.startswith('$') and not key in WIRE)
+
+    client = mongoengine.connection.get_connection()
+
+    return client[entry.database].command(SON([('explain', command),
+                                               ('verbosity', 'queryPlanner')]))
+
+
+###############################################################################
+# Views
+###############################################################################
+bp = flask.Blueprint('slow', __name__)
+
+@bp.route('/admin/slow', methods=['GET'])
+@admin_required
+def list():
+    """Returns the shapes of the slow commands, slowest first"""
+
+    if recorder is None:
+        return flask.Response('The slow query log is off', 404)
+
+    entries = sorted(recorder.all(), key=lambda entry: entry['p95_ms'], reverse=True)
+
+    return JSONResponse(json.dumps(entries, default=str))
+
+
+@bp.route('/admin/slow', methods=['DELETE'])
+@admin_required
+def clear():
+    """Forgets every slow command recorded"""
+
+    if recorder is None:
+        return flask.Response('The slow query log is off', 404)
+
+    recorder.clear()
+
+    return JSONResponse()
+
+
+@bp.route('/admin/slow/<id>/explain', methods=['GET'])
+@admin_required
+def get(id):
+    """Returns the plan mongo would use for the last slow command of the
+    given shape, with the values of the command left out"""
+
+    entry = recorder is not None and recorder.get(id) or None
+    if entry is None:
+        return flask.Response('No slow command with id {} found'.format(id), 404)
+
+    if not entry.name in EXPLAINABLE:
+        return flask.Response('A {} can\'t be explained'.format(entry.name), 400)
+
+    return JSONResponse(json_util.dumps(redact_plan(explain(entry))))
@@ -0,0 +1,230 @@
+"""This module contains an in memory index for searching short texts by the
+trigrams of their words and for completing words by their prefixes"""
+
+import bisect
+import heapq
+import re
+import threading
+from collections import Counter
+from itertools import chain
+from operator import itemgetter
+
+
+def normalize(text):
+    """Lowercases the text and reduces it to its letters and digits, with a
+    single space between words"""
+
+    return ' '.join(re.findall(r'\w+', (text or '').lower()))
+
+
+def trigrams(text):
+    """Returns the trigrams of every word of the normalized text, with the
+    words padded so short words and word boundaries count too"""
+
+    grams = set()
+
+    for word in text.split():
+        padded = ' {} '.format(word)
+        grams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+
+    return grams
+
+
+class TextIndex(object):
+    """Maps the trigrams of the titles and of the other texts of every entry
+    to the entries they're in, and keeps the words of the titles sorted for
+    prefix lookups.  Entries are numbered internally so the postings are sets
+    of small integers.  It is safe to use from several threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+
+        self.titles = {}
+        self.texts = {}
+        self.prefixes = []
+
+        # key -> number, number -> (key, title, normalized title, the other
+        # texts normalized)
+        self.numbers = {}
+        self.entries = {}
+        self.next = 0
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def add(self, key, title, texts):
+        """Indexes the title and texts of the given entry, replacing whatever
+        was indexed for it before"""
+
+        with self.lock:
+            self._add(key, title, texts, lambda item: bisect.insort(self.prefixes, item))
+
+    def add_many(self, items):
+        """Indexes every given key, title and texts, sorting the prefixes once
+        at the end instead of inserting each in place.  The entries are
+        numbered from the shortest title to the longest, which is how search
+        breaks ties without looking at them."""
+
+        items = sorted(items, key=lambda item: len(item[1] or ''))
+
+        with self.lock:
+            for key, title, texts in items:
+                self._add(key, title, texts, self.prefixes.append)
+
+            self.prefixes.sort()
+
+    def _add(self, key, title, texts, insert):
+        self.remove(key)
+
+        number = self.next
+        self.next += 1
+
+        name = normalize(title)
+        other = normalize(' '.join(text or '' for text in texts))
+
+        self.numbers[key] = number
+        self.entries[number] = (key, title, name, other)
+
+        for gram in trigrams(name):
+            self.titles.setdefault(gram, set()).add(number)
+
+        for gram in trigrams(other):
+            self.texts.setdefault(gram, set()).add(number)
+
+        for prefix in self._prefixes(name):
+            insert((prefix, number))
+
+    def remove(self, key):
+        """Drops the given entry, if it was indexed"""
+
+        with self.lock:
+            number = self.numbers.pop(key, None)
+            if number is None:
+                return
+
+            _, _, name, other = self.entries.pop(number)
+
+            for gram in trigrams(name):
+                self._discard(self.titles, gram, number)
+
+            for gram in trigrams(other):
+                self._discard(self.texts, gram, number)
+
+            for prefix in self._prefixes(name):
+                index = bisect.bisect_left(self.prefixes, (prefix, number))
+                if index < len(self.prefixes) and self.prefixes[index] == (prefix, number):
+                    del self.prefixes[index]
+
+    def _discard(self, grams, gram, number):
+        posting = grams.get(gram)
+        if posting is None:
+            return
+
+        posting.discard(number)
+        if len(posting) == 0:
+            del grams[gram]
+
+    def _prefixes(self, name):
+        """Returns the name from the start of each of its words"""
+
+        words = name.split()
+
+        return set(' '.join(words[index:]) for index in range(len(words)))
+
+    def _match(self, postings, limit, found):
+        """Returns up to limit of the entries in every one of the postings,
+        leaving out the ones already found.  The lowest numbers have the
+        shortest titles, so those are taken."""
+
+        postings = sorted(postings, key=len)
+        matched = postings[0].intersection(*postings[1:]) - found
+
+        return heapq.nsmallest(limit, matched)
+
+    def search(self, query, limit=20):
+        """Returns up to limit keys and scores of the entries best matching
+        the query, best first.  Entries with every trigram of the query in
+        their title come first, then ones with every trigram in any of their
+        texts, both found by intersecting postings.  Only if there are none
+        of those, entries sharing at least half of the trigrams are counted
+        up, which lets misspelt queries match.
+        """
+
+        name = normalize(query)
+        grams = trigrams(name)
+        if len(grams) == 0:
+            return []
+
+        empty = set()
+
+        with self.lock:
+            titles = [self.titles.get(gram, empty) for gram in grams]
+            best = self._match(titles, limit, empty)
+
+            if len(best) < limit:
+                either = [posting | self.texts.get(gram, empty)
+                          for gram, posting in zip(grams, titles)]
+                best += self._match(either, limit - len(best), set(best))
+
+                if len(best) == 0:
+                    need = (len(grams) + 1) // 2
+                    rarest = sorted(either, key=len)
+                    # anything sharing half of the trigrams is in at least
+                    # one of the rarest ones, so only those are read in full
+                    counts = Counter(chain.from_iterable(rarest[:len(grams) - need + 1]))
+
+                    for posting in rarest[len(grams) - need + 1:]:
+                        counts.update(posting.intersection(counts))
+
+                    best += [number for number, count in counts.most_common()
+                             if count >= need][:limit]
+
+            results = []
+            for number in best:
+                key, _, title, other = self.entries[number]
+
+                # the share of the trigrams found anywhere and in the title,
+                # and whether the title starts with the query
+                found = trigrams(title)
+                score = len(grams & (found | trigrams(other))) / len(grams)
+                score += len(grams & found) / len(grams)
+                if title.startswith(name):
+                    score += 1
+
+                results.append((key, round(score / 3, 3), -len(title)))
+
+        results.sort(key=itemgetter(1, 2), reverse=True)
+
+        return [(key, score) for key, score, _ in results]
+
+    def suggest(self, prefix, limit=10):
+        """Returns up to limit keys and titles of the entries with a word in
+        their title starting with the given prefix, in order of the text from
+        that word on"""
+
+        prefix = normalize(prefix)
+        if len(prefix) == 0:
+            return []
+
+        results = []
+        seen = set()
+
+        with self.lock:
+            index = bisect.bisect_left(self.prefixes, (prefix, -1))
+
+            while index < len(self.prefixes) and len(results) < limit:
+                text, number = self.prefixes[index]
+                if not text.startswith(prefix):
+                    break
+
+                index += 1
+
+                if number in seen:
+                    continue
+
+                seen.add(number)
+                key, title, _, _ = self.entries[number]
+                results.append((key, title))
+
+        return results
@@ -0,0 +1,131 @@
+"""This module contains the helpers for writing a document with a single
+round trip to mongo, instead of loading it and saving it back whole"""
+
+import mongoengine
+from bson import ObjectId
+from mongoengine import fields
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+def get_update(document, data, allowed):
+    """Builds the update setting the allowed properties given in the data,
+    each converted and validated by its field, and unsetting the ones given
+    as null.  References are given by id.  Raises mongoengine.ValidationError
+    if a value isn't valid.
+    """
+
+    sets = {}
+    unsets = {}
+
+    if not isinstance(data, dict):
+        raise mongoengine.ValidationError('Expected an object')
+
+    for prop in allowed:
+        if not prop in data:
+            continue
+
+        field = document._fields[prop]
+        value = data[prop]
+
+        if value is None:
+            unsets[field.db_field] = ''
+            continue
+
+        if isinstance(field, fields.ReferenceField):
+            if not ObjectId.is_valid(str(value)):
+                raise mongoengine.ValidationError('Invalid {} id {}'.format(prop, value))
+
+            sets[field.db_field] = ObjectId(str(value))
+            continue
+
+        value = field.to_python(value)
+        field.validate(value)
+
+        sets[field.db_field] = field.to_mongo(value)
+
+    update = {}
+
+    if len(sets) > 0:
+        update['$set'] = sets
+    if len(unsets) > 0:
+        update['$unset'] = unsets
+
+    return update
+
+
+def missing(document, update):
+    """Returns the name and id of the first reference the update sets to a
+    document that doesn't exist, or None if they all do"""
+
+    for prop, field in document._fields.items():
+        if not isinstance(field, fields.ReferenceField):
+            continue
+
+        id = update.get('$set', {}).get(field.db_field)
+
+        if id is not None and field.document_type.objects(id=id).only('id').first() is None:
+            return prop, id
+
+    return None
+
+
+def modify(document, query, update, projection=None, before=False):
+    """Applies the update to the document matching the query with a single
+    find_one_and_update.  Returns the raw document as it is after the update,
+    or before it if asked, or None if nothing matched.  Raises
+    mongoengine.NotUniqueError if the update breaks a unique index.
+    """
+
+    collection = document._get_collection()
+
+    # there's nothing to write, so the document is only read
+    if len(update) == 0:
+        return collection.find_one(query, projection)
+
+    returned = before and ReturnDocument.BEFORE or ReturnDocument.AFTER
+
+    try:
+        return collection.find_one_and_update(query, update, projection,
+                                              return_document=returned)
+    except DuplicateKeyError as exp:
+        raise mongoengine.NotUniqueError('{}'.format(exp))
+
+
+def get_or_create(doc, unique):
+    """Returns the raw document with the same value of the unique property as
+    the given one, inserting the given one if there isn't any, with a single
+    upsert.  Returns whether it was inserted too.  Raises
+    mongoengine.ValidationError if the given document isn't valid.
+    """
+
+    doc.validate()
+
+    son = doc.to_mongo()
+    son['_id'] = ObjectId()
+
+    field = type(doc)._fields[unique].db_field
+    query = {field: son[field]}
+    values = dict((key, value) for key, value in son.items() if key != field)
+
+    collection = type(doc)._get_collection()
+
+    # two upserts of the same document at once can both miss and insert, and
+    # the unique index fails the one that loses, which finds it the second
+    # time around
+    for attempt in range(2):
+        try:
+            found = collection.find_one_and_update(query, {'$setOnInsert': values},
+                                                   upsert=True,
+                                                   return_document=ReturnDocument.BEFORE)
+        except DuplicateKeyError:
+            if attempt > 0:
+                raise
+
+            continue
+
+        if found is None:
+            doc.id = son['_id']
+            return son.to_dict(), True
+
+        return found, False
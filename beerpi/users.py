@@ -1,15 +1,23 @@
 """This module contains the authentication code"""
 
+import base64
 import hashlib
+import hmac
 import json
+import time
 from functools import wraps
 
 import flask
 import mongoengine
+from bson import ObjectId
 
 from beerpi import db
-from beerpi.json import JSONResponse
+from beerpi.fields import select
+from beerpi.json import JSONList, JSONResponse
+from beerpi.serialize import dump, encoder, register
 from beerpi.sort import get_sort_keys
+from beerpi.update import get_update, modify
+from beerpi.version import bump, conditional
 
 class User(db.Document):
     username = db.StringField(unique=True)
@@ -18,6 +26,19 @@ class User(db.Document):
 
     last_beer_added = db.DateTimeField()
 
+    # bumped whenever the password changes to revoke every issued token
+    token_generation = db.IntField(default=0)
+
+    meta = {
+        'indexes': [
+            ('email', 'id'),
+        ]
+    }
+
+
+# user id -> (token generation, time it can be trusted until)
+_generations = {}
+
 
 def _basic_auth():
     headers = {
@@ -27,15 +48,155 @@ def _basic_auth():
     return flask.Response('Authentication Required', 401, headers)
 
 
+def _bearer_auth():
+    headers = {
+        'WWW-Authenticate': 'Bearer realm=\'beerpi\', error=\'invalid_token\'',
+    }
+
+    return flask.Response('Invalid or expired token', 401, headers)
+
+
+def _encode(data):
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _sign(payload, secret):
+    return hmac.new(secret.encode('utf-8'), payload, hashlib.sha256).digest()
+
+
+def cached_generation(id):
+    """Returns the token generation of a user if it was read recently enough
+    to be trusted, otherwise None"""
+
+    cached = _generations.get(id)
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
+
+    return None
+
+
+def remember_generation(id, generation, ttl):
+    """Trusts the given token generation of a user for ttl seconds"""
+
+    if generation is None:
+        _generations.pop(id, None)
+    else:
+        _generations[id] = (generation, time.time() + ttl)
+
+
+def _generation(id):
+    """Returns the current token generation of a user, only going to mongo
+    once the cached value is older than TOKEN_GENERATION_TTL.
+    """
+
+    cached = cached_generation(id)
+    if cached is not None:
+        return cached
+
+    try:
+        user = User.objects.only('token_generation').get(id=id)
+    except (mongoengine.DoesNotExist, mongoengine.ValidationError):
+        remember_generation(id, None, 0)
+        return None
+
+    remember_generation(id, user.token_generation or 0,
+                        flask.current_app.config['TOKEN_GENERATION_TTL'])
+
+    return user.token_generation or 0
+
+
+def hash_password(password):
+    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+
+# the placeholder the key was once shipped as, which is as good as none
+PLACEHOLDERS = ['change-me']
+
+
+def signing_key(config):
+    """Returns the key tokens are signed with, or None if the site hasn't set
+    one, in which case no token may be issued or accepted"""
+
+    secret = config.get('SECRET_KEY')
+
+    if not secret or secret in PLACEHOLDERS:
+        return None
+
+    return secret
+
+
+def make_token(user):
+    """Creates a signed token for the given user.  Returns the token and the
+    time it expires at.  SECRET_KEY has to be set.
+    """
+
+    expires = int(time.time()) + flask.current_app.config['TOKEN_LIFETIME']
+
+    payload = json.dumps({
+        'id': str(user.id),
+        'name': user.username,
+        'gen': user.token_generation or 0,
+        'exp': expires,
+    }).encode('utf-8')
+
+    secret = signing_key(flask.current_app.config)
+    if secret is None:
+        raise ValueError('No SECRET_KEY is set to sign tokens with')
+
+    return '{}.{}'.format(_encode(payload), _encode(_sign(payload, secret))), expires
+
+
+def read_token(token, secret):
+    """Returns the claims of the given token if it was signed with the given
+    secret and hasn't expired, otherwise None.  Whether it was revoked is left
+    to the caller.  Without a secret no token is valid.
+    """
+
+    if secret is None:
+        return None
+
+    try:
+        payload, signature = token.split('.')
+        payload = _decode(payload)
+        signature = _decode(signature)
+    except ValueError:
+        return None
+
+    if not hmac.compare_digest(signature, _sign(payload, secret)):
+        return None
+
+    claims = json.loads(payload.decode('utf-8'))
+
+    if claims['exp'] < time.time():
+        return None
+
+    return claims
+
+
+def verify_token(token):
+    """Returns the claims of the given token if it was signed by us, hasn't
+    expired and hasn't been revoked, otherwise None.
+    """
+
+    claims = read_token(token, signing_key(flask.current_app.config))
+
+    if claims is None or claims['gen'] != _generation(claims['id']):
+        return None
+
+    return claims
+
+
 def authenticate(username, password):
     try:
         user = User.objects.get(username=username)
     except:
         return False
 
-    hashed = hashlib.sha256(password.encode('utf-8')).hexdigest()
-
-    if user.password == hashed:
+    if user.password == hash_password(password):
         return user
 
     return None
@@ -46,13 +207,29 @@ def login_required(func):
 
     @wraps(func)
     def decorated(*args, **kwargs):
+        header = flask.request.headers.get('Authorization', '')
+
+        if header.startswith('Bearer '):
+            claims = verify_token(header[7:].strip())
+            if claims is None:
+                return _bearer_auth()
+
+            # tokens only carry the id and name of the user, anything else
+            # has to be loaded by the view that needs it
+            user = User._from_son({'_id': ObjectId(claims['id']),
+                                   'username': claims['name']})
+
+            setattr(flask.request, 'user', user)
+
+            return func(*args, **kwargs)
+
         auth = flask.request.authorization
 
         if auth is None:
             return _basic_auth()
 
         user = authenticate(auth.username, auth.password)
-        if user is None:
+        if not user:
             return _basic_auth()
 
         setattr(flask.request, 'user', user)
@@ -62,27 +239,54 @@ def login_required(func):
     return decorated
 
 
+def admin_required(func):
+    """This decorator protects the views only the users named in ADMINS may
+    use"""
+
+    @login_required
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        if not flask.request.user.username in flask.current_app.config['ADMINS']:
+            return flask.Response('Only an admin can do this', 403)
+
+        return func(*args, **kwargs)
+
+    return decorated
+
+
 ###############################################################################
 # Views
 ###############################################################################
+# the properties the user list can be sorted by
+SORTABLE = ['username', 'email']
+
+# the properties that are never returned
+PRIVATE = ['password', 'token_generation']
+
+# the properties the users can be limited to with `fields`, which can never
+# include the private ones
+SELECTABLE = SORTABLE + ['last_beer_added']
+
+register(User, PRIVATE)
+
 bp = flask.Blueprint('users', __name__)
 
 @bp.route('/users', methods=['GET'])
 @login_required
+@conditional('user')
 def list():
     """Returns a list of all users"""
 
-    users = User.objects.all().exclude('password')
+    users = User.objects.all().exclude(*PRIVATE)
+    keys = []
 
     if 'sort' in flask.request.values:
-        props = ['username', 'email']
-
-        keys = get_sort_keys(flask.request.values['sort'].split(','), props)
+        keys = get_sort_keys(flask.request.values['sort'].split(','), SORTABLE)
 
         if len(keys) > 0:
             users = users.order_by(*keys)
 
-    return JSONResponse(users.to_json())
+    return JSONList(users, keys, stream=True, selectable=SELECTABLE)
 
 
 @bp.route('/users', methods=['POST'])
@@ -95,7 +299,7 @@ def post():
     if not 'username' in data or not 'password' in data:
         return flask.Response('Username and password are required', 400)
 
-    epass = hashlib.sha256(data['password'].encode('utf-8')).hexdigest()
+    epass = hash_password(data['password'])
 
     user = User(username=data['username'],
                 password=epass,
@@ -106,28 +310,25 @@ def post():
     except mongoengine.NotUniqueError:
         return flask.Response('That user already exists', 409)
 
-    # need to find a cleaner way to serialize an object as json excluding a
-    # property...
-    clean = json.loads(user.to_json())
-    del clean['password']
-    clean = json.dumps(clean)
+    bump('user', 'user:{}'.format(user.id))
 
-    return JSONResponse(clean)
+    return JSONResponse(dump(user))
 
 
 @bp.route('/users/<id>', methods=['GET'])
 @login_required
+@conditional('user:{id}')
 def get(id):
     """Gets a specific user"""
 
     try:
-        user = User.objects.exclude('password').get(id=id).to_json()
+        user = select(User.objects.exclude(*PRIVATE), SELECTABLE).as_pymongo().get(id=id)
     except mongoengine.DoesNotExist:
         return flask.Response('No user with id {} found'.format(id), 400)
     except mongoengine.errors.ValidationError:
         return flask.Response('Invalid id {}'.format(id), 400)
 
-    return JSONResponse(user.to_json())
+    return JSONResponse(encoder(User).encode(user))
 
 
 @bp.route('/users/<id>', methods=['DELETE'])
@@ -142,33 +343,66 @@ def delete(id):
     except:
         return flask.Response('Invalid id {}'.format(id), 400)
 
+    bump('user', 'user:{}'.format(id))
+
     return JSONResponse()
 
 
-@bp.route('/users/<id>', methods=['PUT'])
+@bp.route('/users/<id>', methods=['PUT', 'PATCH'])
 @login_required
 def put(id):
-    """Updates a specific user"""
+    """Updates a specific user with a single update and returns it as it is
+    afterwards"""
 
-    try:
-        user = User.objects.get(id=id)
-    except mongoengine.DoesNotExist:
-        return flask.Response('No user with id {} found'.format(id), 404)
-    except:
+    if not ObjectId.is_valid(id):
         return flask.Response('Invalid id {}'.format(id), 400)
 
     data = flask.request.get_json()
 
     # update the email if it's in the data
-    if 'email' in data:
-        user.email = data['email']
+    try:
+        update = get_update(User, data, ['email'])
+    except mongoengine.ValidationError as exp:
+        return flask.Response('{}'.format(exp), 400)
+
+    # if the password is in here, hash it and store it, revoking the tokens
+    # issued with the old one
+    if 'password' in data:
+        update.setdefault('$set', {})['password'] = hash_password(data['password'])
+        update['$inc'] = {'token_generation': 1}
+
+    user = modify(User, {'_id': ObjectId(id)}, update,
+                  dict((name, False) for name in PRIVATE))
+
+    if user is None:
+        return flask.Response('No user with id {} found'.format(id), 404)
 
-    # if the password is in here, hash it and store it
     if 'password' in data:
-        user.password = hashlib.sha256(data['password'].encode('utf-8')).hexdigest()
+        _generations.pop(id, None)
+
+    bump('user', 'user:{}'.format(id))
+
+    return JSONResponse(encoder(User).encode(user))
+
+
+@bp.route('/tokens', methods=['POST'])
+def token():
+    """Exchanges basic credentials for a signed bearer token"""
+
+    if signing_key(flask.current_app.config) is None:
+        return flask.Response('Tokens are disabled until SECRET_KEY is set', 503)
+
+    auth = flask.request.authorization
+
+    if auth is None:
+        return _basic_auth()
+
+    user = authenticate(auth.username, auth.password)
+    if not user:
+        return _basic_auth()
 
-    user.save()
+    token, expires = make_token(user)
 
-    return JSONResponse(user.to_json())
+    return JSONResponse(json.dumps({'token': token, 'expires': expires}))
 
 
@@ -0,0 +1,148 @@
+"""This module contains the version counters that GETs are tagged with, and
+the decorator answering conditional GETs from them"""
+
+import hashlib
+import time
+from functools import wraps
+
+import flask
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from beerpi import db
+
+
+class Version(db.Document):
+    """A counter bumped on every write to the collection or document it is
+    named after.  Collections are named like `beer`, single documents like
+    `beer:<id>` and the nested lists like `reviews:<beer id>`.
+    """
+
+    id = db.StringField(primary_key=True)
+    version = db.IntField(default=0)
+
+
+# name -> (counter, time it was read at)
+_known = {}
+
+# the most counters remembered before they are all forgotten
+KNOWN_MAX = 100000
+
+# functions called with the names bumped by this process
+listeners = []
+
+
+def canonical(name):
+    """Returns the given counter name with the id after its colon, if it is
+    an ObjectId, written the way str(ObjectId) does.  Mongo reads a hex id in
+    either case, so `beer:5A...` and `beer:5a...` are the same counter."""
+
+    kind, _, id = name.partition(':')
+
+    if not ObjectId.is_valid(id):
+        return name
+
+    return '{}:{}'.format(kind, ObjectId(id))
+
+
+def names_of(names, **kwargs):
+    """Returns the counter names of the given templates formatted with the
+    arguments of a view"""
+
+    return [canonical(name.format(**kwargs)) for name in names]
+
+
+def bump(*names):
+    """Increments the counters of the given names in one round trip"""
+
+    names = [canonical(name) for name in names]
+
+    requests = [UpdateOne({'_id': name}, {'$inc': {'version': 1}}, upsert=True)
+                for name in names]
+
+    Version._get_collection().bulk_write(requests, ordered=False)
+
+    # this process sees its own writes straight away
+    for name in names:
+        _known.pop(name, None)
+
+    for listener in listeners:
+        listener(names)
+
+
+def current(names):
+    """Returns the counters of the given names, in the same order.  A counter
+    is only read again once VERSION_POLL_INTERVAL seconds have passed since
+    it was last read, which is how long the writes of other processes can go
+    unnoticed.
+    """
+
+    missing = stale(names, flask.current_app.config['VERSION_POLL_INTERVAL'])
+
+    if len(missing) > 0:
+        remember(missing, Version.objects(id__in=missing).as_pymongo())
+
+    return [_known[name][0] for name in names]
+
+
+def stale(names, interval):
+    """Returns the given names whose counters have to be read again"""
+
+    now = time.time()
+
+    return [name for name in names
+            if not name in _known or _known[name][1] + interval <= now]
+
+
+def remember(names, found):
+    """Remembers the counters of the given names out of the version documents
+    found for them.  Names without one are at 0."""
+
+    found = dict((doc['_id'], doc['version']) for doc in found)
+    now = time.time()
+
+    if len(_known) > KNOWN_MAX:
+        _known.clear()
+
+    for name in names:
+        _known[name] = (found.get(name, 0), now)
+
+
+def make_tag(path, names, versions):
+    """Returns the ETag of the response to the given path with the given
+    counters"""
+
+    tag = '{} {} {}'.format(path, names, versions)
+
+    return hashlib.sha1(tag.encode('utf-8')).hexdigest()
+
+
+def conditional(*names):
+    """This decorator tags the response of a GET with an ETag made from the
+    counters of the given names, which are formatted with the arguments of
+    the view.  If the request already has that tag a 304 is returned without
+    calling the view.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            keys = names_of(names, **kwargs)
+            tag = make_tag(flask.request.full_path, keys, current(keys))
+
+            if flask.request.if_none_match.contains(tag):
+                response = flask.Response(status=304)
+                response.set_etag(tag)
+
+                return response
+
+            response = func(*args, **kwargs)
+
+            if response.status_code == 200:
+                response.set_etag(tag)
+
+            return response
+
+        return decorated
+
+    return decorator
@@ -0,0 +1,134 @@
+"""This benchmark seeds a large catalogue of beers and compares fetching the
+filtered lists from the API with downloading the whole list and filtering it
+on the client, which is what clients did before the filters.  Everything in
+the given database is dropped first.
+
+    python benchmarks/filter.py --database beerpi_bench --beers 200000
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import time
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beerpi import app, create_app, indexes
+from beerpi.beer import Beer
+from beerpi.brewery import Brewery
+from beerpi.users import User, hash_password
+
+STYLES = ['Style {}'.format(number) for number in range(40)]
+
+CASES = [
+    ('style', {'style': 'Style 7'}, lambda beer: beer.get('style') == 'Style 7'),
+    ('style by rating', {'style': 'Style 7', 'sort': '-rating', 'limit': '50'}, None),
+    ('abv range', {'abv_min': '5', 'abv_max': '5.5', 'sort': 'abv'},
+     lambda beer: 5 <= beer.get('abv', 0) <= 5.5),
+    ('ibu range', {'ibu_min': '60', 'ibu_max': '61'},
+     lambda beer: 60 <= beer.get('ibu', 0) <= 61),
+    ('rating', {'rating_min': '4.9', 'sort': '-rating'},
+     lambda beer: (beer.get('rating') or 0) >= 4.9),
+]
+
+
+def seed(count, batch=10000):
+    """Replaces everything in the database with a brewery per 100 beers and
+    the given number of beers"""
+
+    database = Beer._get_collection().database
+
+    for name in database.list_collection_names():
+        database.drop_collection(name)
+
+    indexes.ensure()
+
+    breweries = [{'_id': ObjectId(), 'name': 'Brewery {}'.format(number)}
+                 for number in range(max(count // 100, 1))]
+    Brewery._get_collection().insert_many(breweries)
+
+    beers = Beer._get_collection()
+    rows = []
+
+    for number in range(count):
+        rows.append({
+            'name': 'Beer {}'.format(number),
+            'style': random.choice(STYLES),
+            'abv': round(random.uniform(3, 12), 1),
+            'ibu': random.randint(5, 120),
+            'calories': random.randint(90, 350),
+            'rating': round(random.uniform(1, 5), 2),
+            'brewery': random.choice(breweries)['_id'],
+        })
+
+        if len(rows) >= batch:
+            beers.insert_many(rows)
+            rows = []
+
+    if len(rows) > 0:
+        beers.insert_many(rows)
+
+    User(username='bench', password=hash_password('bench')).save()
+
+
+def timed(func, repeat):
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+
+        best = best is None and elapsed or min(best, elapsed)
+
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the beer filters')
+    parser.add_argument('--database', default='beerpi_bench',
+                        help='the database to seed, everything in it is dropped')
+    parser.add_argument('--beers', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-seed', dest='seed', action='store_false',
+                        help='reuse the catalogue seeded by an earlier run')
+
+    args = parser.parse_args()
+
+    app.config['MONGODB_SETTINGS'] = dict(app.config['MONGODB_SETTINGS'], DB=args.database)
+    create_app()
+
+    if args.seed:
+        print('seeding {} beers'.format(args.beers))
+        seed(args.beers)
+
+    client = app.test_client()
+    auth = base64.b64encode(b'bench:bench').decode('ascii')
+    headers = {'Authorization': 'Basic {}'.format(auth)}
+
+    def get(path, query=None):
+        response = client.get(path, query_string=query or {}, headers=headers)
+        return json.loads(response.get_data(as_text=True))
+
+    whole, beers = timed(lambda: get('/beers'), args.repeat)
+    print('{:<20} {:>8} rows {:>10.1f} ms'.format('whole list', len(beers), whole * 1000))
+
+    for name, query, match in CASES:
+        elapsed, rows = timed(lambda: get('/beers', query), args.repeat)
+        line = '{:<20} {:>8} rows {:>10.1f} ms'.format(name, len(rows), elapsed * 1000)
+
+        if match is not None:
+            filtering, _ = timed(lambda: [beer for beer in beers if match(beer)], args.repeat)
+            line += ', {:.1f}x faster than the whole list filtered on the client' \
+                    .format((whole + filtering) / elapsed)
+
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
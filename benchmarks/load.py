@@ -0,0 +1,443 @@
+"""This benchmark puts a load on the endpoints and reports the throughput and
+the 50th, 95th and 99th percentile latencies of each, sorts and filters
+included, as JSON.  It seeds a synthetic catalogue with benchmarks/seed.py
+first, then drives the application through the Flask test client, through
+the Tornado server started with wsgi.py, or both, from a number of threads
+at once.
+
+    python benchmarks/load.py --database beerpi_bench --output before.json
+    python benchmarks/load.py --no-seed --baseline before.json
+
+Given a baseline saved by an earlier run, every endpoint whose p95 latency
+went up or whose throughput went down by more than the tolerance is flagged
+and the exit status is 1.  With --mongomock the catalogue is kept in memory
+by mongomock instead of a local mongod, which only the test client can use.
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import seed
+
+# the name, path and arguments of every request made, formatted with a beer,
+# brewery, user, style, word and prefix picked for each request
+CASES = [
+    ('beers by name', '/beers', {'sort': 'name', 'limit': '50'}),
+    ('beers by -rating', '/beers', {'sort': '-rating', 'limit': '50'}),
+    ('beers by abv', '/beers', {'sort': 'abv', 'limit': '50'}),
+    ('beers of a style by -rating', '/beers',
+     {'style': '{style}', 'sort': '-rating', 'limit': '50'}),
+    ('beers in an abv range', '/beers', {'abv_min': '5', 'abv_max': '5.5', 'limit': '50'}),
+    ('beers, brewery expanded', '/beers', {'expand': 'brewery', 'limit': '50'}),
+    ('beer', '/beers/{beer}', {}),
+    ('reviews', '/beers/{beer}/reviews', {}),
+    ('reviews by -overall', '/beers/{beer}/reviews', {'sort': '-overall', 'limit': '20'}),
+    ('review summary', '/beers/{beer}/reviews/summary', {}),
+    ('top beers', '/beers/top', {'n': '20'}),
+    ('top beers of a style', '/beers/top', {'n': '20', 'style': '{style}'}),
+    ('popular beers', '/beers/popular', {'n': '20'}),
+    ('popular beers of a style', '/beers/popular', {'n': '20', 'style': '{style}'}),
+    ('breweries by name', '/breweries', {'sort': 'name', 'limit': '50'}),
+    ('brewery', '/breweries/{brewery}', {}),
+    ('glasses', '/glasses', {}),
+    ('favorites', '/users/{user}/favorites', {}),
+    ('favorites by -popularity', '/users/{user}/favorites', {'sort': '-popularity'}),
+    ('search', '/search', {'q': '{word}'}),
+    ('suggest', '/beers/_suggest', {'prefix': '{prefix}'}),
+]
+
+AUTH = 'Basic {}'.format(base64.b64encode(b'bench:bench').decode('ascii'))
+
+
+def configure(args):
+    """Writes the settings of the benchmark to a file and points the
+    application at it, which has to be done before it is imported"""
+
+    settings = {
+        'MONGODB_SETTINGS': {
+            'DB': args.database,
+            'host': args.mongomock and 'mongomock://localhost' or args.host,
+            'port': args.port,
+        },
+        'ENSURE_INDEXES': False,
+        'SLOW_QUERY_LOG': None,
+        'LISTEN_ADDRESS': '127.0.0.1',
+        'LISTEN_PORT': args.listen,
+        'WORKERS': args.workers,
+        'NATIVE_READS': args.native,
+    }
+
+    handle, path = tempfile.mkstemp(prefix='beerpi-bench-', suffix='.py')
+
+    with os.fdopen(handle, 'w') as out:
+        for name, value in sorted(settings.items()):
+            out.write('{} = {!r}\n'.format(name, value))
+
+    os.environ['BEERPI_SETTINGS'] = path
+
+    return path
+
+
+def pickers(state):
+    """Returns the skewed pickers of the catalogue already in the database"""
+
+    from beerpi.beer import Beer
+    from beerpi.brewery import Brewery
+    from beerpi.users import User
+
+    rng = random.Random(state)
+
+    def ids(document):
+        return [row['_id'] for row in document.objects.only('id').as_pymongo()]
+
+    return {
+        'beers': seed.Skewed(ids(Beer), 1.1, rng),
+        'breweries': seed.Skewed(ids(Brewery), 1.1, rng),
+        'users': seed.Skewed(ids(User), 1.1, rng),
+        'styles': seed.Skewed(seed.STYLES, 1.1, rng),
+    }
+
+
+def request(case, picked, rng):
+    """Returns the path and arguments of a request of the given case"""
+
+    word = rng.choice(seed.WORDS)
+    values = {
+        'beer': picked['beers'].pick(),
+        'brewery': picked['breweries'].pick(),
+        'user': picked['users'].pick(),
+        'style': picked['styles'].pick(),
+        'word': word,
+        'prefix': word[:3],
+    }
+
+    _, path, query = case
+
+    return path.format(**values), dict((key, value.format(**values))
+                                       for key, value in query.items())
+
+
+class ClientDriver(object):
+    """Makes the requests through the Flask test client, one per thread"""
+
+    name = 'client'
+
+    def __init__(self, app):
+        self.app = app
+
+    def session(self):
+        client = self.app.test_client()
+
+        def get(path, query):
+            response = client.get(path, query_string=query,
+                                  headers={'Authorization': AUTH})
+            response.get_data()
+
+            return response.status_code
+
+        return get
+
+    def close(self):
+        pass
+
+
+class ServerDriver(object):
+    """Starts wsgi.py and makes the requests over HTTP, with a kept alive
+    connection per thread"""
+
+    name = 'server'
+
+    def __init__(self, port, timeout=120):
+        self.port = port
+        self.process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'wsgi.py')],
+                                        cwd=ROOT)
+
+        deadline = time.time() + timeout
+
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                sys.exit('wsgi.py exited with {}'.format(self.process.returncode))
+
+            try:
+                socket.create_connection(('127.0.0.1', port), 1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+
+        self.close()
+        sys.exit('wsgi.py didn\'t start listening within {} seconds'.format(timeout))
+
+    def session(self):
+        connection = [None]
+
+        def get(path, query):
+            if connection[0] is None:
+                connection[0] = http.client.HTTPConnection('127.0.0.1', self.port)
+
+            url = len(query) > 0 and '{}?{}'.format(path, urlencode(query)) or path
+
+            try:
+                connection[0].request('GET', url, headers={'Authorization': AUTH})
+                response = connection[0].getresponse()
+                response.read()
+            except (http.client.HTTPException, OSError):
+                connection[0].close()
+                connection[0] = None
+                return 0
+
+            return response.status
+
+        return get
+
+    def close(self):
+        self.process.terminate()
+
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def percentile(durations, share):
+    """Returns the duration the given share of the sorted durations are at
+    or under"""
+
+    if len(durations) == 0:
+        return None
+
+    return durations[min(int(len(durations) * share), len(durations) - 1)]
+
+
+def run(driver, case, picked, count, concurrency, warmup):
+    """Makes count requests of the case from concurrency threads at once and
+    returns their throughput, latencies and errors"""
+
+    lock = threading.Lock()
+    left = [warmup, count]
+    durations = []
+    errors = [0]
+
+    def work(number):
+        get = driver.session()
+        rng = random.Random(number)
+        mine = []
+        failed = 0
+
+        # each thread warms up on its own share first
+        while True:
+            with lock:
+                if left[0] <= 0:
+                    break
+                left[0] -= 1
+
+            get(*request(case, picked, rng))
+
+        barrier.wait()
+
+        while True:
+            with lock:
+                if left[1] <= 0:
+                    break
+                left[1] -= 1
+
+            path, query = request(case, picked, rng)
+
+            start = time.perf_counter()
+            status = get(path, query)
+            mine.append(time.perf_counter() - start)
+
+            if status == 0 or status >= 400:
+                failed += 1
+
+        with lock:
+            durations.extend(mine)
+            errors[0] += failed
+
+    # the clock starts once every thread has warmed up
+    barrier = threading.Barrier(concurrency + 1)
+
+    threads = [threading.Thread(target=work, args=(number,))
+               for number in range(concurrency)]
+
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start
+    durations.sort()
+
+    def ms(value):
+        return value is not None and round(value * 1000, 3) or None
+
+    return {
+        'requests': len(durations),
+        'errors': errors[0],
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(durations) / elapsed, 1),
+        'p50_ms': ms(percentile(durations, .5)),
+        'p95_ms': ms(percentile(durations, .95)),
+        'p99_ms': ms(percentile(durations, .99)),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Returns a line for every endpoint whose p95 latency went up or whose
+    throughput went down by more than the tolerance since the baseline"""
+
+    regressions = []
+
+    for driver, cases in sorted(results.items()):
+        for name, found in sorted(cases.items()):
+            before = baseline.get(driver, {}).get(name)
+            if before is None or found['requests'] == 0:
+                continue
+
+            if before['p95_ms'] and found['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append('{} {}: p95 {} ms, was {} ms'.format(
+                    driver, name, found['p95_ms'], before['p95_ms']))
+
+            if found['throughput'] < before['throughput'] * (1 - tolerance):
+                regressions.append('{} {}: {} requests/s, was {}'.format(
+                    driver, name, found['throughput'], before['throughput']))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the endpoints under load')
+    parser.add_argument('--database', default='beerpi_bench',
+                        help='the database to seed, everything in it is dropped')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--mongomock', action='store_true',
+                        help='keep the catalogue in memory with mongomock')
+    parser.add_argument('--no-seed', dest='seed', action='store_false',
+                        help='reuse the catalogue seeded by an earlier run')
+    parser.add_argument('--skew', type=float, default=1.1)
+
+    for name, count in sorted(seed.COUNTS.items()):
+        parser.add_argument('--{}'.format(name), type=int, default=count)
+
+    parser.add_argument('--driver', choices=['client', 'server', 'both'], default='both')
+    parser.add_argument('--listen', type=int, default=8089,
+                        help='the port wsgi.py is started on')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--native', action='store_true',
+                        help='serve the native reads from the IOLoop')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='the requests made per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--case', action='append',
+                        help='only run the cases with this in their name')
+    parser.add_argument('--output', help='the file the results are written to')
+    parser.add_argument('--baseline', help='the results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=.1,
+                        help='the share p95 and throughput may get worse by')
+
+    args = parser.parse_args()
+
+    if args.mongomock and args.driver != 'client':
+        parser.error('only the client driver can use mongomock')
+
+    if args.mongomock and not args.seed:
+        parser.error('mongomock starts empty, it has to be seeded')
+
+    settings = configure(args)
+
+    try:
+        from beerpi import create_app
+
+        app = create_app()
+
+        if args.seed:
+            counts = dict((name, getattr(args, name)) for name in seed.COUNTS)
+            print('seeding {}'.format(counts), file=sys.stderr)
+            seed.seed(counts, args.skew)
+
+        picked = pickers(0)
+
+        cases = [case for case in CASES if args.case is None or
+                 any(name in case[0] for name in args.case)]
+
+        drivers = []
+        if args.driver in ['client', 'both']:
+            drivers.append(lambda: ClientDriver(app))
+        if args.driver in ['server', 'both']:
+            drivers.append(lambda: ServerDriver(args.listen))
+
+        results = {}
+
+        for make in drivers:
+            driver = make()
+
+            try:
+                found = results[driver.name] = {}
+
+                for case in cases:
+                    found[case[0]] = run(driver, case, picked, args.requests,
+                                         args.concurrency, args.warmup)
+
+                    print('{:<8} {:<30} {:>8.1f}/s p50 {:>8} p95 {:>8} p99 {:>8} ms, {} errors'
+                          .format(driver.name, case[0], found[case[0]]['throughput'],
+                                  found[case[0]]['p50_ms'], found[case[0]]['p95_ms'],
+                                  found[case[0]]['p99_ms'], found[case[0]]['errors']),
+                          file=sys.stderr)
+            finally:
+                driver.close()
+    finally:
+        os.unlink(settings)
+
+    report = {
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'native': args.native,
+        'workers': args.workers,
+        'results': results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline)['results'], args.tolerance)
+
+        report['regressions'] = regressions
+
+        for line in regressions:
+            print('REGRESSION {}'.format(line), file=sys.stderr)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+
+    if len(regressions) > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""This benchmark measures what the request and mongo metrics cost the hot
+paths, by timing them through the test client with the metrics installed
+and with their hooks and command listener switched off, in alternating
+rounds.  It reads the catalogue seeded by benchmarks/filter.py.
+
+    python benchmarks/filter.py --database beerpi_bench --beers 10000
+    python benchmarks/metrics.py --database beerpi_bench
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beerpi import app, create_app, metrics
+
+PATHS = [
+    ('beer list', '/beers', {'sort': '-rating', 'limit': '50'}),
+    ('beer', '/beers/{id}', {}),
+    ('beer list, filtered', '/beers', {'style': 'Style 7', 'limit': '50'}),
+    ('reviews', '/beers/{id}/reviews', {}),
+]
+
+
+def switch(on):
+    """Adds or removes the metrics hooks of the app and the recording of the
+    command listener"""
+
+    hooks = [(app.before_request_funcs, metrics._before),
+             (app.after_request_funcs, metrics._after),
+             (app.teardown_request_funcs, metrics._teardown)]
+
+    for funcs, hook in hooks:
+        found = funcs.setdefault(None, [])
+
+        if on and not hook in found:
+            found.append(hook)
+        elif not on and hook in found:
+            found.remove(hook)
+
+    listener = metrics._installed[0]
+
+    if on:
+        listener.__dict__.pop('record', None)
+    else:
+        listener.record = lambda event, outcome: None
+
+
+def timed(func, count):
+    start = time.perf_counter()
+
+    for _ in range(count):
+        func()
+
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the metrics overhead')
+    parser.add_argument('--database', default='beerpi_bench',
+                        help='a database seeded by benchmarks/filter.py')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='the requests made per path per round')
+    parser.add_argument('--rounds', type=int, default=5)
+
+    args = parser.parse_args()
+
+    app.config['MONGODB_SETTINGS'] = dict(app.config['MONGODB_SETTINGS'], DB=args.database)
+    create_app()
+
+    client = app.test_client()
+    auth = base64.b64encode(b'bench:bench').decode('ascii')
+    headers = {'Authorization': 'Basic {}'.format(auth)}
+
+    first = json.loads(client.get('/beers', query_string={'limit': '1'}, headers=headers)
+                       .get_data(as_text=True))
+    if len(first) == 0:
+        sys.exit('no beers found, seed the database with benchmarks/filter.py first')
+
+    id = first[0]['_id']['$oid']
+
+    for name, path, query in PATHS:
+        path = path.format(id=id)
+
+        def get():
+            response = client.get(path, query_string=query, headers=headers)
+            response.get_data()
+
+        best = {True: None, False: None}
+
+        for _ in range(args.rounds):
+            for on in [False, True]:
+                switch(on)
+                elapsed = timed(get, args.requests)
+                best[on] = best[on] is None and elapsed or min(best[on], elapsed)
+
+        switch(True)
+
+        print('{:<20} {:>8.3f} ms without {:>8.3f} ms with, {:+.1f}%'.format(
+            name, best[False] * 1000, best[True] * 1000,
+            (best[True] / best[False] - 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
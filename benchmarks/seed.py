@@ -0,0 +1,195 @@
+"""This module seeds a synthetic catalogue for the benchmarks: breweries,
+glasses, beers, users, reviews and favorites.  A few breweries make most of
+the beers, and a few beers and users account for most of the reviews and
+favorites, the way they do on a real site.  Every user's password is
+`bench`, and one of them is named `bench`.  Everything in the database is
+dropped first.
+
+    python benchmarks/seed.py --database beerpi_bench --beers 100000
+"""
+
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sys
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STYLES = ['Style {}'.format(number) for number in range(40)]
+STATES = ['State {}'.format(number) for number in range(50)]
+WORDS = ['amber', 'hazy', 'imperial', 'golden', 'black', 'double', 'session',
+         'wild', 'smoked', 'barrel', 'river', 'mountain', 'harvest', 'winter']
+
+# the number of each thing seeded when none is given
+COUNTS = {
+    'breweries': 1000,
+    'glasses': 20,
+    'beers': 50000,
+    'users': 5000,
+    'reviews': 200000,
+    'favorites': 50000,
+}
+
+
+class Skewed(object):
+    """Picks from the given items with Zipf's law, the item at each position
+    of a shuffled order picked 1 / position ** skew as often as the first"""
+
+    def __init__(self, items, skew, rng):
+        self.items = items[:]
+        rng.shuffle(self.items)
+
+        weights = [1 / (position + 1) ** skew for position in range(len(self.items))]
+        self.totals = list(itertools.accumulate(weights))
+        self.rng = rng
+
+    def pick(self):
+        found = self.rng.random() * self.totals[-1]
+
+        return self.items[min(bisect.bisect(self.totals, found), len(self.items) - 1)]
+
+
+def _insert(collection, rows, batch):
+    for start in range(0, len(rows), batch):
+        collection.insert_many(rows[start:start + batch], ordered=False)
+
+
+def _pairs(users, beers, count, rng):
+    """Returns count distinct pairs of a user and a beer, picking both by
+    their skew"""
+
+    pairs = set()
+    tries = count * 10
+
+    while len(pairs) < count and tries > 0:
+        pairs.add((users.pick(), beers.pick()))
+        tries -= 1
+
+    return pairs
+
+
+def seed(counts=None, skew=1.1, batch=10000, state=0):
+    """Replaces everything in the database with a synthetic catalogue of the
+    given number of each thing.  Returns the skewed pickers of the beers,
+    breweries and users, for the benchmarks to ask for the popular ones more
+    often."""
+
+    from beerpi import indexes
+    from beerpi.beer import Beer
+    from beerpi.brewery import Brewery
+    from beerpi.favorite import Favorite, reconcile_favorites
+    from beerpi.glasses import Glass
+    from beerpi.review import Review, rebuild_ratings
+    from beerpi.users import User, hash_password
+
+    counts = dict(COUNTS, **(counts or {}))
+    rng = random.Random(state)
+
+    database = Beer._get_collection().database
+
+    for name in database.list_collection_names():
+        database.drop_collection(name)
+
+    indexes.ensure()
+
+    breweries = [{'_id': ObjectId(),
+                  'name': 'Brewery {}'.format(number),
+                  'city': 'City {}'.format(number % 300),
+                  'state': rng.choice(STATES)} for number in range(counts['breweries'])]
+    _insert(Brewery._get_collection(), breweries, batch)
+
+    glasses = [{'_id': ObjectId(), 'name': 'Glass {}'.format(number)}
+               for number in range(counts['glasses'])]
+    _insert(Glass._get_collection(), glasses, batch)
+
+    password = hash_password('bench')
+    users = [{'_id': ObjectId(),
+              'username': number == 0 and 'bench' or 'user{}'.format(number),
+              'email': 'user{}@example.com'.format(number),
+              'password': password,
+              'token_generation': 0} for number in range(counts['users'])]
+    _insert(User._get_collection(), users, batch)
+
+    makers = Skewed([brewery['_id'] for brewery in breweries], skew, rng)
+    styles = Skewed(STYLES, skew, rng)
+
+    beers = []
+    for number in range(counts['beers']):
+        beers.append({
+            '_id': ObjectId(),
+            'name': '{} {} {}'.format(rng.choice(WORDS).title(),
+                                      rng.choice(WORDS).title(), number),
+            'style': styles.pick(),
+            'abv': round(rng.uniform(3, 12), 1),
+            'ibu': rng.randint(5, 120),
+            'calories': rng.randint(90, 350),
+            'brewery': makers.pick(),
+            'glass': rng.choice(glasses)['_id'],
+            'added_by': rng.choice(users)['_id'],
+            'rating_sum': 0,
+            'rating_count': 0,
+        })
+    _insert(Beer._get_collection(), beers, batch)
+
+    popular = Skewed([beer['_id'] for beer in beers], skew, rng)
+    active = Skewed([user['_id'] for user in users], skew, rng)
+
+    reviews = []
+    for user, beer in _pairs(active, popular, counts['reviews'], rng):
+        review = {
+            '_id': ObjectId(),
+            'beer': beer,
+            'user': user,
+            'aroma': rng.randint(1, 5),
+            'appearance': rng.randint(1, 5),
+            'taste': rng.randint(1, 10),
+            'palate': rng.randint(1, 5),
+            'bottle_style': rng.randint(1, 5),
+        }
+
+        points = sum(review[prop] for prop in
+                     ['aroma', 'appearance', 'taste', 'palate', 'bottle_style'])
+        review['overall'] = round(points / Review.total / .2, 2)
+
+        reviews.append(review)
+    _insert(Review._get_collection(), reviews, batch)
+
+    favorites = [{'_id': ObjectId(), 'user': user, 'beer': beer}
+                 for user, beer in _pairs(active, popular, counts['favorites'], rng)]
+    _insert(Favorite._get_collection(), favorites, batch)
+
+    rebuild_ratings(batch)
+    reconcile_favorites(batch)
+
+    return {'beers': popular, 'breweries': makers, 'users': active, 'styles': styles}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seeds a synthetic catalogue')
+    parser.add_argument('--database', default='beerpi_bench',
+                        help='the database to seed, everything in it is dropped')
+    parser.add_argument('--skew', type=float, default=1.1,
+                        help='the exponent of the popularity of the beers and users')
+
+    for name, count in sorted(COUNTS.items()):
+        parser.add_argument('--{}'.format(name), type=int, default=count)
+
+    args = parser.parse_args()
+
+    from beerpi import app, connect
+
+    app.config['MONGODB_SETTINGS'] = dict(app.config['MONGODB_SETTINGS'], DB=args.database)
+    connect()
+
+    seed(dict((name, getattr(args, name)) for name in COUNTS), args.skew)
+
+    print('seeded {}'.format(', '.join('{} {}'.format(getattr(args, name), name)
+                                       for name in sorted(COUNTS))))
+
+
+if __name__ == '__main__':
+    main()
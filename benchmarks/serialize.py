@@ -0,0 +1,82 @@
+"""This benchmark compares writing a list of beers out by loading every row
+into a Document and calling to_json, which is what the lists used to do,
+with encoding the raw rows with the precompiled encoder.  It needs no
+database, the rows are made up.
+
+    python benchmarks/serialize.py --rows 100000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beerpi.beer import Beer
+from beerpi.serialize import dumps
+
+
+def make_rows(count):
+    brewery = ObjectId()
+    glass = ObjectId()
+    user = ObjectId()
+
+    return [{
+        '_id': ObjectId(),
+        'name': 'Beer {}'.format(number),
+        'ibu': number % 100,
+        'calories': 150 + number % 50,
+        'abv': 4.5 + (number % 40) / 10,
+        'style': 'Style {}'.format(number % 20),
+        'brewery': brewery,
+        'glass': glass,
+        'rating': 3.25,
+        'rating_sum': 1300,
+        'rating_count': 4,
+        'added_by': user,
+    } for number in range(count)]
+
+
+def hydrated(rows):
+    return '[{}]'.format(', '.join(Beer._from_son(row).to_json() for row in rows))
+
+
+def raw(rows):
+    return dumps(Beer, rows)
+
+
+def measure(func, rows, repeat):
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(rows)
+        elapsed = time.perf_counter() - start
+
+        best = best is None and elapsed or min(best, elapsed)
+
+    return len(rows) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the list serializer')
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+
+    before = measure(hydrated, rows, args.repeat)
+    after = measure(raw, rows, args.repeat)
+
+    print('to_json:  {:>10.0f} rows/second'.format(before))
+    print('encoder:  {:>10.0f} rows/second'.format(after))
+    print('speedup:  {:>10.1f}x'.format(after / before))
+
+
+if __name__ == '__main__':
+    main()
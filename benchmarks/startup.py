@@ -0,0 +1,89 @@
+"""This benchmark measures the cold start of the application: importing the
+package, creating the app from the listed blueprints and from discovering
+them, and what a maintenance job imports.  Each is timed in a new python
+process, so nothing is imported beforehand.  Nothing is sent to mongo.  With
+a budget given, it exits with 1 if creating the app takes longer.
+
+    python benchmarks/startup.py --runs 10 --budget 0.5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# what is timed in each process, after the clock is started
+CASES = [
+    ('import beerpi', 'import beerpi'),
+    ('create_app', 'import beerpi; beerpi.create_app()'),
+    ('create_app, discovered', 'import beerpi; beerpi.create_app()'),
+    ('maintenance job', 'import beerpi; import beerpi.review; beerpi.connect()'),
+]
+
+PROGRAM = '''
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+'''
+
+
+def settings(discover):
+    """Writes a settings file that keeps the app from touching mongo"""
+
+    handle, path = tempfile.mkstemp(prefix='beerpi-startup-', suffix='.py')
+
+    with os.fdopen(handle, 'w') as out:
+        out.write('ENSURE_INDEXES = False\n')
+        out.write('DISCOVER_BLUEPRINTS = {!r}\n'.format(discover))
+
+    return path
+
+
+def timed(code, path):
+    env = dict(os.environ, BEERPI_SETTINGS=path)
+    output = subprocess.check_output([sys.executable, '-c',
+                                      PROGRAM.format(root=ROOT, code=code)],
+                                     env=env, cwd=ROOT)
+
+    return float(output.decode('ascii').strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the cold start')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float,
+                        help='the most seconds creating the app may take')
+
+    args = parser.parse_args()
+
+    listed = settings(False)
+    discovered = settings(True)
+
+    found = {}
+
+    try:
+        for name, code in CASES:
+            path = name.endswith('discovered') and discovered or listed
+            runs = [timed(code, path) for _ in range(args.runs)]
+
+            found[name] = statistics.median(runs)
+
+            print('{:<25} {:>8.1f} ms median {:>8.1f} ms best'.format(
+                name, found[name] * 1000, min(runs) * 1000))
+    finally:
+        os.unlink(listed)
+        os.unlink(discovered)
+
+    if args.budget is not None and found['create_app'] > args.budget:
+        sys.exit('creating the app took {:.3f} seconds, over the budget of {}'
+                 .format(found['create_app'], args.budget))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""This is the command line runner for the maintenance jobs of the
+application"""
+
+import argparse
+import sys
+
+
+def rebuild_ratings(args):
+    """Rebuilds the rating totals of every beer from its reviews"""
+
+    from beerpi.review import rebuild_ratings
+
+    print('Corrected {} beers'.format(len(rebuild_ratings(args.batch))))
+
+
+def reconcile_favorites(args):
+    """Recomputes the favorite count of every beer from the favorites"""
+
+    from beerpi.favorite import reconcile_favorites
+
+    print('Corrected {} beers'.format(len(reconcile_favorites(args.batch))))
+
+
+def ensure_indexes(args):
+    """Creates every declared index that doesn't exist yet"""
+
+    from beerpi import indexes
+
+    indexes.ensure()
+
+
+def check_plans(args):
+    """Explains the queries of every endpoint and fails if any of them isn't
+    served by an index"""
+
+    from beerpi import indexes
+
+    failed = indexes.check()
+
+    for name, query, stages in failed:
+        print('{}: {} ({})'.format(name, query._query, ', '.join(stages)))
+
+    if len(failed) > 0:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BeerPI maintenance jobs')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser('rebuild-ratings', help=rebuild_ratings.__doc__)
+    command.add_argument('--batch', type=int, default=1000,
+                         help='the number of beers to write at a time')
+    command.set_defaults(func=rebuild_ratings)
+
+    command = commands.add_parser('reconcile-favorites', help=reconcile_favorites.__doc__)
+    command.add_argument('--batch', type=int, default=1000,
+                         help='the number of beers to write at a time')
+    command.set_defaults(func=reconcile_favorites)
+
+    command = commands.add_parser('ensure-indexes', help=ensure_indexes.__doc__)
+    command.set_defaults(func=ensure_indexes)
+
+    command = commands.add_parser('check-plans', help=check_plans.__doc__)
+    command.set_defaults(func=check_plans)
+
+    args = parser.parse_args()
+
+    # the jobs only need the documents, not the application
+    from beerpi import connect
+    connect()
+
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""The checks of the behaviour the benchmarks can't show.  They're run from
+the top of the repository with
+
+    python -m unittest discover -s tests -t .
+
+The ones that need a catalogue keep it in memory with mongomock, so no
+mongod has to be running.
+"""
+
+import base64
+import random
+
+from bson import ObjectId
+
+from beerpi import app, create_app
+
+SETTINGS = {
+    'MONGODB_SETTINGS': {
+        'DB': 'beerpi_tests',
+        'host': 'mongomock://localhost',
+        'connect': False,
+    },
+    'ENSURE_INDEXES': False,
+    'SLOW_QUERY_MS': None,
+    'TESTING': True,
+}
+
+HEADERS = {
+    'Authorization': 'Basic {}'.format(base64.b64encode(b'test:test').decode('ascii')),
+}
+
+
+def create(**settings):
+    """Returns the app reading from mongomock, with the given settings"""
+
+    app.config.update(SETTINGS)
+    app.config.update(settings)
+
+    return create_app()
+
+
+def seed(beers=150, reviews=30, state=0):
+    """Replaces everything in the database with a few breweries and glasses,
+    the given number of beers and reviews of the first beer, and a user
+    named `test` with the password `test`.  Returns the ids of the beers."""
+
+    from beerpi import review, version
+    from beerpi.beer import Beer
+    from beerpi.brewery import Brewery
+    from beerpi.glasses import Glass
+    from beerpi.users import User, hash_password
+
+    rng = random.Random(state)
+
+    database = Beer._get_collection().database
+
+    for name in database.list_collection_names():
+        database.drop_collection(name)
+
+    version._known.clear()
+
+    def insert(document, rows):
+        document._get_collection().insert_many(rows)
+        return [row['_id'] for row in rows]
+
+    breweries = insert(Brewery, [{'_id': ObjectId(), 'name': 'Brewery {}'.format(number),
+                                  'city': 'City', 'state': 'State'}
+                                 for number in range(10)])
+    glasses = insert(Glass, [{'_id': ObjectId(), 'name': 'Glass {}'.format(number)}
+                             for number in range(5)])
+
+    ids = insert(Beer, [{'_id': ObjectId(),
+                         'name': 'Beer {}'.format(number),
+                         'abv': rng.choice([4.5, 5.0, 5.5, 6.0, 7.5]),
+                         'ibu': rng.randint(10, 90),
+                         'style': 'Style {}'.format(number % 7),
+                         'brewery': rng.choice(breweries),
+                         'glass': rng.choice(glasses),
+                         'rating_sum': 0,
+                         'rating_count': 0}
+                        for number in range(beers)])
+
+    user = insert(User, [{'_id': ObjectId(), 'username': 'test',
+                          'password': hash_password('test'), 'token_generation': 0}])[0]
+
+    rows = []
+    for _ in range(reviews):
+        row = dict((item, rng.randint(1, 5)) for item in review.Review.scores)
+        row.update(_id=ObjectId(), beer=ids[0], user=user)
+        row['overall'] = review.overall(row)
+
+        rows.append(row)
+
+    if len(rows) > 0:
+        insert(review.Review, rows)
+
+    return ids
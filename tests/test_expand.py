@@ -0,0 +1,64 @@
+"""Checks that expanding the references of a list reads each referenced
+collection once per page, however long the page is"""
+
+import json
+import unittest
+from collections import Counter
+from unittest import mock
+
+from mongomock.collection import Collection
+
+import tests
+from beerpi.beer import Beer
+from beerpi.brewery import Brewery
+from beerpi.glasses import Glass
+
+
+class ExpandTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = tests.create().test_client()
+        tests.seed(beers=150, reviews=0)
+
+    def get(self, query):
+        """Returns the beers of a GET of the list and the number of finds it
+        sent to each collection"""
+
+        finds = Counter()
+        find = Collection.find
+
+        def counted(collection, *args, **kwargs):
+            finds[collection.name] += 1
+            return find(collection, *args, **kwargs)
+
+        with mock.patch.object(Collection, 'find', counted):
+            response = self.client.get('/beers', query_string=query,
+                                       headers=tests.HEADERS)
+
+        self.assertEqual(response.status_code, 200)
+
+        return json.loads(response.get_data(as_text=True)), finds
+
+    def test_pages(self):
+        names = [Beer._get_collection_name(), Brewery._get_collection_name(),
+                 Glass._get_collection_name()]
+        found = {}
+
+        for limit in [10, 100]:
+            beers, finds = self.get({'expand': 'brewery,glass', 'limit': str(limit)})
+
+            self.assertEqual(len(beers), limit)
+
+            for beer in beers:
+                self.assertIsInstance(beer['brewery'], dict)
+                self.assertIsInstance(beer['glass'], dict)
+
+            found[limit] = [finds[name] for name in names]
+
+        self.assertEqual(found[10], [1, 1, 1])
+        self.assertEqual(found[100], found[10])
+
+
+if __name__ == '__main__':
+    unittest.main()
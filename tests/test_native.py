@@ -0,0 +1,141 @@
+"""Checks that the native handlers answer the busiest GETs the same way the
+WSGI application does.  They read from a stand-in for motor over the same
+mongomock database the application uses."""
+
+import itertools
+import json
+import unittest
+from urllib.parse import urlencode
+
+from bson import ObjectId
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase
+
+import tests
+from beerpi import server
+from beerpi.beer import Beer
+
+# the paths and arguments compared, with the ids of the seeded beers
+CASES = [
+    ('/beers', {}),
+    ('/beers', {'sort': '-abv', 'limit': '7'}),
+    ('/beers', {'sort': 'name,-ibu', 'limit': '25'}),
+    ('/beers', {'limit': '0'}),
+    ('/beers/{beer}', {}),
+    ('/beers/{beer}/reviews', {}),
+    ('/beers/{beer}/reviews', {'sort': '-overall', 'limit': '4'}),
+    ('/beers/{missing}/reviews', {}),
+]
+
+
+class Cursor(object):
+    """A motor cursor over a mongomock one"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, keys):
+        self.cursor.sort(keys)
+        return self
+
+    def limit(self, limit):
+        self.cursor.limit(limit)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    @gen.coroutine
+    def to_list(self, length):
+        return [row for row in itertools.islice(self.cursor, length)]
+
+
+class Collection(object):
+    """A motor collection over a mongomock one"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return Cursor(self.collection.find(*args, **kwargs))
+
+    @gen.coroutine
+    def find_one(self, *args, **kwargs):
+        return self.collection.find_one(*args, **kwargs)
+
+
+class Database(object):
+    """A motor database over a mongomock one, counting the collections read"""
+
+    def __init__(self, database):
+        self.database = database
+        self.reads = 0
+
+    def __getitem__(self, name):
+        self.reads += 1
+        return Collection(self.database[name])
+
+
+class NativeTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        # small batches, so the unpaged lists are streamed in several
+        self.app = tests.create(STREAM_BATCH_SIZE=4)
+        self.client = self.app.test_client()
+
+        self.ids = tests.seed(beers=30, reviews=10)
+        self.db = Database(Beer._get_collection().database)
+
+        return server.application(self.app, 2, db=self.db)
+
+    def native(self, path, query):
+        reads = self.db.reads
+
+        response = self.fetch('{}?{}'.format(path, urlencode(query)),
+                              headers=tests.HEADERS)
+
+        # the request was answered from the stand-in, not handed to the app
+        self.assertGreater(self.db.reads, reads)
+
+        return (response.code, response.body.decode('utf-8'),
+                response.headers.get('X-Next-Cursor'))
+
+    def wsgi(self, path, query):
+        response = self.client.get(path, query_string=query, headers=tests.HEADERS)
+
+        return (response.status_code, response.get_data(as_text=True),
+                response.headers.get('X-Next-Cursor'))
+
+    def assertSame(self, native, wsgi):
+        self.assertEqual(native[0], wsgi[0])
+        self.assertEqual(native[2], wsgi[2])
+
+        if native[0] == 200:
+            self.assertEqual(json.loads(native[1]), json.loads(wsgi[1]))
+        else:
+            self.assertEqual(native[1], wsgi[1])
+
+    def test_cases(self):
+        ids = {'beer': self.ids[0], 'missing': ObjectId()}
+
+        for path, query in CASES:
+            path = path.format(**ids)
+
+            with self.subTest(path=path, query=query):
+                native = self.native(path, query)
+                wsgi = self.wsgi(path, query)
+
+                self.assertSame(native, wsgi)
+
+                # every page after the first is the same too
+                while native[2] is not None:
+                    query = dict(query, cursor=native[2])
+
+                    native = self.native(path, query)
+                    wsgi = self.wsgi(path, query)
+
+                    self.assertSame(native, wsgi)
+
+
+if __name__ == '__main__':
+    unittest.main()
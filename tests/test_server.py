@@ -0,0 +1,87 @@
+"""Checks that a client reading a streamed response slowly only holds back
+its own response, not the other requests or the memory of the process"""
+
+import socket
+import time
+import unittest
+
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase
+
+from beerpi import server
+
+CHUNK = b'x' * 65536
+CHUNKS = 1000
+
+
+class Streaming(object):
+    """A WSGI application streaming CHUNKS chunks from /slow, counting how
+    many it has made, and answering anything else straight away"""
+
+    def __init__(self):
+        self.made = 0
+        self.closed = False
+
+    def __call__(self, environ, start_response):
+        if environ['PATH_INFO'] != '/slow':
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'fast']
+
+        start_response('200 OK', [('Content-Type', 'application/octet-stream')])
+        return self.generate()
+
+    def generate(self):
+        try:
+            for _ in range(CHUNKS):
+                self.made += 1
+                yield CHUNK
+        finally:
+            self.closed = True
+
+
+class SlowClientTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.streaming = Streaming()
+
+        return server.application(self.streaming, 2)
+
+    def wait_for(self, seconds):
+        self.io_loop.run_sync(lambda: gen.sleep(seconds))
+
+    def test_slow_client(self):
+        slow = socket.create_connection(('127.0.0.1', self.get_http_port()))
+        slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+
+        try:
+            slow.sendall(b'GET /slow HTTP/1.1\r\nHost: localhost\r\n\r\n')
+
+            # the slow client never reads, so the stream fills the socket
+            # buffers and then has to wait
+            self.wait_for(1)
+
+            start = time.time()
+            response = self.fetch('/fast')
+
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.body, b'fast')
+            self.assertLess(time.time() - start, 1)
+
+            made = self.streaming.made
+
+            self.wait_for(0.5)
+
+            self.assertLess(made, CHUNKS // 2)
+            self.assertLessEqual(self.streaming.made, made + 1)
+        finally:
+            slow.close()
+
+        # once the client is gone the rest of the stream isn't made
+        self.wait_for(0.5)
+
+        self.assertTrue(self.streaming.closed)
+        self.assertLess(self.streaming.made, CHUNKS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Checks that creating the app from a cold process stays within its budget,
+so a slow import creeping into the blueprints fails here rather than in a
+deploy"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the most seconds the median cold creation of the app may take
+BUDGET = 0.5
+
+RUNS = 5
+
+PROGRAM = '''
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import beerpi
+beerpi.create_app()
+print(time.perf_counter() - start)
+'''
+
+
+class StartupTest(unittest.TestCase):
+
+    def setUp(self):
+        # keep the app from touching mongo
+        handle, self.settings = tempfile.mkstemp(prefix='beerpi-startup-', suffix='.py')
+
+        with os.fdopen(handle, 'w') as out:
+            out.write('ENSURE_INDEXES = False\n')
+
+    def tearDown(self):
+        os.unlink(self.settings)
+
+    def timed(self):
+        """Returns the seconds creating the app took in a new process"""
+
+        env = dict(os.environ, BEERPI_SETTINGS=self.settings)
+        output = subprocess.check_output([sys.executable, '-c', PROGRAM.format(root=ROOT)],
+                                         env=env, cwd=ROOT)
+
+        return float(output.decode('ascii').strip().splitlines()[-1])
+
+    def test_create_app(self):
+        seconds = statistics.median([self.timed() for _ in range(RUNS)])
+
+        self.assertLess(seconds, BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
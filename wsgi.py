@@ -1,17 +1,256 @@
 """This is the WSGI runner for the application"""
 
+import errno
+import logging
+import multiprocessing
+import os
+import signal
+import time
 
-from tornado.wsgi import WSGIContainer
 from tornado.httpserver import HTTPServer
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.netutil import bind_sockets
 
-from beerpi import app
+from beerpi import create_app, reconnect, search
+from beerpi.native import connect
+from beerpi.server import application, stats
+
+log = logging.getLogger('beerpi.wsgi')
+
+app = create_app()
+
+
+def serve(sockets, heartbeat=None):
+    """Serves the application on the given sockets until a SIGTERM, which
+    stops it accepting connections and returns once the requests it has are
+    done, or GRACEFUL_TIMEOUT seconds have passed if that is sooner.  If a
+    heartbeat pipe is given, a byte is written to it every second.
+    """
+
+    db = None
+    if app.config['NATIVE_READS']:
+        db = connect(app.config['MONGODB_SETTINGS'])
+
+        if db is None:
+            log.warning('motor is not installed, serving every request through WSGI')
+
+    web = application(app, app.config['THREAD_POOL_SIZE'], db)
+
+    server = HTTPServer(web)
+    server.add_sockets(sockets)
+
+    loop = IOLoop.current()
+    stopping = {'deadline': None}
+
+    def drained():
+        if stats.snapshot()['open'] == 0 or time.time() >= stopping['deadline']:
+            loop.stop()
+
+    def shutdown():
+        if stopping['deadline'] is not None:
+            return
+
+        server.stop()
+
+        stopping['deadline'] = time.time() + app.config['GRACEFUL_TIMEOUT']
+        PeriodicCallback(drained, 100).start()
+
+    def terminate(signum, frame):
+        loop.add_callback_from_signal(shutdown)
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    if heartbeat is not None:
+        PeriodicCallback(lambda: os.write(heartbeat, b'.'), 1000).start()
+
+    loop.start()
+
+    # a request whose client went away can still be running on a thread, so
+    # the threads are given what is left of the timeout to finish
+    web.settings['executor'].shutdown(wait=False)
+
+    while stats.snapshot()['running'] > 0 and time.time() < stopping['deadline']:
+        time.sleep(0.1)
+
+
+class Worker(object):
+    """A forked server process and the pipe it sends its heartbeat on"""
+
+    def __init__(self, sockets):
+        read, write = os.pipe()
+
+        self.pid = os.fork()
+
+        if self.pid == 0:
+            os.close(read)
+
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+            # the child never returns into the supervisor's loop, however it
+            # fails
+            code = 1
+
+            try:
+                # the connection inherited from the supervisor can't be shared
+                reconnect()
+
+                serve(sockets, write)
+                code = 0
+            except Exception:
+                log.exception('worker %s failed', os.getpid())
+            finally:
+                os._exit(code)
+
+        os.close(write)
+        os.set_blocking(read, False)
+
+        self.pipe = read
+        self.started = time.time()
+        self.seen = self.started
+
+    def check(self):
+        """Reads the heartbeats sent since the last check"""
+
+        try:
+            while os.read(self.pipe, 1024):
+                self.seen = time.time()
+        except OSError as exp:
+            if exp.errno != errno.EAGAIN:
+                raise
+
+    def signal(self, signum):
+        try:
+            os.kill(self.pid, signum)
+        except OSError:
+            pass
+
+    def close(self):
+        os.close(self.pipe)
+
+
+def supervise(sockets, count):
+    """Forks the given number of workers and keeps that many running.  A
+    worker that exits is replaced, one that hasn't sent a heartbeat within
+    WORKER_TIMEOUT seconds is killed and replaced.  A SIGHUP starts a new set
+    of workers and then gracefully stops the old ones, a SIGTERM or SIGINT
+    gracefully stops them all.
+    """
+
+    timeout = app.config['WORKER_TIMEOUT']
+    state = {'restart': False, 'stop': False}
+
+    def restart(signum, frame):
+        state['restart'] = True
+
+    def stop(signum, frame):
+        state['stop'] = True
+
+    signal.signal(signal.SIGHUP, restart)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    workers = {}
+    retiring = {}
+    failures = []
+
+    def spawn():
+        worker = Worker(sockets)
+        workers[worker.pid] = worker
+        log.info('started worker %s', worker.pid)
+
+    for _ in range(count):
+        spawn()
+
+    while not state['stop']:
+        time.sleep(0.5)
+
+        if state['restart']:
+            state['restart'] = False
+            log.info('restarting %s workers', len(workers))
+
+            # start every replacement before stopping the old ones so there
+            # is always someone accepting
+            for pid in list(workers):
+                retiring[pid] = workers.pop(pid)
+                spawn()
+
+            for worker in retiring.values():
+                worker.signal(signal.SIGTERM)
+
+        # reap everyone that exited
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+
+            if pid == 0:
+                break
+
+            if pid in retiring:
+                retiring.pop(pid).close()
+                continue
+
+            worker = workers.pop(pid, None)
+            if worker is None:
+                continue
+
+            worker.close()
+            log.warning('worker %s exited with status %s', pid, status)
+
+            # back off if workers keep dying straight after starting
+            now = time.time()
+            failures = [at for at in failures if at > now - 60] + [now]
+            if len(failures) > count * 5:
+                log.error('workers are failing to start, waiting')
+                time.sleep(5)
+
+            spawn()
+
+        # kill anyone who has stopped sending heartbeats
+        now = time.time()
+        for worker in workers.values():
+            worker.check()
+
+            if worker.seen + timeout < now:
+                log.warning('worker %s timed out', worker.pid)
+                worker.signal(signal.SIGKILL)
+
+    log.info('stopping %s workers', len(workers))
+
+    for worker in list(workers.values()) + list(retiring.values()):
+        worker.signal(signal.SIGTERM)
+
+    deadline = time.time() + app.config['GRACEFUL_TIMEOUT'] + 1
+    while time.time() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+
+        if pid == 0:
+            time.sleep(0.1)
+
+    for worker in list(workers.values()) + list(retiring.values()):
+        worker.signal(signal.SIGKILL)
 
 
 def main():
-    server = HTTPServer(WSGIContainer(app))
-    server.listen(8080)
-    IOLoop.instance().start()
+    logging.basicConfig(level=logging.INFO)
+
+    sockets = bind_sockets(app.config['LISTEN_PORT'], app.config['LISTEN_ADDRESS'])
+
+    # built before forking so the workers start with it
+    with app.app_context():
+        search.build()
+
+    count = app.config['WORKERS'] or multiprocessing.cpu_count()
+
+    if count == 1:
+        serve(sockets)
+    else:
+        supervise(sockets, count)
 
 
 if __name__ == '__main__':